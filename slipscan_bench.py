@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ==========================================================
+# Slipstreamplus-CLI offline benchmark
+# ==========================================================
+# - Fake DNS responder on UDP/53 for the whole loopback range (Linux routes all of 127/8 to lo);
+#   replies leave from the queried address via IP_PKTINFO, like a real resolver
+# - Stub slipstream-client (this file in 'stub-client' mode) relaying SOCKS5 to a local HTTPS endpoint
+# - Drives `slipscan_cli.py scan` / `realtest` end to end and reports probes/s, realtests/min,
+#   per-probe overhead (reported RTT minus injected delay), peak RSS and CPU of the CLI process
+# - --save / --compare keep JSON baselines so regressions show up between commits
+# - Linux only; binding port 53 needs root or CAP_NET_BIND_SERVICE. Next to a resolver that holds
+#   127.0.0.53:53 (systemd-resolved) or similar, --bind-targets binds only the --targets addresses
+
+import argparse
+import errno
+import heapq
+import ipaddress
+import json
+import os
+import platform
+import random
+import resource
+import selectors
+import shutil
+import signal
+import socket
+import ssl
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "slipscan_cli.py")
+
+_IP_PKTINFO = getattr(socket, "IP_PKTINFO", 8)
+_SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+_RCODES = {"ok": 0, "servfail": 2, "nx": 3, "refused": 5}
+_BIND_MAX = 4096       # --bind-targets: one socket per address
+
+
+# ========================= Fake DNS responder =========================
+# - Behaviour is fixed per queried address (hash of address + seed), so repeat runs see the same mix
+# - Loss is per packet; delay = --latency-ms plus an exponential tail with mean --jitter-ms
+# - Per address the responder keeps kernel-receive -> send time (SO_TIMESTAMPNS), i.e. the injected delay
+#   plus its own queueing, so the harness can subtract everything that isn't the scanner's
+# - Listens on 0.0.0.0:53 (the queried address comes from IP_PKTINFO), or with bind= on one socket
+#   per given address, which leaves port 53 on other loopback addresses to a local resolver
+
+def _parse_mix(v: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in v.split(","):
+        name, _, w = part.partition("=")
+        name = name.strip().lower()
+        if name not in _RCODES and name != "drop":
+            raise argparse.ArgumentTypeError(f"unknown mix entry {name!r} (use ok, nx, refused, servfail, drop)")
+        mix.append((name, float(w or 1)))
+    total = sum(w for _, w in mix)
+    if total <= 0:
+        raise argparse.ArgumentTypeError("mix weights must add up to more than 0")
+    acc = 0.0
+    out = []
+    for name, w in mix:
+        acc += w / total
+        out.append((name, acc))
+    return out
+
+class _FakeDns:
+    def __init__(self, mix: List[Tuple[str, float]], latency_ms: float, jitter_ms: float, loss: float, seed: int,
+                 bind: Optional[List[str]] = None):
+        self.mix = mix
+        self.latency = max(0.0, latency_ms) / 1000.0
+        self.jitter = max(0.0, jitter_ms) / 1000.0
+        self.loss = max(0.0, min(1.0, loss))
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.delays: Dict[str, float] = {}   # address -> responder-side ms (kernel rx to send) of its last reply
+        self.heap: list = []
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.stopped = False
+        self.received = 0
+        self.sel = selectors.DefaultSelector()
+        self.socks: List[socket.socket] = []
+        try:
+            for addr in bind or [None]:
+                self._listen(addr)
+        except OSError:
+            self.close()
+            raise
+
+    def _listen(self, addr: Optional[str]) -> None:
+        # data = the address this socket answers for; None: wildcard, read it from IP_PKTINFO
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socks.append(sock)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, (8 << 20) if addr is None else (256 << 10))
+        if addr is None:
+            sock.setsockopt(socket.IPPROTO_IP, _IP_PKTINFO, 1)
+        sock.setsockopt(socket.SOL_SOCKET, _SO_TIMESTAMPNS, 1)
+        sock.bind((addr or "0.0.0.0", 53))
+        sock.setblocking(False)
+        self.sel.register(sock, selectors.EVENT_READ, addr)
+
+    def behaviour(self, addr: str) -> str:
+        h = ((struct.unpack("!I", socket.inet_aton(addr))[0] ^ self.seed) * 2654435761) & 0xFFFFFFFF
+        x = h / 4294967296.0
+        for name, edge in self.mix:
+            if x < edge:
+                return name
+        return self.mix[-1][0]
+
+    def start(self) -> None:
+        threading.Thread(target=self._recv_loop, daemon=True).start()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def _recv_loop(self) -> None:
+        while not self.stopped:
+            try:
+                ready = self.sel.select(0.2)
+            except (OSError, ValueError):
+                return
+            for key, _ in ready:
+                while not self.stopped:
+                    try:
+                        data, anc, _, src = key.fileobj.recvmsg(4096, socket.CMSG_SPACE(12) + socket.CMSG_SPACE(16))
+                    except OSError:
+                        break
+                    self._on_query(key.fileobj, key.data, data, anc, src)
+
+    def _on_query(self, sock: socket.socket, dst: Optional[str], data: bytes, anc: list, src) -> None:
+        rx = time.time()
+        info = None
+        for lvl, typ, d in anc:
+            if lvl == socket.IPPROTO_IP and typ == _IP_PKTINFO:
+                dst = socket.inet_ntoa(d[8:12])
+                info = struct.pack("@i4s4s", 0, d[8:12], d[8:12])
+            elif lvl == socket.SOL_SOCKET and typ == _SO_TIMESTAMPNS:
+                sec, nsec = struct.unpack("@qq", d[:16])
+                rx = sec + nsec / 1e9
+        if dst is None or len(data) < 12:
+            return
+        self.received += 1
+        kind = self.behaviour(dst)
+        if kind == "drop" or (self.loss and self.rng.random() < self.loss):
+            return
+        resp = bytearray(data)
+        resp[2] = 0x81
+        resp[3] = 0x80 | _RCODES[kind]
+        delay = self.latency + (self.rng.expovariate(1.0 / self.jitter) if self.jitter else 0.0)
+        pkt = (sock, bytes(resp), info, src, dst, rx)
+        if delay <= 0:
+            self._send(pkt)
+            return
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (time.monotonic() + delay, self.seq, pkt))
+            self.cond.notify()
+
+    def _send_loop(self) -> None:
+        while True:
+            with self.cond:
+                while not self.stopped and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    self.cond.wait(max(0.0005, self.heap[0][0] - time.monotonic()) if self.heap else 0.2)
+                if self.stopped:
+                    return
+                _, _, pkt = heapq.heappop(self.heap)
+            self._send(pkt)
+
+    def _send(self, pkt: tuple) -> None:
+        sock, resp, info, src, dst, rx = pkt
+        try:
+            # a wildcard socket answers from the queried address via IP_PKTINFO; a bound one already does
+            sock.sendmsg([resp], [(socket.IPPROTO_IP, _IP_PKTINFO, info)] if info else [], 0, src)
+        except OSError:
+            return
+        self.delays[dst] = (time.time() - rx) * 1000.0
+
+    def close(self) -> None:
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for sock in self.socks:
+            sock.close()
+        self.sel.close()
+
+
+# ========================= RealPing endpoint + stub client =========================
+# - One local HTTP/1.1 keep-alive server answering 204 (HTTPS when openssl can make a throwaway cert)
+# - The stub is installed as an executable 'slipstream-client' wrapper in a temp dir and re-enters this
+#   file; it prints "Connection ready" after --ready-s and relays every SOCKS5 CONNECT to the endpoint
+
+class _NoContent(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *a):
+        pass
+
+def _start_endpoint(workdir: str) -> Tuple[ThreadingHTTPServer, str]:
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _NoContent)
+    srv.daemon_threads = True
+    scheme = "http"
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    if shutil.which("openssl"):
+        r = subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+                            "-subj", "/CN=bench.local", "-keyout", key, "-out", cert],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if r.returncode == 0:
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(cert, key)
+            srv.socket = ctx.wrap_socket(srv.socket, server_side=True)
+            scheme = "https"
+    if scheme == "http":
+        print("WARN: openssl not found, RealPing runs over plain HTTP (no TLS in the numbers)", file=sys.stderr)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"{scheme}://bench.local:{srv.server_address[1]}/generate_204"
+
+def _install_stub(workdir: str, upstream_port: int, ready_s: float) -> str:
+    path = os.path.join(workdir, "slipstream-client")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#!/bin/sh\n")
+        f.write(f'BENCH_UPSTREAM_PORT={upstream_port} BENCH_READY_S={ready_s} '
+                f'exec "{sys.executable}" "{os.path.abspath(__file__)}" stub-client "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def _relay(a: socket.socket, b: socket.socket) -> None:
+    try:
+        while True:
+            d = a.recv(65536)
+            if not d:
+                break
+            b.sendall(d)
+    except OSError:
+        pass
+    try:
+        b.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+def _socks_session(c: socket.socket, upstream_port: int) -> None:
+    try:
+        hdr = c.recv(2)
+        c.recv(hdr[1])
+        c.sendall(b"\x05\x00")
+        req = c.recv(4)
+        atyp = req[3]
+        if atyp == 1:
+            c.recv(4)
+        elif atyp == 3:
+            c.recv(c.recv(1)[0])
+        else:
+            c.recv(16)
+        c.recv(2)
+        u = socket.create_connection(("127.0.0.1", upstream_port))
+        c.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+    except (OSError, IndexError):
+        c.close()
+        return
+    threading.Thread(target=_relay, args=(u, c), daemon=True).start()
+    _relay(c, u)
+
+def cmd_stub_client(args: argparse.Namespace) -> int:
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    upstream = int(os.environ.get("BENCH_UPSTREAM_PORT", "0"))
+    time.sleep(float(os.environ.get("BENCH_READY_S", "0.3")))
+    ls = socket.socket()
+    ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ls.bind(("127.0.0.1", args.tcp_listen_port))
+    ls.listen(16)
+    print("Connection ready", flush=True)
+    while True:
+        c, _ = ls.accept()
+        threading.Thread(target=_socks_session, args=(c, upstream), daemon=True).start()
+
+
+# ========================= Harness =========================
+
+def _pct(vals: List[float], q: float) -> float:
+    if not vals:
+        return -1.0
+    vals = sorted(vals)
+    return round(vals[min(len(vals) - 1, int(q * len(vals)))], 2)
+
+def _run_cli(argv: List[str], workdir: str, name: str) -> dict:
+    # the CLI's own rusage (wait4), not the harness': peak RSS and user+sys CPU
+    out_path = os.path.join(workdir, f"{name}.out")
+    err_path = os.path.join(workdir, f"{name}.err")
+    t0 = time.monotonic()
+    with open(out_path, "w") as out, open(err_path, "w") as err:
+        proc = subprocess.Popen([sys.executable, CLI] + argv, stdout=out, stderr=err)
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.monotonic() - t0
+    if proc.returncode != 0:
+        with open(err_path, encoding="utf-8", errors="replace") as f:
+            raise RuntimeError(f"{name}: slipscan_cli exited {proc.returncode}\n{f.read()[-2000:]}")
+    return {"wall_s": round(wall, 3), "cpu_s": round(ru.ru_utime + ru.ru_stime, 3),
+            "peak_rss_mb": round(ru.ru_maxrss / 1024.0, 1)}
+
+def _read_records(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def bench_scan(args: argparse.Namespace, dns: _FakeDns, workdir: str, engine: str) -> dict:
+    name = f"scan-{engine}"
+    rec_path = os.path.join(workdir, f"{name}.jsonl")
+    dns.delays.clear()
+    # "event-mmsg" / "event-plain" pin the event engine's --udp-io
+    engine, _, udp_io = engine.partition("-")
+    res = _run_cli(["scan", "--domain", "bench.test", "--targets", args.targets, "--engine", engine,
+                    "--threads", str(args.threads), "--timeout-ms", str(args.timeout_ms), "--procs", "1",
+                    "--results-out", rec_path] + (["--udp-io", udp_io] if udp_io else []), workdir, name)
+    recs = _read_records(rec_path)
+    overhead = [r["ms"] - dns.delays[r["ip"]] for r in recs if r.get("ms") is not None and r["ip"] in dns.delays]
+    res.update({
+        "probes": len(recs),
+        "replies": sum(1 for r in recs if r.get("ms") is not None),
+        "probes_per_s": round(len(recs) / res["wall_s"], 1),
+        "overhead_p50_ms": _pct(overhead, 0.50),
+        "overhead_p99_ms": _pct(overhead, 0.99),
+    })
+    return res
+
+def bench_realtest(args: argparse.Namespace, dns: _FakeDns, workdir: str, url: str, stub: str) -> dict:
+    name = "realtest"
+    net = args.targets.split("/")[0]
+    base = struct.unpack("!I", socket.inet_aton(net))[0]
+    ips = []
+    for n in range(1, 1 << 16):
+        ip = socket.inet_ntoa(struct.pack("!I", base + n))
+        if dns.behaviour(ip) in ("ok", "nx"):
+            ips.append(ip)
+            if len(ips) >= args.realtests:
+                break
+    list_path = os.path.join(workdir, "realtest-ips.txt")
+    with open(list_path, "w") as f:
+        f.write("\n".join(ips) + "\n")
+    rec_path = os.path.join(workdir, f"{name}.jsonl")
+    argv = ["realtest", "--domain", "bench.test", "--file", list_path, "--slipstream-path", stub,
+            "--parallel", str(args.parallel), "--url", url, "--timeout-s", "10", "--ready-timeout-ms", "5000",
+            "--results-out", rec_path]
+    if url.startswith("https"):
+        argv.append("--insecure")
+    res = _run_cli(argv, workdir, name)
+    recs = _read_records(rec_path)
+    ok_ms = [r["ms"] for r in recs if r.get("ms") is not None]
+    res.update({
+        "realtests": len(recs),
+        "ok": len(ok_ms),
+        "realtests_per_min": round(len(recs) * 60.0 / res["wall_s"], 1),
+        "realping_p50_ms": _pct(ok_ms, 0.50),
+    })
+    return res
+
+# higher is better for these; every other compared metric is lower-is-better
+_HIGHER_BETTER = ("probes_per_s", "realtests_per_min")
+_COMPARED = ("probes_per_s", "realtests_per_min", "overhead_p99_ms", "peak_rss_mb", "cpu_s")
+
+def _compare(base: dict, cur: dict, tolerance: float) -> int:
+    regressions = 0
+    for name, now in cur.items():
+        old = base.get(name)
+        if not old:
+            print(f"{name:14s} (no baseline)")
+            continue
+        for key in _COMPARED:
+            if key not in now or key not in old or old[key] <= 0:
+                continue
+            change = (now[key] - old[key]) / old[key]
+            worse = -change if key in _HIGHER_BETTER else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            regressions += bool(flag)
+            print(f"{name:14s} {key:18s} {old[key]:>10} -> {now[key]:>10}  {change:+.1%} {flag}".rstrip())
+    return regressions
+
+def _fmt_result(name: str, r: dict) -> str:
+    if "probes_per_s" in r:
+        head = (f"probes/s={r['probes_per_s']}  replies={r['replies']}/{r['probes']}  "
+                f"overhead p50={r['overhead_p50_ms']}ms p99={r['overhead_p99_ms']}ms")
+    else:
+        head = f"realtests/min={r['realtests_per_min']}  ok={r['ok']}/{r['realtests']}  p50={r['realping_p50_ms']}ms"
+    return f"{name:14s} {head}  rss={r['peak_rss_mb']}MB  cpu={r['cpu_s']}s  wall={r['wall_s']}s"
+
+def cmd_run(args: argparse.Namespace) -> int:
+    if not sys.platform.startswith("linux"):
+        print("ERROR: the fake resolver needs Linux (whole 127/8 on lo + IP_PKTINFO)", file=sys.stderr)
+        return 2
+    bind = None
+    if args.bind_targets:
+        try:
+            net = ipaddress.ip_network(args.targets, strict=False)
+        except ValueError as e:
+            print(f"ERROR: --targets: {e}", file=sys.stderr)
+            return 2
+        if net.version != 4 or net.num_addresses > _BIND_MAX:
+            print(f"ERROR: --bind-targets needs an IPv4 --targets of at most {_BIND_MAX} addresses "
+                  f"(e.g. 127.1.0.0/20)", file=sys.stderr)
+            return 2
+        bind = [str(a) for a in net]
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        want = len(bind) + 256
+        if soft < want and (hard == resource.RLIM_INFINITY or hard >= want):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+    try:
+        dns = _FakeDns(args.mix, args.latency_ms, args.jitter_ms, args.loss, args.seed, bind)
+    except OSError as e:
+        where = "0.0.0.0" if bind is None else "the --targets addresses"
+        if e.errno in (errno.EACCES, errno.EPERM):
+            hint = "run as root or grant CAP_NET_BIND_SERVICE"
+        elif e.errno == errno.EADDRINUSE:
+            hint = ("something already listens on port 53 (systemd-resolved, dnsmasq, ...); use --bind-targets "
+                    "with a 127.x range it doesn't hold" if bind is None else
+                    "something already listens on port 53 there; pick another 127.x range")
+        else:
+            hint = "check the address and open-file limits"
+        print(f"ERROR: cannot bind UDP/53 on {where}: {errno.errorcode.get(e.errno, e.errno)} {e.strerror}; {hint}",
+              file=sys.stderr)
+        return 2
+    dns.start()
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="slipbench-")
+    try:
+        for engine in args.engines:
+            results[f"scan-{engine}"] = bench_scan(args, dns, workdir, engine)
+            print(_fmt_result(f"scan-{engine}", results[f"scan-{engine}"]))
+        if args.realtests > 0:
+            srv, url = _start_endpoint(workdir)
+            stub = _install_stub(workdir, srv.server_address[1], args.ready_s)
+            try:
+                results["realtest"] = bench_realtest(args, dns, workdir, url, stub)
+            finally:
+                srv.shutdown()
+            print(_fmt_result("realtest", results["realtest"]))
+    except RuntimeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    finally:
+        dns.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"Run files kept in {workdir}", file=sys.stderr)
+
+    if args.save:
+        doc = {
+            "meta": {
+                "time": int(time.time()), "python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(), "argv": sys.argv[1:],
+            },
+            "results": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print(f"Baseline saved to {args.save}", file=sys.stderr)
+    if args.compare:
+        try:
+            with open(args.compare, encoding="utf-8") as f:
+                base = json.load(f)["results"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ERROR: cannot read baseline {args.compare}: {e}", file=sys.stderr)
+            return 2
+        if _compare(base, results, args.tolerance):
+            return 1
+    return 0
+
+
+# ========================= CLI =========================
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="slipscan_bench", description="Offline benchmark for slipscan_cli.py")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="Start the fake resolver/endpoint and benchmark scan + realtest")
+    r.add_argument("--targets", default="127.1.0.0/18", help="Loopback CIDR to scan (default 127.1.0.0/18)")
+    r.add_argument("--bind-targets", action="store_true",
+                   help=f"Bind the fake resolver on each --targets address instead of 0.0.0.0:53, so it can run next to "
+                        f"systemd-resolved or dnsmasq --bind-interfaces (at most {_BIND_MAX} addresses)")
+    r.add_argument("--engines", type=lambda v: [e.strip() for e in v.split(",") if e.strip()],
+                   default=["threads", "event"], help="Scan engines to run, comma separated; event-mmsg / event-plain pick --udp-io (default threads,event)")
+    r.add_argument("--threads", type=int, default=200, help="--threads for the threads engine (default 200)")
+    r.add_argument("--timeout-ms", type=int, default=500, help="Scan probe timeout (default 500)")
+    r.add_argument("--mix", type=_parse_mix, default=_parse_mix("nx=60,ok=10,refused=10,drop=20"),
+                   help="Resolver behaviour weights over ok,nx,refused,servfail,drop (default nx=60,ok=10,refused=10,drop=20)")
+    r.add_argument("--latency-ms", type=float, default=2.0, help="Base reply delay (default 2)")
+    r.add_argument("--jitter-ms", type=float, default=3.0, help="Mean of the exponential extra delay (default 3)")
+    r.add_argument("--loss", type=float, default=0.01, help="Per-packet drop probability on replying addresses (default 0.01)")
+    r.add_argument("--seed", type=int, default=1, help="Seed for behaviour, loss and delays (default 1)")
+    r.add_argument("--realtests", type=int, default=40, help="Addresses to realtest, 0 = skip (default 40)")
+    r.add_argument("--parallel", type=int, default=8, help="realtest --parallel (default 8)")
+    r.add_argument("--ready-s", type=float, default=0.3, help="Stub slipstream-client startup delay (default 0.3)")
+    r.add_argument("--save", default="", help="Write results as a JSON baseline")
+    r.add_argument("--compare", default="", help="Compare against a saved baseline; exit 1 on regression")
+    r.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change before flagging (default 0.15)")
+    r.add_argument("--keep", action="store_true", help="Keep the temp dir with CLI output and records")
+    r.set_defaults(func=cmd_run)
+
+    s = sub.add_parser("stub-client", help=argparse.SUPPRESS)
+    s.add_argument("--resolver", default="")
+    s.add_argument("--domain", default="")
+    s.add_argument("--tcp-listen-port", type=int, required=True)
+    s.set_defaults(func=cmd_stub_client)
+
+    return p
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return int(args.func(args))
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,18 +2,38 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import base64
+import contextlib
+import cProfile
+import csv
+import ctypes
+import errno
+import hashlib
+import heapq
 import ipaddress
+import json
+import mmap
+import multiprocessing
 import os
+import pstats
 import random
+import selectors
 import socket
+import sqlite3
 import ssl
+import struct
 import subprocess
 import sys
 import threading
 import time
+import tracemalloc
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from collections import deque
-from queue import Queue, Empty
-from typing import Iterable, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty, Full
+from typing import Callable, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 from rich.console import Console
 from rich.live import Live
@@ -70,130 +90,698 @@ def _iter_clean_tokens(lines: Iterable[str]) -> Iterable[str]:
             if t:
                 yield t
 
-def _file_has_plain_ip(path: str) -> bool:
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            for t in _iter_clean_tokens(f):
-                k, v = _parse_token(t)
-                if k == "ip" and v:
-                    return True
-    except Exception:
-        pass
-    return False
+# ========================= Target plan (uint32 ranges) =========================
+# - Input is parsed once into (base, span) uint32 ranges; no per-address ipaddress objects
+# - Every range contributes `slots` targets: all of it, or --random-per-cidr samples
+# - Global slot g -> range via bisect on the cumulative slot counts
+# - Sampled ranges pick offsets through a keyed Feistel bijection (first k of a permutation);
+#   when the parsed ranges overlap, the picks are deduplicated into single-address slots up front
+# - "permuted" order walks all slots through a cyclic group (x -> x*g mod p), like masscan
+# - Dotted strings are only built at the socket boundary
 
+def _ip_to_int(ip: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip), "big")
 
-# ========================= CIDR Random like GUI =========================
+def _int_to_ip(x: int) -> str:
+    return socket.inet_ntoa(x.to_bytes(4, "big"))
 
-def _cidr_sample_ips(cidr: str, k: int) -> List[str]:
+def _is_prime(n: int) -> bool:
+    if n < 2:
+        return False
+    for q in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        if n % q == 0:
+            return n == q
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    # deterministic for n < 3.3e24 with these bases
+    for a in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def _next_prime(n: int) -> int:
+    while not _is_prime(n):
+        n += 1
+    return n
+
+def _prime_factors(n: int) -> List[int]:
+    out = []
+    q = 2
+    while q * q <= n:
+        if n % q == 0:
+            out.append(q)
+            while n % q == 0:
+                n //= q
+        q += 1 if q == 2 else 2
+    if n > 1:
+        out.append(n)
+    return out
+
+def _feistel(x: int, n: int, key: int) -> int:
+    # keyed bijection on [0, n): 3-round balanced Feistel over the next even power of two, cycle-walking back into range
+    if n <= 1:
+        return 0
+    half = ((n - 1).bit_length() + 1) >> 1
+    mask = (1 << half) - 1
+    k1, k2, k3 = key & 0xFFFFFFFF, (key >> 11) ^ 0x5BD1E995, (key >> 22) ^ 0x1B873593
+    while True:
+        l, r = x >> half, x & mask
+        l, r = r, l ^ ((((r ^ k1) * 0x9E3779B1) >> 7) & mask)
+        l, r = r, l ^ ((((r ^ k2) * 0x85EBCA6B) >> 9) & mask)
+        l, r = r, l ^ ((((r ^ k3) * 0xC2B2AE35) >> 5) & mask)
+        x = (l << half) | r
+        if x < n:
+            return x
+
+
+def _parse_cidr4(v: str) -> Optional[Tuple[int, int]]:
+    # (network base, size) for an IPv4 CIDR; fast path for plain a.b.c.d/nn, ipaddress for the rest
+    addr, _, plen = v.partition("/")
+    if addr.count(".") == 3 and plen.isdigit() and int(plen) <= 32:
+        try:
+            x = int.from_bytes(socket.inet_aton(addr), "big")
+        except OSError:
+            x = -1
+        if x >= 0 and all(p.isdigit() and len(p) <= 3 and (p == "0" or p[0] != "0") for p in addr.split(".")):
+            size = 1 << (32 - int(plen))
+            return x & ~(size - 1) & 0xFFFFFFFF, size
     try:
-        net = ipaddress.ip_network(cidr, strict=False)
+        net = ipaddress.ip_network(v, strict=False)
     except Exception:
-        return []
+        return None
     if net.version != 4:
-        return []
-    total = int(net.num_addresses)
-    if total <= 0:
-        return []
-    k = min(max(0, int(k)), total)
-    if k <= 0:
-        return []
-    picks = random.sample(range(0, total), k)
-    return [str(net.network_address + int(off)) for off in picks]
-
-
-# ========================= Count total (GUI-like) =========================
-
-def _count_targets_in_lines(lines: Iterable[str], use_random: bool, random_k: int) -> int:
-    total = 0
-    for t in _iter_clean_tokens(lines):
-        k, v = _parse_token(t)
+        return None
+    return int(net.network_address), int(net.num_addresses)
+
+
+class _TargetPlan:
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = random.randrange(1 << 32) if seed is None else int(seed) & 0xFFFFFFFF
+        self.base = array("I")      # parsed ranges (sorted, exact duplicates dropped by finalize)
+        self.span = array("Q")      # addresses in range
+        self.mbase = array("I")     # interval union of the parsed ranges, used for full expansion
+        self.mspan = array("Q")
+        self.mcum = array("Q", [0])
+        self.overlap = False        # parsed ranges overlap, so sampled picks may coincide
+        self.abase = self.mbase     # active ranges for the current sampling mode
+        self.aspan = self.mspan
+        self.cum = self.mcum        # cumulative target slots of the active ranges, len = ranges + 1
+        self.singles = 0
+        self.random_k = 0
+
+    def __getstate__(self) -> dict:
+        # views over a mapped index (_load_index) can't be pickled; --procs children get array copies
+        state = dict(self.__dict__)
+        copies = {}     # abase/cum alias mbase/mcum: copy each view once
+        for k, v in state.items():
+            if isinstance(v, memoryview):
+                if id(v) not in copies:
+                    copies[id(v)] = array(v.format)
+                    copies[id(v)].frombytes(v.cast("B"))
+                state[k] = copies[id(v)]
+        return state
+
+    @property
+    def has_single(self) -> bool:
+        return self.singles > 0
+
+    @property
+    def total(self) -> int:
+        return int(self.cum[-1])
+
+    def add_token(self, tok: str) -> None:
+        k, v = _parse_token(tok)
         if k == "ip" and v:
-            total += 1
-        elif k == "cidr" and v:
             try:
-                net = ipaddress.ip_network(v, strict=False)
-                if net.version != 4:
-                    continue
-                n = int(net.num_addresses)
-                total += min(random_k, n) if (use_random and random_k > 0) else n
-            except Exception:
+                self.base.append(_ip_to_int(v))
+            except OSError:
+                return  # IPv6: probes are IPv4/UDP only
+            self.span.append(1)
+            self.singles += 1
+        elif k == "cidr" and v:
+            r = _parse_cidr4(v)
+            if r is None:
+                return
+            self.base.append(r[0])
+            self.span.append(r[1])
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[str], seed: Optional[int] = None) -> "_TargetPlan":
+        plan = cls(seed)
+        for t in tokens:
+            plan.add_token(t)
+        plan.finalize()
+        return plan
+
+    def subset(self, ips: Iterable[int]) -> "_TargetPlan":
+        # those of the given addresses that fall inside the target union, as a new plan (same seed)
+        sub = _TargetPlan(self.seed)
+        for x in ips:
+            i = bisect_right(self.mbase, x) - 1
+            if i >= 0 and x < self.mbase[i] + self.mspan[i]:
+                sub.base.append(x)
+                sub.span.append(1)
+        sub.singles = len(sub.base)
+        sub.finalize()
+        return sub
+
+    @classmethod
+    def from_file(cls, path: str, seed: Optional[int] = None) -> "_TargetPlan":
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return cls.from_tokens(_iter_clean_tokens(f), seed)
+
+    def finalize(self) -> None:
+        # sort, drop repeated ranges, and build the overlap/adjacency-merged union
+        pairs = sorted(set(zip(self.base, self.span)))
+        self.base = array("I", (b for b, _ in pairs))
+        self.span = array("Q", (n for _, n in pairs))
+        mbase = array("I")
+        mspan = array("Q")
+        mcum = array("Q", [0])
+        overlap = False
+        cur_b = cur_e = -1          # current union interval [cur_b, cur_e)
+        acc = 0
+        for b, n in pairs:
+            if b < cur_e:
+                overlap = True
+            if b <= cur_e:
+                cur_e = max(cur_e, b + n)
                 continue
-    return total
+            if cur_b >= 0:
+                mbase.append(cur_b)
+                mspan.append(cur_e - cur_b)
+                acc += cur_e - cur_b
+                mcum.append(acc)
+            cur_b, cur_e = b, b + n
+        if cur_b >= 0:
+            mbase.append(cur_b)
+            mspan.append(cur_e - cur_b)
+            mcum.append(acc + cur_e - cur_b)
+        self.mbase, self.mspan, self.mcum = mbase, mspan, mcum
+        self.overlap = overlap
+        self.set_sampling(self.random_k)
+
+    def set_sampling(self, random_k: int) -> None:
+        self.random_k = max(0, int(random_k))
+        if self.random_k == 0:
+            self.abase, self.aspan, self.cum = self.mbase, self.mspan, self.mcum
+            return
+        cum = array("Q", [0])
+        acc = 0
+        for n in self.span:
+            acc += min(self.random_k, n)
+            cum.append(acc)
+        self.abase, self.aspan, self.cum = self.base, self.span, cum
+        if self.overlap:
+            # overlapping networks can pick the same address: collapse the picks once into a sorted
+            # list of single addresses, so every walker (and every --procs shard) sees each one once
+            picks = array("I", _IpSet(self.addr(g) for g in range(acc)))
+            self.abase, self.aspan = picks, array("Q", [1]) * len(picks)
+            self.cum = array("Q", range(len(picks) + 1))
+
+    def addr(self, g: int) -> int:
+        i = bisect_right(self.cum, g) - 1
+        j = g - self.cum[i]
+        n = self.aspan[i]
+        if self.cum[i + 1] - self.cum[i] < n:
+            j = _feistel(j, n, self.seed ^ ((i * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFF))
+        return self.abase[i] + j
+
+    def _cyclic(self) -> Tuple[int, int, int]:
+        # prime p > total and a primitive root g: x -> x*g mod p visits 1..p-1 exactly once
+        rng = random.Random(self.seed)
+        p = _next_prime(self.total + 1)
+        if p <= 3:
+            return p, p - 1, 1
+        factors = _prime_factors(p - 1)
+        while True:
+            g = rng.randrange(2, p)
+            if all(pow(g, (p - 1) // q, p) != 1 for q in factors):
+                return p, g, rng.randrange(1, p)
+
+    def iter_addrs(self, stop_evt: threading.Event, order: str = "permuted",
+                   shard: Tuple[int, int] = (0, 1), skip: int = 0) -> Iterable[int]:
+        # Yields target tags, (position << 32) | address. Positions are dense per shard:
+        # shard=(i, n) gets i, i+n, i+2n, ... so n walkers cover the plan exactly once, and
+        # skip=s resumes at the shard's s-th target (the checkpoint cursor's watermark).
+        shard_i, shard_n = shard
+        total = self.total
+        addr = self.addr
+        pos = shard_i + skip * shard_n
+        if order != "permuted":
+            # sequential: ascending address order
+            for g in range(pos, total, shard_n):
+                if stop_evt.is_set():
+                    return
+                yield (g << 32) | addr(g)
+            return
+        p, g, x0 = self._cyclic()
+        step = pow(g, shard_n, p)
+        x = x0 * pow(g, shard_i, p) % p
+        k = shard_i
+        # fast-forward: walk values > total yield nothing, so resuming has to re-walk the cycle
+        while skip > 0 and k < p - 1:
+            if x <= total:
+                skip -= 1
+            x = x * step % p
+            k += shard_n
+        n = 0
+        for k in range(k, p - 1, shard_n):
+            n += 1
+            if (n & 0xFFF) == 0 and stop_evt.is_set():
+                return
+            if x <= total:
+                yield (pos << 32) | addr(x - 1)
+                pos += shard_n
+            x = x * step % p
+
+
+# ========================= Compact IPv4 set =========================
+# Roaring-style: one container per /16, a sorted array('H') of low halves until it
+# holds 4096 members, then an 8 KiB bitmap. ~2 bytes per member when sparse, and at
+# most 512 MiB even if every IPv4 address is added.
+
+class _IpSet:
+    __slots__ = ("_c", "_n")
+
+    _ARRAY_MAX = 4096
+
+    def __init__(self, items: Iterable[int] = ()):
+        self._c = {}
+        self._n = 0
+        for x in items:
+            self.add(x)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __contains__(self, x: int) -> bool:
+        c = self._c.get(x >> 16)
+        if c is None:
+            return False
+        lo = x & 0xFFFF
+        if type(c) is bytearray:
+            return bool(c[lo >> 3] & (1 << (lo & 7)))
+        i = bisect_left(c, lo)
+        return i < len(c) and c[i] == lo
+
+    def add(self, x: int) -> bool:
+        # True if x was not yet present
+        hi, lo = x >> 16, x & 0xFFFF
+        c = self._c.get(hi)
+        if c is None:
+            self._c[hi] = array("H", [lo])
+            self._n += 1
+            return True
+        if type(c) is bytearray:
+            bit = 1 << (lo & 7)
+            if c[lo >> 3] & bit:
+                return False
+            c[lo >> 3] |= bit
+            self._n += 1
+            return True
+        i = bisect_left(c, lo)
+        if i < len(c) and c[i] == lo:
+            return False
+        if len(c) >= self._ARRAY_MAX:
+            bm = bytearray(8192)
+            for v in c:
+                bm[v >> 3] |= 1 << (v & 7)
+            bm[lo >> 3] |= 1 << (lo & 7)
+            self._c[hi] = bm
+        else:
+            c.insert(i, lo)
+        self._n += 1
+        return True
 
-def _count_targets_file(path: str, use_random: bool, random_k: int) -> int:
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return _count_targets_in_lines(f, use_random, random_k)
-    except Exception:
-        return 0
+    def __iter__(self):
+        for hi in sorted(self._c):
+            c = self._c[hi]
+            base = hi << 16
+            if type(c) is bytearray:
+                for i, byte in enumerate(c):
+                    if byte:
+                        for bit in range(8):
+                            if byte & (1 << bit):
+                                yield base | (i << 3) | bit
+            else:
+                for lo in c:
+                    yield base | lo
 
 
-# ========================= Target generator (streaming + GUI behavior) =========================
+class _TargetFilter:
+    # --recheck-known-good narrows the plan itself (_TargetPlan.subset); this only drops addresses
+    __slots__ = ("skip",)
 
-def _iter_targets_file(path: str, stop_evt: threading.Event, use_random: bool, random_k: int) -> Iterable[str]:
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        for t in _iter_clean_tokens(f):
-            if stop_evt.is_set():
-                return
-            k, v = _parse_token(t)
-            if k == "ip" and v:
-                yield v
-            elif k == "cidr" and v:
-                if use_random and random_k > 0:
-                    for ip in _cidr_sample_ips(v, random_k):
-                        if stop_evt.is_set():
-                            return
-                        yield ip
-                else:
-                    # GUI behavior: expand ALL (⚠ huge)
-                    try:
-                        net = ipaddress.ip_network(v, strict=False)
-                    except Exception:
-                        continue
-                    if net.version != 4:
-                        continue
-                    n = int(net.num_addresses)
-                    for off in range(0, n):
-                        if stop_evt.is_set():
-                            return
-                        yield str(net.network_address + int(off))
-
-def _iter_targets_tokens(tokens: List[str], stop_evt: threading.Event, use_random: bool, random_k: int) -> Iterable[str]:
-    for raw in tokens:
-        if stop_evt.is_set():
+    def __init__(self, skip: _IpSet):
+        self.skip = skip    # never probe these
+
+    def allows(self, ip: int) -> bool:
+        return ip not in self.skip
+
+
+def _iter_filtered(tags: Iterable[int], flt: _TargetFilter, on_skip: Callable[[int], None]) -> Iterable[int]:
+    allows = flt.allows
+    for t in tags:
+        if allows(t & 0xFFFFFFFF):
+            yield t
+        else:
+            on_skip(t)
+
+
+# ========================= Adaptive sampling (--probe-budget) =========================
+# - The target union is cut into aligned prefixes of at most /16 (the "arms")
+# - Seed round: _ADAPT_SEED (or --random-per-cidr) samples from every prefix, round-robin in seeded random order
+# - Then each probe goes to the live prefix with the highest optimistic hit rate,
+#   (hits + 2*prior) / (sent + 2) + bonus * sqrt(g / (sent + 1)), g = overall hit rate so far;
+#   unanswered probes count as misses, so in-flight work spreads over several prefixes
+# - A prefix wider than /24 that has hits splits into 16 sub-prefixes (down to /24) once
+#   _ADAPT_SPLIT probes came back; the parent's results are handed down, its hit rate is the prior
+# - A prefix is dropped once it had enough answered probes to expect 3 hits at rate g
+#   (at least _ADAPT_ZERO_STOP) and got none
+# - Addresses are drawn without repeats: keyed Feistel per prefix, plus one seen-set
+# - Addresses in the --db skip set are passed over while drawing, so only probes actually sent use the budget
+
+_ADAPT_ROOT_BITS = 16
+_ADAPT_SEED = 4
+_ADAPT_LEAF_BITS = 8
+_ADAPT_SPLIT = 16
+_ADAPT_ZERO_STOP = 12
+_ADAPT_BONUS = 0.5
+
+class _Arm:
+    __slots__ = ("base", "bits", "drawn", "sent", "done", "hits", "prior", "obs", "kids", "ver", "dead")
+
+    def __init__(self, base: int, bits: int, prior: Optional[float] = None):
+        self.base = base
+        self.bits = bits            # 1 << bits addresses
+        self.drawn = 0              # Feistel counter
+        self.sent = 0
+        self.done = 0               # probes with a result
+        self.hits = 0
+        self.prior = prior          # None: the overall hit rate
+        self.obs = {} if bits > _ADAPT_LEAF_BITS else None    # addr -> hit (None while pending), until split
+        self.kids: Optional[List["_Arm"]] = None
+        self.ver = 0                # heap entries with an older ver are stale
+        self.dead = False
+
+
+class _AdaptiveSampler:
+    def __init__(self, plan: _TargetPlan, budget: int, initial: int, skip: Optional[_IpSet] = None):
+        self.lock = threading.Lock()
+        self.budget = budget
+        self.initial = max(1, initial)
+        self.seed = plan.seed
+        self.seen = _IpSet()
+        self.skip = skip        # --only-stale / --skip-dead-within: never drawn
+        self.roots: List[_Arm] = []
+        for b, n in zip(plan.mbase, plan.mspan):
+            while n > 0:
+                bits = min(_ADAPT_ROOT_BITS, (b & -b).bit_length() - 1 if b else 32, n.bit_length() - 1)
+                self.roots.append(_Arm(b, bits))
+                b += 1 << bits
+                n -= 1 << bits
+        self.root_base = array("I", (a.base for a in self.roots))
+        self.heap: List[tuple] = []
+        self.seq = 0
+        self.live = len(self.roots)
+        self.sent = 0
+        self.done = 0
+        self.hits = 0
+        self.splits = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def _rate(self) -> float:
+        return (self.hits + 1.0) / (self.done + 2)
+
+    def _push(self, arm: _Arm) -> None:
+        arm.ver += 1
+        if arm.dead or arm.kids is not None:
             return
-        k, v = _parse_token(raw)
-        if k == "ip" and v:
-            yield v
-        elif k == "cidr" and v:
-            if use_random and random_k > 0:
-                for ip in _cidr_sample_ips(v, random_k):
-                    if stop_evt.is_set():
-                        return
-                    yield ip
-            else:
-                try:
-                    net = ipaddress.ip_network(v, strict=False)
-                except Exception:
+        g = self._rate()
+        prior = g if arm.prior is None else arm.prior
+        idx = (arm.hits + 2.0 * prior) / (arm.sent + 2) + _ADAPT_BONUS * (g / (arm.sent + 1)) ** 0.5
+        self.seq += 1
+        heapq.heappush(self.heap, (-idx, self.seq, arm.ver, arm))
+        if len(self.heap) > 2 * self.live + 65536:
+            # one current entry per live arm; the rest went stale
+            self.heap = [e for e in self.heap if e[2] == e[3].ver and not e[3].dead and e[3].kids is None]
+            heapq.heapify(self.heap)
+
+    def _retire(self, arm: _Arm) -> None:
+        arm.dead = True
+        self.live -= 1
+
+    def _take(self, arm: _Arm) -> Optional[int]:
+        size = 1 << arm.bits
+        key = self.seed ^ ((arm.base * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFF) ^ arm.bits
+        while arm.drawn < size:
+            ip = arm.base + _feistel(arm.drawn, size, key)
+            arm.drawn += 1
+            if self.seen.add(ip):
+                if self.skip is not None and ip in self.skip:
+                    self.skipped += 1
                     continue
-                if net.version != 4:
+                arm.sent += 1
+                if arm.obs is not None:
+                    arm.obs[ip] = None
+                self.sent += 1
+                self._push(arm)
+                return ip
+        self._retire(arm)
+        return None
+
+    def _leaf(self, ip: int) -> _Arm:
+        arm = self.roots[bisect_right(self.root_base, ip) - 1]
+        while arm.kids is not None:
+            arm = arm.kids[(ip - arm.base) >> arm.kids[0].bits]
+        return arm
+
+    def _split(self, arm: _Arm) -> None:
+        bits = max(_ADAPT_LEAF_BITS, arm.bits - 4)
+        prior = (arm.hits + 1.0) / (arm.done + 2)
+        kids = [_Arm(arm.base + (i << bits), bits, prior) for i in range(1 << (arm.bits - bits))]
+        for ip, hit in arm.obs.items():
+            k = kids[(ip - arm.base) >> bits]
+            k.sent += 1
+            if hit is not None:
+                k.done += 1
+                k.hits += hit
+            if k.obs is not None:
+                k.obs[ip] = hit
+        arm.kids = kids
+        arm.obs = None
+        self.splits += 1
+        self.live += len(kids) - 1
+        for k in kids:
+            self._push(k)
+
+    def observe(self, ip: int, ok: bool) -> None:
+        with self.lock:
+            arm = self._leaf(ip)
+            self.done += 1
+            arm.done += 1
+            if ok:
+                arm.hits += 1
+                self.hits += 1
+            if arm.obs is not None:
+                arm.obs[ip] = ok
+            if arm.dead:
+                return
+            if not arm.hits and arm.done >= max(_ADAPT_ZERO_STOP, 3.0 / self._rate()):
+                self._retire(arm)
+                self.dropped += 1
+            elif arm.hits and arm.obs is not None and arm.done >= _ADAPT_SPLIT:
+                self._split(arm)
+            else:
+                self._push(arm)
+
+    def _pick(self) -> Optional[int]:
+        with self.lock:
+            while self.heap:
+                _, _, ver, arm = heapq.heappop(self.heap)
+                if ver != arm.ver or arm.dead or arm.kids is not None:
                     continue
-                n = int(net.num_addresses)
-                for off in range(0, n):
-                    if stop_evt.is_set():
-                        return
-                    yield str(net.network_address + int(off))
+                ip = self._take(arm)
+                if ip is not None:
+                    return ip
+            return None
+
+    def iter_addrs(self, stop_evt: threading.Event) -> Iterable[int]:
+        # same (position << 32) | address tags as _TargetPlan.iter_addrs; observe() steers what comes next
+        pos = 0
+        order = list(self.roots)
+        random.Random(self.seed).shuffle(order)
+        for _ in range(self.initial):
+            for arm in order:
+                if pos >= self.budget or stop_evt.is_set():
+                    return
+                with self.lock:
+                    ip = None if arm.dead or arm.kids is not None else self._take(arm)
+                if ip is not None:
+                    yield (pos << 32) | ip
+                    pos += 1
+        while pos < self.budget:
+            if (pos & 0xFFF) == 0 and stop_evt.is_set():
+                return
+            ip = self._pick()
+            if ip is None:
+                return
+            yield (pos << 32) | ip
+            pos += 1
+
+    def summary(self) -> str:
+        with self.lock:
+            rate = 100.0 * self.hits / self.sent if self.sent else 0.0
+            line = (f"Adaptive sampling: {self.sent} probes, {self.hits} hits ({rate:.2f}%) | "
+                    f"prefixes={len(self.roots)} splits={self.splits} dropped={self.dropped} live={self.live}")
+            if self.skipped:
+                line += f" skipped={self.skipped}"
+            return line
+
+
+# ========================= Compiled target index =========================
+# <file>.slipidx next to the source: header + little-endian arrays (parsed base u32 /
+# span u64, merged base u32 / span u64 / cumulative u64). Valid while the source
+# size+mtime match, or failing that, its sha256. Loaded through mmap: on little-endian
+# hosts the plan's arrays are memoryviews straight over the map (pages come in as the walk
+# touches them), so repeat scans skip tokenizing and copying entirely.
+
+_IDX_MAGIC = b"SLIPIDX1"
+_IDX_VERSION = 2
+_IDX_HDR = struct.Struct("<8sIQq32sQQQQQ")  # magic, version, src size, src mtime_ns, src sha256, ranges, merged, singles, overlap, total
+
+def _index_path(src: str) -> str:
+    return src + ".slipidx"
+
+def _file_sha256(path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+def _le_bytes(a) -> bytes:
+    if isinstance(a, memoryview):
+        return a.tobytes()      # a view over a loaded index is little-endian already
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def _le_array(typecode: str, buf) -> array:
+    a = array(typecode)
+    a.frombytes(buf)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def _write_index(plan: _TargetPlan, src: str, dst: str, digest: Optional[bytes] = None) -> None:
+    st = os.stat(src)
+    if digest is None:
+        digest = _file_sha256(src)
+    hdr = _IDX_HDR.pack(_IDX_MAGIC, _IDX_VERSION, st.st_size, st.st_mtime_ns, digest,
+                        len(plan.base), len(plan.mbase), plan.singles, int(plan.overlap), int(plan.mcum[-1]))
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(hdr)
+            for a in (plan.base, plan.span, plan.mbase, plan.mspan, plan.mcum):
+                f.write(_le_bytes(a))
+        # Windows refuses to replace a file that is still mapped; the caller keeps the old map
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+def _compile_index(src: str, dst: str) -> _TargetPlan:
+    digest = _file_sha256(src)
+    plan = _TargetPlan.from_file(src)
+    _write_index(plan, src, dst, digest)
+    return plan
+
+def _load_index(src: str, idx: str, seed: Optional[int] = None) -> Optional[_TargetPlan]:
+    try:
+        with open(idx, "rb") as f:
+            # the map stays open for as long as the plan's views reference it
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < _IDX_HDR.size:
+            return None
+        magic, ver, size, mtime_ns, digest, n, m, singles, overlap, total = _IDX_HDR.unpack_from(mm, 0)
+        if magic != _IDX_MAGIC or ver != _IDX_VERSION:
+            return None
+        if len(mm) != _IDX_HDR.size + n * 12 + m * 12 + (m + 1) * 8:
+            return None
+        st = os.stat(src)
+        stale = (st.st_size, st.st_mtime_ns) != (size, mtime_ns)
+        if stale and _file_sha256(src) != digest:
+            return None
+        plan = _TargetPlan(seed)
+        view = memoryview(mm)
+        off = _IDX_HDR.size
+        arrays = []
+        for typecode, count in (("I", n), ("Q", n), ("I", m), ("Q", m), ("Q", m + 1)):
+            width = 4 if typecode == "I" else 8
+            chunk = view[off:off + count * width]
+            arrays.append(chunk.cast(typecode) if sys.byteorder == "little" else _le_array(typecode, chunk))
+            off += count * width
+        plan.base, plan.span, plan.mbase, plan.mspan, plan.mcum = arrays
+        plan.singles = singles
+        plan.overlap = bool(overlap)
+        plan.set_sampling(0)
+    except (OSError, ValueError, struct.error):
+        return None
+    if plan.total != total:
+        return None
+    if stale:
+        # content unchanged (touched/copied file): refresh the size+mtime key
+        try:
+            _write_index(plan, src, idx, digest)
+        except OSError:
+            pass
+    return plan
+
+def _load_plan(src: str, seed: Optional[int] = None, use_cache: bool = True, idx: str = "") -> _TargetPlan:
+    if not use_cache:
+        return _TargetPlan.from_file(src, seed)
+    idx = idx or _index_path(src)
+    plan = _load_index(src, idx, seed)
+    if plan is not None:
+        return plan
+    plan = _TargetPlan.from_file(src, seed)
+    try:
+        _write_index(plan, src, idx)
+    except OSError:
+        pass  # read-only location: just scan without a cache
+    return plan
 
 
 # ========================= Fast DNS tunnel probe =========================
 
-def _encode_dns_query(qname: str) -> bytes:
-    tid = random.randint(0, 0xFFFF)
-    hdr = tid.to_bytes(2, "big") + b"\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00"
+def _encode_dns_query(qname: str, tid: Optional[int] = None, qtype: int = 1, edns: int = 0) -> bytes:
+    # edns > 0 adds an OPT record advertising that UDP payload size
+    if tid is None:
+        tid = random.randint(0, 0xFFFF)
+    hdr = tid.to_bytes(2, "big") + b"\x01\x00\x00\x01\x00\x00\x00\x00\x00" + (b"\x01" if edns else b"\x00")
     body = b""
     for p in qname.strip(".").split("."):
         body += bytes([len(p)]) + p.encode("ascii", "ignore")
-    body += b"\x00\x00\x01\x00\x01"
+    body += b"\x00" + qtype.to_bytes(2, "big") + b"\x00\x01"
+    if edns:
+        body += b"\x00\x00\x29" + edns.to_bytes(2, "big") + b"\x00\x00\x00\x00\x00\x00"
     return hdr + body
 
 def _dns_rcode(resp: bytes) -> Optional[int]:
@@ -201,9 +789,130 @@ def _dns_rcode(resp: bytes) -> Optional[int]:
         return None
     return resp[3] & 0x0F
 
-def fast_dns_tunnel_check(ip: str, domain: str, timeout_ms: int) -> Tuple[bool, str, int]:
-    qname = f"{random.randint(100000, 999999)}.{domain.strip('.')}"
-    payload = _encode_dns_query(qname)
+def _dns_qname(resp: bytes) -> Optional[bytes]:
+    # lowercased wire-format qname of the first question, or None if malformed
+    if len(resp) < 13:
+        return None
+    i = 12
+    end = len(resp)
+    while i < end:
+        n = resp[i]
+        if n == 0:
+            return resp[12:i + 1].lower()
+        if n & 0xC0:
+            return None
+        i += 1 + n
+    return None
+
+def _dns_skip_name(resp: bytes, i: int) -> int:
+    # offset just past the (possibly compressed) name at i; raises IndexError on a cut-off packet
+    while True:
+        n = resp[i]
+        if n == 0:
+            return i + 1
+        if n & 0xC0 == 0xC0:
+            return i + 2
+        i += 1 + n
+
+def _dns_has_opt(resp: bytes) -> bool:
+    # whether the additional section carries an EDNS0 OPT record
+    try:
+        qd, an, ns, ar = struct.unpack_from("!HHHH", resp, 4)
+        i = 12
+        for _ in range(qd):
+            i = _dns_skip_name(resp, i) + 4
+        for n in range(an + ns + ar):
+            i = _dns_skip_name(resp, i)
+            rtype, _, _, rdlen = struct.unpack_from("!HHIH", resp, i)
+            if n >= an + ns and rtype == 41:
+                return True
+            i += 10 + rdlen
+    except (IndexError, struct.error):
+        pass
+    return False
+
+def _rcode_status(rcode: Optional[int]) -> Tuple[bool, str]:
+    if rcode is None:
+        return False, "BadResp"
+    # GUI: NOERROR + NXDOMAIN = alive
+    if rcode == 0:
+        return True, "OK (Resolved)"
+    if rcode == 3:
+        return True, "Tunnel Alive (NX)"
+    if rcode == 2:
+        return False, "ServFail"
+    if rcode == 5:
+        return False, "Refused"
+    return False, f"RCODE {rcode}"
+
+# compact status codes for records crossing process boundaries: DNS rcode 0..15, then local outcomes
+# (new outcomes go at the end: the codes are stored in --results-out .bin files and --db)
+_STATUS_TEXT = [_rcode_status(rc)[1] for rc in range(16)] + ["BadResp", "TIMEOUT", "ERROR", "SKIP",
+                                                             "Truncated", "No EDNS", "Truncated (NX)", "No EDNS (NX)"]
+_STATUS_CODE = {t: i for i, t in enumerate(_STATUS_TEXT)}
+# outcomes without any reply; everything else came back from the resolver
+_NO_REPLY_CODES = frozenset(_STATUS_CODE[t] for t in ("TIMEOUT", "ERROR", "SKIP"))
+# DNS rcode behind a status code, where there was one (profile rejections keep the NOERROR/NX they had)
+_STATUS_RCODE = {rc: rc for rc in range(16)}
+_STATUS_RCODE.update({_STATUS_CODE[t]: rc for t, rc in (("Truncated", 0), ("No EDNS", 0),
+                                                        ("Truncated (NX)", 3), ("No EDNS (NX)", 3))})
+
+
+# --probe-profile / --realtest-prefilter: what a probe query looks like.
+# - "a" is the classic short A lookup: cheap, but many resolvers that answer it can't carry a tunnel
+# - "txt"/"null" look like slipstream traffic: that qtype, random labels filling the name up to 253 chars
+#   and EDNS0 with a 1232-byte UDP size. A NOERROR/NX reply only counts if it isn't truncated (TC) and
+#   still has its OPT record; a resolver that mangles the long name never matches and times out
+_QNAME_MAX = 253
+_B32 = "abcdefghijklmnopqrstuvwxyz234567"
+
+class _ProbeProfile:
+    __slots__ = ("name", "qtype", "fill", "edns")
+
+    def __init__(self, name: str, qtype: int, fill: bool = False, edns: int = 0):
+        self.name = name
+        self.qtype = qtype
+        self.fill = fill
+        self.edns = edns
+
+    def suffix(self, domain: str) -> str:
+        # everything after the 6-digit first label; the filler is random per call
+        domain = domain.strip(".")
+        if not self.fill:
+            return domain
+        room = _QNAME_MAX - 7 - len(domain) - 1
+        labels = []
+        while room > 1:
+            n = min(63, room - 1)
+            labels.append("".join(random.choices(_B32, k=n)))
+            room -= n + 1
+        return ".".join(labels + [domain])
+
+    def query(self, domain: str, tid: Optional[int] = None) -> bytes:
+        return _encode_dns_query(f"{random.randint(100000, 999999)}.{self.suffix(domain)}", tid, self.qtype, self.edns)
+
+    def status(self, resp: bytes) -> Tuple[bool, str]:
+        rcode = _dns_rcode(resp)
+        ok, detail = _rcode_status(rcode)
+        if ok and self.fill:
+            nx = " (NX)" if rcode == 3 else ""
+            if resp[2] & 0x02:
+                return False, "Truncated" + nx
+            if self.edns and not _dns_has_opt(resp):
+                return False, "No EDNS" + nx
+        return ok, detail
+
+
+_PROBE_PROFILES = {
+    "a": _ProbeProfile("a", 1),
+    "txt": _ProbeProfile("txt", 16, fill=True, edns=1232),
+    "null": _ProbeProfile("null", 10, fill=True, edns=1232),
+}
+
+def fast_dns_tunnel_check(ip: str, domain: str, timeout_ms: int, profile: Optional[_ProbeProfile] = None
+                          ) -> Tuple[bool, str, int]:
+    profile = profile or _PROBE_PROFILES["a"]
+    payload = profile.query(domain)
 
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.settimeout(max(timeout_ms, 50) / 1000.0)
@@ -212,20 +921,8 @@ def fast_dns_tunnel_check(ip: str, domain: str, timeout_ms: int) -> Tuple[bool,
         s.sendto(payload, (ip, 53))
         resp, _ = s.recvfrom(4096)
         ms = int((time.monotonic() - start) * 1000)
-        rcode = _dns_rcode(resp)
-        if rcode is None:
-            return False, "BadResp", ms
-
-        # GUI: NOERROR + NXDOMAIN = alive
-        if rcode == 0:
-            return True, "OK (Resolved)", ms
-        if rcode == 3:
-            return True, "Tunnel Alive (NX)", ms
-        if rcode == 2:
-            return False, "ServFail", ms
-        if rcode == 5:
-            return False, "Refused", ms
-        return False, f"RCODE {rcode}", ms
+        ok, detail = profile.status(resp)
+        return ok, detail, ms
 
     except socket.timeout:
         return False, "TIMEOUT", -1
@@ -238,42 +935,1495 @@ def fast_dns_tunnel_check(ip: str, domain: str, timeout_ms: int) -> Tuple[bool,
             pass
 
 
+def _probe_summary(sent: int, rtts: List[int], details: List[str]) -> Tuple[bool, str, int, tuple]:
+    # N probes -> (ok, most common reply status, median ms, (sent, replies, min ms, jitter ms))
+    if not rtts:
+        return False, ("TIMEOUT" if sent else "ERROR"), -1, (sent, 0, -1, -1)
+    detail = max(set(details), key=details.count)
+    srt = sorted(rtts)
+    jitter = sum(abs(a - b) for a, b in zip(rtts, rtts[1:])) // max(1, len(rtts) - 1)
+    return _STATUS_CODE.get(detail) in (0, 3), detail, srt[(len(srt) - 1) // 2], (sent, len(rtts), srt[0], jitter)
+
+
+def multi_dns_tunnel_check(ip: str, domain: str, timeout_ms: int, probes: int,
+                           profile: Optional[_ProbeProfile] = None) -> Tuple[bool, str, int, tuple]:
+    # pipelined on one socket: distinct TIDs and labels, replies matched back by (tid, qname)
+    profile = profile or _PROBE_PROFILES["a"]
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    timeout = max(timeout_ms, 50) / 1000.0
+    sent_at = {}
+    rtts: List[int] = []
+    details: List[str] = []
+    try:
+        for _ in range(probes):
+            payload = profile.query(domain)
+            key = (int.from_bytes(payload[0:2], "big"), _dns_qname(payload))
+            if key in sent_at:
+                continue
+            try:
+                s.sendto(payload, (ip, 53))
+            except OSError:
+                break
+            sent_at[key] = time.monotonic()
+        sent = len(sent_at)
+        deadline = time.monotonic() + timeout
+        while sent_at:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            s.settimeout(left)
+            try:
+                resp, _ = s.recvfrom(4096)
+            except socket.timeout:
+                break
+            except OSError:
+                continue
+            start = sent_at.pop((int.from_bytes(resp[0:2], "big"), _dns_qname(resp)), None)
+            if start is None:
+                continue
+            rtts.append(int((time.monotonic() - start) * 1000))
+            details.append(profile.status(resp)[1])
+        return _probe_summary(sent, rtts, details)
+    except Exception:
+        return False, "ERROR", -1, (len(sent_at), len(rtts), -1, -1)
+    finally:
+        try:
+            s.close()
+        except Exception:
+            pass
+
+
+def _fmt_probe_stats(stats: Optional[tuple]) -> Tuple[str, str]:
+    # -> (loss %, jitter ms) display strings
+    if not stats or not stats[0]:
+        return "-", "-"
+    sent, replies, _, jitter = stats
+    return f"{100 * (sent - replies) // sent}%", ("-" if jitter < 0 else str(jitter))
+
+
+# ========================= Rate control =========================
+# - Token bucket caps the probe send rate (pps)
+# - AIMD controller adjusts the bucket from the observed TIMEOUT/ERROR ratio
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.rate = max(1.0, float(rate))
+        self.burst = float(burst) if burst else max(1.0, self.rate / 20.0)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def set_rate(self, rate: float) -> None:
+        with self.lock:
+            self.rate = max(1.0, float(rate))
+            self.burst = max(1.0, self.rate / 20.0)
+            self.tokens = min(self.tokens, self.burst)
+
+    def try_take(self) -> float:
+        # 0 when a token was taken, otherwise seconds until the next one
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+    def take(self, stop_evt: threading.Event) -> bool:
+        while not stop_evt.is_set():
+            wait = self.try_take()
+            if wait <= 0:
+                return True
+            stop_evt.wait(wait)
+        return False
+
+
+class _AimdController:
+    # Results are binned by *send* time (arrival minus RTT, or minus the timeout for
+    # TIMEOUTs) so a rate change is judged only on probes actually sent at that rate.
+    def __init__(self, bucket: _TokenBucket, max_rate: float, min_rate: float, timeout_s: float,
+                 margin: float = 0.15, step: Optional[float] = None, interval_s: float = 1.0, min_samples: int = 50):
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.max_rate = max(1.0, float(max_rate))
+        self.min_rate = min(max(1.0, float(min_rate)), self.max_rate)
+        # slow start from a low rate so the loss floor is learned before any congestion
+        self.rate = max(self.min_rate, self.max_rate / 16.0)
+        self.slow_start = True
+        self.step = float(step) if step else max(1.0, self.max_rate / 50.0)
+        self.margin = float(margin)
+        self.interval = float(interval_s)
+        self.timeout = float(timeout_s)
+        self.min_samples = int(min_samples)
+        self.origin = time.monotonic()
+        self.bins = {}              # send-interval index -> [sent, bad]
+        self.next_bin = 0
+        self.carry = [0, 0]
+        self.floor: Optional[float] = None
+        self.ignore_before = 0      # bins sent before the last rate cut
+        self.backoffs = 0
+        self.last_event = ""
+        self.bucket.set_rate(self.rate)
+
+    def observe(self, detail: str, ms: int = -1) -> None:
+        with self.lock:
+            self._observe(time.monotonic(), detail, ms)
+
+    def _observe(self, now: float, detail: str, ms: int) -> None:
+        bad = detail in ("TIMEOUT", "ERROR")
+        if detail == "TIMEOUT":
+            sent = now - self.timeout
+        elif ms >= 0:
+            sent = now - ms / 1000.0
+        else:
+            sent = now
+        idx = max(self.next_bin, int((sent - self.origin) / self.interval))
+        b = self.bins.get(idx)
+        if b is None:
+            b = self.bins[idx] = [0, 0]
+        b[0] += 1
+        if bad:
+            b[1] += 1
+
+        # a bin is complete once every probe sent in it has either answered or timed out
+        complete = int((now - self.timeout - self.origin) / self.interval) - 1
+        while self.next_bin <= complete:
+            b = self.bins.pop(self.next_bin, None)
+            self.next_bin += 1
+            if b is None or self.next_bin <= self.ignore_before:
+                continue
+            self.carry[0] += b[0]
+            self.carry[1] += b[1]
+            if self.carry[0] >= self.min_samples:
+                self._evaluate(now, self.carry[1] / self.carry[0])
+                self.carry = [0, 0]
+
+    def _evaluate(self, now: float, ratio: float) -> None:
+        # the floor tracks the "natural" loss of the target list (dead IPs) and only drifts up slowly
+        if self.floor is None or ratio < self.floor:
+            self.floor = ratio
+        else:
+            self.floor += 0.02 * (ratio - self.floor)
+
+        if ratio > self.floor + self.margin:
+            self.rate = max(self.min_rate, self.rate * 0.7)
+            self.slow_start = False
+            self.ignore_before = int((now - self.origin) / self.interval) + 1
+            self.backoffs += 1
+            self.last_event = f"backoff -> {int(self.rate)} pps (loss {ratio:.0%} vs {self.floor:.0%})"
+        elif self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate * 1.5 if self.slow_start else self.rate + self.step)
+        self.bucket.set_rate(self.rate)
+
+
+# ========================= Profiling (--profile) =========================
+# - Stage timers (wall + thread CPU) and queue waits go to per-thread tables that are merged only for
+#   the report, so recording one is two clock reads and a dict update, no lock
+# - A sampler thread looks at every thread's stack --profile-hz times a second and counts where it is
+# - cProfile (--profile-cprofile) and tracemalloc (--profile-mem) are opt-in on top; they are not cheap
+
+def _thread_kind(t: threading.Thread) -> str:
+    # "Thread-7 (worker)" -> "worker", so a pool of workers adds up to one line
+    name = t.name
+    if name == "MainThread":
+        return "main"
+    if name.endswith(")") and "(" in name:
+        return name[name.rindex("(") + 1:-1]
+    return name
+
+def _stack_where(frame) -> str:
+    inner = frame
+    while frame is not None and frame.f_code.co_filename != __file__:
+        frame = frame.f_back
+    where = f"{inner.f_code.co_name} ({os.path.basename(inner.f_code.co_filename)}:{inner.f_lineno})"
+    if frame is not None and frame is not inner:
+        where += f" <- {frame.f_code.co_name}:{frame.f_lineno}"
+    return where
+
+class _Profiler:
+    def __init__(self, path: str, hz: float = 20.0, cprofile: bool = False, mem: bool = False):
+        self.path = path
+        self.hz = max(0.0, float(hz))
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tables: List[Tuple[str, dict]] = []   # (thread kind, {stage: [n, wall, cpu]} / {("wait", q): [n, total, max]})
+        self.samples = {}                          # (thread kind, where) -> hits
+        self.ticks = 0
+        self.stop_evt = threading.Event()
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.profiles: Optional[List[cProfile.Profile]] = [] if cprofile else None
+        self.mem = mem
+        self.sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.profiles is not None:
+            main = cProfile.Profile()
+            self.profiles.append(main)
+            main.enable()
+            if sys.version_info < (3, 12):
+                # before 3.12 cProfile only sees the thread that enabled it; give every new thread its own
+                threading.setprofile(self._thread_profile)
+        if self.mem:
+            tracemalloc.start()
+        if self.hz > 0:
+            self.sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self.sampler.start()
+
+    def _thread_profile(self, *_):
+        prof = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(prof)
+        prof.enable()
+
+    def _table(self) -> dict:
+        t = getattr(self.local, "t", None)
+        if t is None:
+            t = self.local.t = {}
+            with self.lock:
+                self.tables.append((_thread_kind(threading.current_thread()), t))
+        return t
+
+    @staticmethod
+    def begin() -> Tuple[float, float]:
+        return time.perf_counter(), time.thread_time()
+
+    def end(self, stage: str, mark: Tuple[float, float], n: int = 1) -> None:
+        t = self._table()
+        rec = t.get(stage)
+        if rec is None:
+            rec = t[stage] = [0, 0.0, 0.0]
+        rec[0] += n
+        rec[1] += time.perf_counter() - mark[0]
+        rec[2] += time.thread_time() - mark[1]
+
+    def wait(self, queue: str, seconds: float) -> None:
+        t = self._table()
+        rec = t.get(("wait", queue))
+        if rec is None:
+            rec = t[("wait", queue)] = [0, 0.0, 0.0]
+        rec[0] += 1
+        rec[1] += seconds
+        if seconds > rec[2]:
+            rec[2] = seconds
+
+    def timed_iter(self, stage: str, it: Iterable[int]) -> Iterable[int]:
+        it = iter(it)
+        while True:
+            mark = self.begin()
+            try:
+                x = next(it)
+            except StopIteration:
+                return
+            self.end(stage, mark)
+            yield x
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        period = 1.0 / self.hz
+        while not self.stop_evt.wait(period):
+            kinds = {t.ident: _thread_kind(t) for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                key = (kinds.get(ident, "?"), _stack_where(frame))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.ticks += 1
+
+    def finish(self) -> None:
+        self.stop_evt.set()
+        if self.sampler is not None:
+            # samples must be complete before they are read
+            self.sampler.join()
+        wall = time.perf_counter() - self.t0
+        report = {"wall_s": round(wall, 3), "cpu_s": round(time.process_time() - self.cpu0, 3),
+                  "stages": {}, "waits": {}, "samples": {"hz": self.hz, "ticks": self.ticks, "top": []}}
+        stages, waits = {}, {}
+        with self.lock:
+            tables = list(self.tables)
+        for kind, t in tables:
+            for key, (n, total, third) in list(t.items()):
+                if isinstance(key, tuple):
+                    rec = waits.setdefault(key[1], [0, 0.0, 0.0])
+                    rec[2] = max(rec[2], third)
+                else:
+                    rec = stages.setdefault(f"{kind}/{key}", [0, 0.0, 0.0])
+                    rec[2] += third
+                rec[0] += n
+                rec[1] += total
+        for name, (n, w, c) in sorted(stages.items(), key=lambda kv: -kv[1][1]):
+            report["stages"][name] = {"count": n, "wall_s": round(w, 3), "cpu_s": round(c, 3),
+                                      "avg_us": round(w * 1e6 / n, 1) if n else 0.0}
+        for name, (n, total, mx) in sorted(waits.items(), key=lambda kv: -kv[1][1]):
+            report["waits"][name] = {"count": n, "total_s": round(total, 3), "max_ms": round(mx * 1000, 1)}
+        ticks = max(1, self.ticks)
+        for (kind, where), hits in sorted(self.samples.items(), key=lambda kv: -kv[1])[:40]:
+            # average number of threads of this kind found here
+            report["samples"]["top"].append({"thread": kind, "where": where, "threads": round(hits / ticks, 2)})
+
+        if self.mem and tracemalloc.is_tracing():
+            cur, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:15]
+            tracemalloc.stop()
+            report["memory"] = {"current_kb": cur // 1024, "peak_kb": peak // 1024,
+                                "top": [{"where": str(st.traceback[0]), "kb": st.size // 1024, "count": st.count}
+                                        for st in top]}
+
+        if self.profiles is not None:
+            threading.setprofile(None)
+            self.profiles[0].disable()
+            stats = None
+            for prof in self.profiles:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(prof)
+                    else:
+                        stats.add(prof)
+                except (TypeError, ValueError):
+                    continue
+            if stats is not None:
+                report["cprofile"] = os.path.splitext(self.path)[0] + ".pstats"
+                stats.dump_stats(report["cprofile"])
+
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            print(f"WARN: could not write profile {self.path}: {e}", file=sys.stderr)
+
+        print(f"Profile: wall={report['wall_s']}s cpu={report['cpu_s']}s -> {self.path}", file=sys.stderr)
+        for name, r in list(report["stages"].items())[:8]:
+            print(f"  stage {name:28s} n={r['count']:<9} wall={r['wall_s']}s cpu={r['cpu_s']}s avg={r['avg_us']}us",
+                  file=sys.stderr)
+        for name, r in list(report["waits"].items())[:6]:
+            print(f"  wait  {name:28s} n={r['count']:<9} total={r['total_s']}s max={r['max_ms']}ms", file=sys.stderr)
+        for r in report["samples"]["top"][:8]:
+            print(f"  where {r['thread']:12s} x{r['threads']:<6} {r['where']}", file=sys.stderr)
+
+
+# ========================= Batched UDP I/O (--udp-io mmsg) =========================
+# - Linux only: the event engine passes queries to sendmmsg() in small batches and reads replies with recvmmsg()
+# - libc is reached through ctypes; send/recv vectors and packet buffers are allocated once per run
+# - Anywhere else (Windows, macOS, libc without the calls) the plain sendto/recvfrom path is used
+
+_MMSG_PKT = 512      # per-query send slot; a query for a <=253 char domain is well under this
+_MMSG_BUF = 2048     # per-reply receive slot; longer replies are truncated, which is fine for rcode/qname
+_MMSG_SEND = 32      # queries per sendmmsg call; small chunks keep sends spread out (a big burst comes back
+                     # as a big clump of replies, and the last ones wait behind the first ones' processing)
+_MMSG_RECV = 256     # replies per recvmmsg call
+
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [("base", ctypes.c_void_p), ("len", ctypes.c_size_t)]
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [("family", ctypes.c_ushort), ("port", ctypes.c_uint16), ("addr", ctypes.c_uint32),
+                ("zero", ctypes.c_char * 8)]
+
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [("name", ctypes.c_void_p), ("namelen", ctypes.c_uint32), ("iov", ctypes.c_void_p),
+                ("iovlen", ctypes.c_size_t), ("control", ctypes.c_void_p), ("controllen", ctypes.c_size_t),
+                ("flags", ctypes.c_int)]
+
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [("hdr", _Msghdr), ("len", ctypes.c_uint)]
+
+
+_IOV_LEN = struct.Struct("N")
+_SIN_ADDR = struct.Struct("!I")
+_MSG_LEN = struct.Struct("I")
+_MMSG_LIBC = None
+
+def _mmsg_libc():
+    # libc with sendmmsg/recvmmsg bound, or None where they are missing
+    global _MMSG_LIBC
+    if _MMSG_LIBC is None:
+        _MMSG_LIBC = False
+        if sys.platform.startswith("linux"):
+            try:
+                lib = ctypes.CDLL(None, use_errno=True)
+                lib.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+                lib.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+                lib.sendmmsg.restype = lib.recvmmsg.restype = ctypes.c_int
+                _MMSG_LIBC = lib
+            except (OSError, AttributeError):
+                pass
+    return _MMSG_LIBC or None
+
+
+class _MmsgIO:
+    def __init__(self, lib, send_n: int, recv_n: int = _MMSG_RECV):
+        self.lib = lib
+        self.send_n = send_n
+        self.recv_n = recv_n
+
+        self.s_buf = ctypes.create_string_buffer(send_n * _MMSG_PKT)
+        self.s_addr = (_SockaddrIn * send_n)()
+        self.s_iov = (_Iovec * send_n)()
+        self.s_msg = (_Mmsghdr * send_n)()
+        base = ctypes.addressof(self.s_buf)
+        for i in range(send_n):
+            self.s_addr[i].family = socket.AF_INET
+            self.s_addr[i].port = socket.htons(53)
+            self.s_iov[i].base = base + i * _MMSG_PKT
+            h = self.s_msg[i].hdr
+            h.name = ctypes.addressof(self.s_addr[i])
+            h.namelen = ctypes.sizeof(_SockaddrIn)
+            h.iov = ctypes.addressof(self.s_iov[i])
+            h.iovlen = 1
+        self.s_msg_p = ctypes.addressof(self.s_msg)
+        # byte views so the per-packet writes are plain slice stores / pack_into
+        self.s_view = memoryview(self.s_buf).cast("B")
+        self.s_iov_view = memoryview(self.s_iov).cast("B")
+        self.s_addr_view = memoryview(self.s_addr).cast("B")
+
+        self.r_buf = ctypes.create_string_buffer(recv_n * _MMSG_BUF)
+        self.r_iov = (_Iovec * recv_n)()
+        self.r_msg = (_Mmsghdr * recv_n)()
+        self.r_base = ctypes.addressof(self.r_buf)
+        for i in range(recv_n):
+            self.r_iov[i].base = self.r_base + i * _MMSG_BUF
+            self.r_iov[i].len = _MMSG_BUF
+            h = self.r_msg[i].hdr
+            h.iov = ctypes.addressof(self.r_iov[i])
+            h.iovlen = 1
+        self.r_msg_p = ctypes.addressof(self.r_msg)
+        self.r_view = memoryview(self.r_buf).cast("B")
+
+    def send(self, fd: int, batch: list, pos: int) -> int:
+        # batch[pos:] is [(probe, payload)]; returns how many went out, or -errno for batch[pos]
+        n = min(len(batch) - pos, self.send_n)
+        buf, iov, addr = self.s_view, self.s_iov_view, self.s_addr_view
+        iov_step, iov_off = ctypes.sizeof(_Iovec), _Iovec.len.offset
+        addr_step, addr_off = ctypes.sizeof(_SockaddrIn), _SockaddrIn.addr.offset
+        for i in range(n):
+            probe, payload = batch[pos + i]
+            o = i * _MMSG_PKT
+            buf[o:o + len(payload)] = payload
+            _IOV_LEN.pack_into(iov, i * iov_step + iov_off, len(payload))
+            _SIN_ADDR.pack_into(addr, i * addr_step + addr_off, probe.ip & 0xFFFFFFFF)
+        r = self.lib.sendmmsg(fd, self.s_msg_p, n, 0)
+        return r if r >= 0 else -ctypes.get_errno()
+
+    def recv(self, fd: int) -> list:
+        # every reply already queued on fd (up to recv_n); [] when there are none
+        r = self.lib.recvmmsg(fd, self.r_msg_p, self.recv_n, 0, None)
+        if r <= 0:
+            return []
+        step = ctypes.sizeof(_Mmsghdr)
+        off = _Mmsghdr.len.offset
+        view = self.r_view
+        out = []
+        for i in range(r):
+            ln = _MSG_LEN.unpack_from(self.r_msg, i * step + off)[0]
+            out.append(bytes(view[i * _MMSG_BUF:i * _MMSG_BUF + min(ln, _MMSG_BUF)]))
+        return out
+
+
+# ========================= Event-driven probe engine =========================
+# - A few shared non-blocking UDP sockets instead of one socket + thread per probe
+# - Replies matched to in-flight probes by (transaction ID, qname)
+# - Timeouts expire through a hashed timer wheel
+
+class _TimerWheel:
+    def __init__(self, tick_ms: int, span_ms: int):
+        self.tick = max(1, int(tick_ms)) / 1000.0
+        self.size = int(max(span_ms, tick_ms) // max(1, tick_ms)) + 2
+        self.slots: List[list] = [[] for _ in range(self.size)]
+        self.origin = time.monotonic()
+        self.cur = 0
+
+    def add(self, item, deadline: float) -> None:
+        t = int((deadline - self.origin) / self.tick) + 1
+        t = min(max(t, self.cur + 1), self.cur + self.size - 1)
+        self.slots[t % self.size].append(item)
+
+    def advance(self, now: float) -> list:
+        target = int((now - self.origin) / self.tick)
+        out = []
+        while self.cur < target:
+            self.cur += 1
+            slot = self.slots[self.cur % self.size]
+            if slot:
+                out.extend(slot)
+                slot.clear()
+        return out
+
+    def next_timeout(self, now: float) -> float:
+        return max(0.0, self.origin + (self.cur + 1) * self.tick - now)
+
+
+class _Probe:
+    __slots__ = ("ip", "key", "start", "group")
+
+    def __init__(self, ip: int, key: Tuple[int, bytes], start: float):
+        self.ip = ip
+        self.key = key
+        self.start = start
+        self.group: Optional[_ProbeGroup] = None
+
+
+class _ProbeGroup:
+    # --probes N: one target's queries; the summary is emitted when the last one resolves
+    __slots__ = ("sent", "left", "closed", "rtts", "details")
+
+    def __init__(self):
+        self.sent = 0
+        self.left = 0
+        self.closed = False
+        self.rtts: List[int] = []
+        self.details: List[str] = []
+
+
+_SEND_BURST = 512
+
+class UdpProbeEngine:
+    def __init__(self, domain: str, timeout_ms: int, sockets: int = 4, max_inflight: int = 10000, tick_ms: int = 10,
+                 bucket: Optional[_TokenBucket] = None, probes: int = 1, prof: Optional[_Profiler] = None,
+                 mmsg: bool = False, profile: Optional[_ProbeProfile] = None):
+        self.domain = domain.strip(".")
+        self.profile = profile or _PROBE_PROFILES["a"]
+        self.lib = _mmsg_libc() if mmsg else None
+        self.bucket = bucket
+        self.prof = prof
+        self.probes = max(1, int(probes))
+        self.timeout = max(timeout_ms, 50) / 1000.0
+        self.sock_count = max(1, int(sockets))
+        self.max_inflight = max(1, int(max_inflight))
+        self.tick_ms = tick_ms
+        self.inflight = {}   # (tid, qname) -> _Probe
+        # every query is the same packet apart from the TID and a 6-digit first label
+        # (a tunnel profile's filler labels are drawn once per run)
+        tmpl = _encode_dns_query(f"000000.{self.profile.suffix(self.domain)}", 0, self.profile.qtype, self.profile.edns)
+        self._q_hdr = tmpl[2:12]
+        self._q_tail = tmpl[19:]
+        self._k_tail = _dns_qname(tmpl)[7:]
+
+    def _open_sockets(self) -> List[socket.socket]:
+        socks = []
+        for _ in range(self.sock_count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setblocking(False)
+            for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                try:
+                    s.setsockopt(socket.SOL_SOCKET, opt, 4 * 1024 * 1024)
+                except OSError:
+                    pass
+            s.bind(("", 0))
+            socks.append(s)
+        return socks
+
+    def _new_probe(self, ip: int, now: float) -> Tuple[_Probe, bytes]:
+        while True:
+            r = random.getrandbits(36)
+            tid = r & 0xFFFF
+            label = b"\x06" + str(100000 + (r >> 16) % 900000).encode()
+            key = (tid, label + self._k_tail)
+            if key not in self.inflight:
+                return _Probe(ip, key, now), tid.to_bytes(2, "big") + self._q_hdr + label + self._q_tail
+
+    def run(self, targets: Iterable[int], emit: Callable[..., None], stop_evt: threading.Event) -> None:
+        socks = self._open_sockets()
+        sel = selectors.DefaultSelector()
+        for s in socks:
+            sel.register(s, selectors.EVENT_READ)
+        wheel = _TimerWheel(self.tick_ms, int(self.timeout * 1000))
+        it = iter(targets)
+        exhausted = False
+        pending: Optional[int] = None
+        group: Optional[_ProbeGroup] = None
+        rr = 0
+        prof = self.prof
+        mm = _MmsgIO(self.lib, _MMSG_SEND) if self.lib is not None else None
+        batch: list = []   # --udp-io mmsg: (probe, payload) waiting for sendmmsg, counted in the group already
+        drain = self._drain if mm is None else (lambda s_, emit_: self._drain_mmsg(mm, s_, emit_))
+        try:
+            while not stop_evt.is_set():
+                now = time.monotonic()
+                rate_wait = 0.0
+
+                # fill the in-flight window, a burst at a time so replies get read in between
+                burst = len(batch)
+                sent_all = True
+                if prof is not None:
+                    mark = prof.begin()
+                while (not exhausted and len(self.inflight) + len(batch) < self.max_inflight
+                       and burst < _SEND_BURST):
+                    if len(batch) >= _MMSG_SEND:
+                        sent_all = self._flush(mm, socks[rr], batch, wheel, emit)
+                        if group is None:
+                            rr = (rr + 1) % len(socks)
+                        if not sent_all:
+                            rate_wait = 0.001
+                            break
+                    if self.bucket is not None:
+                        rate_wait = self.bucket.try_take()
+                        if rate_wait > 0:
+                            break
+                    if pending is None:
+                        try:
+                            pending = next(it)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        if self.probes > 1:
+                            group = _ProbeGroup()
+                    # a full window takes a while to send; stamp each probe with its own send time
+                    now = time.monotonic()
+                    probe, payload = self._new_probe(pending, now)
+                    probe.group = group
+                    if mm is not None:
+                        batch.append((probe, payload))
+                    else:
+                        try:
+                            socks[rr].sendto(payload, (_int_to_ip(pending & 0xFFFFFFFF), 53))
+                        except BlockingIOError:
+                            rate_wait = 0.001
+                            break
+                        except Exception:
+                            if group is None:
+                                emit(pending, False, "ERROR", -1)
+                            else:
+                                group.closed = True
+                                self._settle(pending, group, emit)
+                            pending = group = None
+                            continue
+                        self.inflight[probe.key] = probe
+                        wheel.add(probe, now + self.timeout)
+                    burst += 1
+                    if group is not None:
+                        # the rest of this target's probes go out back-to-back on the same socket
+                        group.sent += 1
+                        group.left += 1
+                        if group.sent < self.probes:
+                            continue
+                        group.closed = True
+                    if mm is None:
+                        rr = (rr + 1) % len(socks)
+                    pending = group = None
+
+                if batch and sent_all:
+                    if not self._flush(mm, socks[rr], batch, wheel, emit):
+                        rate_wait = 0.001
+                    if group is None:
+                        rr = (rr + 1) % len(socks)
+
+                if prof is not None and burst:
+                    prof.end("send", mark, burst)
+
+                if exhausted and not self.inflight and not batch:
+                    return
+
+                wait = 0.0 if burst >= _SEND_BURST else wheel.next_timeout(now)
+                if rate_wait > 0:
+                    wait = min(wait, rate_wait)
+                if prof is None:
+                    for key, _ in sel.select(wait):
+                        drain(key.fileobj, emit)
+                else:
+                    t = time.perf_counter()
+                    ready = sel.select(wait)
+                    prof.wait("select", time.perf_counter() - t)
+                    for key, _ in ready:
+                        mark = prof.begin()
+                        drain(key.fileobj, emit)
+                        prof.end("recv", mark)
+
+                for probe in wheel.advance(time.monotonic()):
+                    if self.inflight.get(probe.key) is probe:
+                        del self.inflight[probe.key]
+                        if probe.group is None:
+                            emit(probe.ip, False, "TIMEOUT", -1)
+                        else:
+                            probe.group.left -= 1
+                            self._settle(probe.ip, probe.group, emit)
+        finally:
+            sel.close()
+            for s in socks:
+                try:
+                    s.close()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _settle(tag: int, group: _ProbeGroup, emit: Callable[..., None]) -> None:
+        if group.closed and group.left == 0:
+            ok, detail, ms, stats = _probe_summary(group.sent, group.rtts, group.details)
+            emit(tag, ok, detail, ms, stats)
+
+    def _flush(self, mm: _MmsgIO, s: socket.socket, batch: list, wheel: _TimerWheel,
+               emit: Callable[..., None]) -> bool:
+        # sendmmsg the batch; what the kernel won't take yet stays in it. False = socket buffer full
+        pos = 0
+        try:
+            while pos < len(batch):
+                now = time.monotonic()
+                n = mm.send(s.fileno(), batch, pos)
+                if n == -errno.EINTR:
+                    continue
+                if n in (-errno.EAGAIN, -errno.EWOULDBLOCK, -errno.ENOBUFS):
+                    return False
+                if n < 0:
+                    # this one can't be sent (e.g. no route); the kernel reports it first in line, so skip it
+                    probe = batch[pos][0]
+                    pos += 1
+                    if probe.group is None:
+                        emit(probe.ip, False, "ERROR", -1)
+                    else:
+                        probe.group.sent -= 1
+                        probe.group.left -= 1
+                        self._settle(probe.ip, probe.group, emit)
+                    continue
+                for probe, _ in batch[pos:pos + n]:
+                    probe.start = now
+                    self.inflight[probe.key] = probe
+                    wheel.add(probe, now + self.timeout)
+                pos += n
+            return True
+        finally:
+            del batch[:pos]
+
+    def _drain(self, s: socket.socket, emit: Callable[..., None]) -> None:
+        for _ in range(1024):
+            try:
+                resp, _ = s.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. ICMP port unreachable surfaced as ConnectionResetError on Windows
+                continue
+            self._on_reply(resp, time.monotonic(), emit)
+
+    def _drain_mmsg(self, mm: _MmsgIO, s: socket.socket, emit: Callable[..., None]) -> None:
+        for _ in range(1024 // mm.recv_n):
+            replies = mm.recv(s.fileno())
+            now = time.monotonic()
+            for resp in replies:
+                self._on_reply(resp, now, emit)
+            if len(replies) < mm.recv_n:
+                return
+
+    def _on_reply(self, resp: bytes, now: float, emit: Callable[..., None]) -> None:
+        if len(resp) < 12:
+            return
+        qname = _dns_qname(resp)
+        if qname is None:
+            return
+        probe = self.inflight.pop((int.from_bytes(resp[0:2], "big"), qname), None)
+        if probe is None:
+            return
+        ms = int((now - probe.start) * 1000)
+        ok, detail = self.profile.status(resp)
+        if probe.group is None:
+            emit(probe.ip, ok, detail, ms)
+            return
+        probe.group.left -= 1
+        probe.group.rtts.append(ms)
+        probe.group.details.append(detail)
+        self._settle(probe.ip, probe.group, emit)
+
+
+# ========================= Scan runners =========================
+
+def _probe_targets(targets: Iterable[int], domain: str, timeout_ms: int, emit: Callable[..., None],
+                   stop_evt: threading.Event, engine: str = "threads", threads: int = 200, sockets: int = 4,
+                   max_inflight: int = 10000, bucket: Optional[_TokenBucket] = None, probes: int = 1,
+                   gauges: Optional[dict] = None, prof: Optional[_Profiler] = None, udp_io: str = "plain",
+                   profile: str = "a") -> None:
+    # blocks until every target has been emitted exactly once (or stop_evt is set).
+    # Targets are plan tags; only the low 32 bits (the address) reach the socket, the tag is echoed to emit.
+    # With probes > 1, emit also gets a (sent, replies, min ms, jitter ms) tuple and ms is the median.
+    # gauges (--metrics-port), if given, gets live 'inflight'/'target_q' callables for the engine in use.
+    # udp_io "mmsg" batches the event engine's socket calls where the platform has sendmmsg/recvmmsg.
+    # profile names a _PROBE_PROFILES entry (the query shape and which replies count as OK).
+    pp = _PROBE_PROFILES[profile]
+    if engine == "event":
+        eng = UdpProbeEngine(domain, timeout_ms, sockets=sockets, max_inflight=max_inflight, bucket=bucket, probes=probes,
+                             prof=prof, mmsg=(udp_io == "mmsg"), profile=pp)
+        if gauges is not None:
+            gauges["inflight"] = lambda: len(eng.inflight)
+        eng.run(targets, emit, stop_evt)
+        return
+
+    # With --rate the producer takes the tokens, so positions go out in plan order and the --state-file
+    # watermark keeps up; the queue is kept short so an AIMD cut isn't buried under pre-paid targets.
+    n_workers = max(1, int(threads))
+    target_q: "Queue[int]" = Queue(maxsize=10000 if bucket is None else n_workers)
+    producer_done = threading.Event()
+    busy = [0] * n_workers
+    if gauges is not None:
+        gauges["inflight"] = lambda: sum(busy)
+        gauges["target_q"] = target_q.qsize
+
+    def worker(n: int):
+        while not stop_evt.is_set():
+            if producer_done.is_set() and target_q.empty():
+                return
+            t = time.perf_counter()
+            try:
+                ip = target_q.get(timeout=0.2)
+            except Empty:
+                continue
+            finally:
+                if prof is not None:
+                    prof.wait("target_q.get", time.perf_counter() - t)
+            busy[n] = 1
+            if prof is not None:
+                mark = prof.begin()
+            if probes > 1:
+                emit(ip, *multi_dns_tunnel_check(_int_to_ip(ip & 0xFFFFFFFF), domain, timeout_ms, probes, pp))
+            else:
+                ok1, detail, ms = fast_dns_tunnel_check(_int_to_ip(ip & 0xFFFFFFFF), domain, timeout_ms, pp)
+                emit(ip, ok1, detail, ms)
+            if prof is not None:
+                prof.end("dns_check", mark)
+            busy[n] = 0
+
+    workers = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(n_workers)]
+    for t in workers:
+        t.start()
+    try:
+        for ip in targets:
+            if bucket is not None and not all(bucket.take(stop_evt) for _ in range(probes)):
+                break
+            t = time.perf_counter()
+            while not stop_evt.is_set():
+                try:
+                    target_q.put(ip, timeout=0.2)
+                    break
+                except Full:
+                    continue
+            if prof is not None:
+                prof.wait("target_q.put", time.perf_counter() - t)
+            if stop_evt.is_set():
+                break
+    finally:
+        producer_done.set()
+    for t in workers:
+        t.join()
+
+
+# ========================= Multi-process sharded scan =========================
+# - Each worker process walks the same target plan (same seed) and keeps only its shard
+# - Results travel back as packed (position, ip, status code, ms, --probes stats) records, batched per queue message
+
+_PROBES_MAX = 0xFFFF     # sent/replies travel as u16 in shard records and .bin result files
+_REC = struct.Struct("!QIBiHHii")
+
+def _scan_shard_main(shard_i: int, shard_n: int, spec: dict, res_q, stop_evt, rate_val) -> None:
+    buf: List[bytes] = []
+    buf_lock = threading.Lock()
+    finished = threading.Event()
+
+    def flush():
+        with buf_lock:
+            if not buf:
+                return
+            chunk = b"".join(buf)
+            buf.clear()
+        res_q.put(chunk)
+
+    def emit(ip_: int, ok_: bool, detail_: str, ms_: int, stats_: Optional[tuple] = None):
+        sent_, replies_, min_, jitter_ = stats_ or (0, 0, -1, -1)
+        rec = _REC.pack(ip_ >> 32, ip_ & 0xFFFFFFFF, _STATUS_CODE.get(detail_, _STATUS_CODE["ERROR"]), int(ms_),
+                        sent_, replies_, min_, jitter_)
+        with buf_lock:
+            buf.append(rec)
+            full = len(buf) >= 512
+        if full:
+            flush()
+
+    def background():
+        last_rate = 0.0
+        while not finished.wait(0.1):
+            flush()
+            if bucket is not None and rate_val.value != last_rate:
+                last_rate = rate_val.value
+                bucket.set_rate(last_rate / shard_n)
+
+    try:
+        plan = spec["plan"]
+        targets = plan.iter_addrs(stop_evt, spec["order"], (shard_i, shard_n), spec["skip"][shard_i])
+        if spec.get("filter") is not None:
+            targets = _iter_filtered(targets, spec["filter"], lambda ip_: emit(ip_, False, "SKIP", -1))
+        bucket = _TokenBucket(rate_val.value / shard_n) if rate_val.value > 0 else None
+        threading.Thread(target=background, daemon=True).start()
+        _probe_targets(targets, spec["domain"], spec["timeout_ms"], emit, stop_evt, spec["engine"],
+                       spec["threads"], spec["sockets"], spec["max_inflight"], bucket, spec.get("probes", 1),
+                       udp_io=spec.get("udp_io", "plain"), profile=spec.get("profile", "a"))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finished.set()
+        flush()
+        res_q.put(None)
+
+def _probe_sharded(spec: dict, nprocs: int, emit: Callable[[int, bool, str, int], None],
+                   stop_evt: threading.Event, bucket: Optional[_TokenBucket] = None) -> None:
+    # spawn (not fork) so children never inherit locks held by the parent's UI/worker threads
+    ctx = multiprocessing.get_context("spawn")
+    res_q = ctx.Queue()
+    mp_stop = ctx.Event()
+    rate_val = ctx.Value("d", float(bucket.rate) if bucket is not None else 0.0, lock=False)
+
+    procs = [ctx.Process(target=_scan_shard_main, args=(i, nprocs, spec, res_q, mp_stop, rate_val), daemon=True)
+             for i in range(nprocs)]
+    for pr in procs:
+        pr.start()
+
+    alive = nprocs
+    try:
+        while alive > 0:
+            if stop_evt.is_set():
+                mp_stop.set()
+            if bucket is not None:
+                rate_val.value = float(bucket.rate)
+            try:
+                chunk = res_q.get(timeout=0.2)
+            except Empty:
+                if not any(pr.is_alive() for pr in procs):
+                    break
+                continue
+            if chunk is None:
+                alive -= 1
+                continue
+            for pos, ip, code, ms, sent, replies, mn, jitter in _REC.iter_unpack(chunk):
+                emit((pos << 32) | ip, code in (0, 3), _STATUS_TEXT[code], ms,
+                     (sent, replies, mn, jitter) if sent else None)
+    finally:
+        mp_stop.set()
+        for pr in procs:
+            pr.join(timeout=2)
+            if pr.is_alive():
+                pr.terminate()
+
+
+# ========================= Scan checkpoint (--state-file) =========================
+# - One cursor per shard: a contiguous-prefix watermark over the dense target positions
+# - Only results below every watermark count as "done"; the out-of-order tail is re-probed on resume
+# - Scan-OK IPs and pending/finished realtests ride along so resume neither repeats nor loses them
+
+_STATE_VERSION = 1
+
+def _pack_ips(ips: Iterable[int]) -> str:
+    return base64.b64encode(_le_bytes(array("I", ips))).decode("ascii")
+
+def _unpack_ips(s: str) -> array:
+    return _le_array("I", base64.b64decode(s.encode("ascii")))
+
+def _status_kind(code: int) -> str:
+    if code in (0, 3):
+        return "ok"
+    return "skip" if code == _STATUS_CODE["SKIP"] else "fail"
+
+
+class _ShardCursor:
+    __slots__ = ("low", "ahead")
+
+    def __init__(self, low: int = 0):
+        self.low = low
+        self.ahead = {}     # seq -> status code, completed above the watermark
+
+    def complete(self, seq: int, code: int, counts: dict) -> None:
+        if seq != self.low:
+            if seq > self.low:
+                self.ahead[seq] = code
+            return
+        counts[_status_kind(code)] += 1
+        self.low += 1
+        while self.low in self.ahead:
+            counts[_status_kind(self.ahead.pop(self.low))] += 1
+            self.low += 1
+
+
+_STATE_RT_KEEP = 1500
+
+class _ScanState:
+    def __init__(self, path: str, params: dict, shards: int):
+        self.path = path
+        self.params = params            # what the positions mean: source digest, seed, order, sampling, shards
+        self.cursors = [_ShardCursor() for _ in range(shards)]
+        self.counts = {"ok": 0, "fail": 0, "skip": 0}   # results below the watermarks
+        self.scan_ok = _IpSet()
+        self.rt_pending = set()
+        # only the newest results ([ip, status, ms]) for the table; the full history is --results-out / --db
+        self.rt_done: "deque[list]" = deque(maxlen=_STATE_RT_KEEP)
+        self.rt_counts = {"ok": 0, "fail": 0}
+        self.finished = False
+        self.last_save = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return sum(c.low for c in self.cursors)
+
+    def complete(self, tag: int, code: int) -> None:
+        pos = tag >> 32
+        n = len(self.cursors)
+        self.cursors[pos % n].complete(pos // n, code, self.counts)
+
+    def save(self) -> None:
+        data = {
+            "version": _STATE_VERSION,
+            "params": self.params,
+            "cursors": [c.low for c in self.cursors],
+            "counts": self.counts,
+            "scan_ok": _pack_ips(self.scan_ok),
+            "rt_pending": _pack_ips(sorted(self.rt_pending)),
+            "rt_done": list(self.rt_done),
+            "rt_counts": self.rt_counts,
+            "finished": self.finished,
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self.last_save = time.monotonic()
+
+    def maybe_save(self, interval_s: float) -> None:
+        if time.monotonic() - self.last_save >= interval_s:
+            self.save()
+
+    @classmethod
+    def load(cls, path: str) -> "_ScanState":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != _STATE_VERSION:
+            raise ValueError("unsupported state file version")
+        cursors = data["cursors"]
+        st = cls(path, data["params"], len(cursors))
+        st.cursors = [_ShardCursor(int(c)) for c in cursors]
+        st.counts.update(data.get("counts", {}))
+        st.scan_ok = _IpSet(_unpack_ips(data.get("scan_ok", "")))
+        st.rt_pending = set(_unpack_ips(data.get("rt_pending", "")))
+        st.rt_done.extend(data.get("rt_done", []))
+        if "rt_counts" in data:
+            st.rt_counts.update(data["rt_counts"])
+        else:
+            ok = sum(1 for r in st.rt_done if str(r[1]).endswith(" ms"))
+            st.rt_counts = {"ok": ok, "fail": len(st.rt_done) - ok}
+        st.finished = bool(data.get("finished", False))
+        return st
+
+
+def _source_digest(path: str, tokens: List[str]) -> str:
+    if path:
+        return _file_sha256(path).hex()
+    return hashlib.sha256("\n".join(tokens).encode("utf-8")).hexdigest()
+
+
+# ========================= Result store (--db) =========================
+# - SQLite, one row per (domain, ip): latest scan status/RTT/time, last OK time and latest RealPing
+# - Rows are buffered and upserted in batches from the consumer thread; each invocation is a row in `runs`
+# - History loads back as _IpSet bitmaps that skip (or restrict) targets on the next run
+
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    targets TEXT,
+    started_at INTEGER NOT NULL,
+    finished_at INTEGER,
+    ok INTEGER,
+    fail INTEGER,
+    skip INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    domain TEXT NOT NULL,
+    ip INTEGER NOT NULL,
+    scan_code INTEGER,
+    scan_ms INTEGER,
+    scan_at INTEGER,
+    last_ok_at INTEGER,
+    rt_status TEXT,
+    rt_ms TEXT,
+    rt_at INTEGER,
+    run_id INTEGER,
+    PRIMARY KEY (domain, ip)
+) WITHOUT ROWID;
+"""
+
+_DB_UPSERT_SCAN = """
+INSERT INTO results (domain, ip, scan_code, scan_ms, scan_at, last_ok_at, run_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (domain, ip) DO UPDATE SET
+    scan_code = excluded.scan_code, scan_ms = excluded.scan_ms, scan_at = excluded.scan_at,
+    last_ok_at = COALESCE(excluded.last_ok_at, results.last_ok_at), run_id = excluded.run_id
+"""
+
+_DB_UPSERT_RT = """
+INSERT INTO results (domain, ip, rt_status, rt_ms, rt_at, run_id) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (domain, ip) DO UPDATE SET
+    rt_status = excluded.rt_status, rt_ms = excluded.rt_ms, rt_at = excluded.rt_at
+"""
+
+_OK_CODES = "(0, 3)"   # NOERROR / NXDOMAIN, same as the scan's OK
+
+
+def _parse_duration(v: str) -> float:
+    v = v.strip().lower()
+    mult = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}.get(v[-1:], None)
+    try:
+        n = float(v[:-1] if mult else v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {v!r} (use e.g. 90s, 30m, 6h, 2d)")
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"invalid duration: {v!r}")
+    return n * (mult or 1)
+
+
+class _ResultStore:
+    def __init__(self, path: str, domain: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_DB_SCHEMA)
+        self.domain = domain
+        self.run_id: Optional[int] = None
+        self._scan: List[tuple] = []
+        self._rt: List[tuple] = []
+        self.last_flush = time.monotonic()
+
+    def begin_run(self, targets: str) -> None:
+        cur = self.db.execute("INSERT INTO runs (domain, targets, started_at) VALUES (?, ?, ?)",
+                              (self.domain, targets, int(time.time())))
+        self.run_id = cur.lastrowid
+        self.db.commit()
+
+    def record_scan(self, ip: int, code: int, ms: int) -> None:
+        now = int(time.time())
+        self._scan.append((self.domain, ip, code, ms, now, now if code in (0, 3) else None, self.run_id))
+        if len(self._scan) >= 4096:
+            self.flush()
+
+    def record_rt(self, ip: int, status: str, ms: str) -> None:
+        self._rt.append((self.domain, ip, status, ms, int(time.time()), self.run_id))
+
+    def flush(self) -> None:
+        if self._scan:
+            self.db.executemany(_DB_UPSERT_SCAN, self._scan)
+            self._scan.clear()
+        if self._rt:
+            self.db.executemany(_DB_UPSERT_RT, self._rt)
+            self._rt.clear()
+        self.db.commit()
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self, interval_s: float = 1.0) -> None:
+        if time.monotonic() - self.last_flush >= interval_s:
+            self.flush()
+
+    def _ips(self, where: str, params: tuple = (), into: Optional[_IpSet] = None) -> _IpSet:
+        out = into if into is not None else _IpSet()
+        rows = self.db.execute(f"SELECT ip FROM results WHERE domain = ? AND {where}", (self.domain,) + params)
+        for (ip,) in rows:
+            out.add(ip)
+        return out
+
+    def scanned_since(self, ts: float, into: Optional[_IpSet] = None) -> _IpSet:
+        return self._ips("scan_at >= ?", (int(ts),), into)
+
+    def dead_since(self, ts: float, into: Optional[_IpSet] = None) -> _IpSet:
+        return self._ips(f"scan_at >= ? AND scan_code NOT IN {_OK_CODES}", (int(ts),), into)
+
+    def known_good(self) -> _IpSet:
+        return self._ips(f"scan_code IN {_OK_CODES}")
+
+    def close(self, counts: dict) -> None:
+        try:
+            self.flush()
+            if self.run_id is not None:
+                self.db.execute("UPDATE runs SET finished_at = ?, ok = ?, fail = ?, skip = ? WHERE id = ?",
+                                (int(time.time()), counts.get("ok", 0), counts.get("fail", 0),
+                                 counts.get("skip", 0), self.run_id))
+                self.db.commit()
+        finally:
+            self.db.close()
+
+
 # ========================= RealTest helpers =========================
 
+class _NoFreePort(OSError):
+    # no listen port left for slipstream-client; reported as NO PORT
+    pass
+
 def _free_port() -> int:
     s = socket.socket()
-    s.bind(("", 0))
-    p = int(s.getsockname()[1])
-    s.close()
-    return p
+    try:
+        s.bind(("", 0))
+        return int(s.getsockname()[1])
+    except OSError as e:
+        raise _NoFreePort(e.errno, f"no free port: {e.strerror}") from e
+    finally:
+        s.close()
 
-def _start_slipstream(exe: str, resolver_ip: str, domain: str, port: int) -> Tuple[subprocess.Popen, threading.Event]:
-    ready = threading.Event()
+def _start_slipstream(exe: str, resolver_ip: str, domain: str, port: int) -> subprocess.Popen:
     cmd = [exe, "--resolver", f"{resolver_ip}:53", "--domain", domain, "--tcp-listen-port", str(port)]
     creationflags = 0
     if os.name == "nt":
         creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0) | getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
 
-    proc = subprocess.Popen(
+    return subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        text=True,
         creationflags=creationflags,
     )
 
-    def _reader():
+def _port_bindable(port: int) -> bool:
+    s = socket.socket()
+    try:
+        s.bind(("127.0.0.1", int(port)))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def _parse_port_range(v: str) -> Tuple[int, int]:
+    try:
+        lo, _, hi = v.partition("-")
+        lo_i, hi_i = int(lo), int(hi or lo)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid port range: {v!r} (use e.g. 41000-41999)")
+    if not (1 <= lo_i <= hi_i <= 65535):
+        raise argparse.ArgumentTypeError(f"invalid port range: {v!r}")
+    return lo_i, hi_i
+
+
+class _SlipstreamPool:
+    # - Listen ports are leased from a reserved range (or the OS) and stay leased until the child has exited,
+    #   so two tests can never race for the same port
+    # - At most `size` children alive at once, counting ones still being torn down
+    # - Teardown (terminate, grace period, kill) runs on a reaper thread, overlapping the next test's startup
+
+    def __init__(self, size: int, ports: Optional[Tuple[int, int]] = None):
+        self.size = max(1, int(size))
+        self.slots = threading.Semaphore(self.size)
+        self.lock = threading.Lock()
+        self.free = deque(range(ports[0], ports[1] + 1)) if ports else None
+        self.leased = set()
+        self.procs = set()
+        self.alive = 0
+        self.reap_q: "Queue[Tuple[subprocess.Popen, int]]" = Queue()
+        threading.Thread(target=self._reaper, daemon=True).start()
+
+    def _lease(self) -> int:
+        with self.lock:
+            if self.free is None:
+                for _ in range(64):
+                    port = _free_port()
+                    if port not in self.leased:
+                        self.leased.add(port)
+                        return port
+            else:
+                for _ in range(len(self.free)):
+                    port = self.free.popleft()
+                    if _port_bindable(port):
+                        self.leased.add(port)
+                        return port
+                    self.free.append(port)
+        raise _NoFreePort("no free port for slipstream-client")
+
+    def _release(self, port: int) -> None:
+        with self.lock:
+            self.leased.discard(port)
+            if self.free is not None:
+                self.free.append(port)
+
+    def spawn(self, exe: str, resolver_ip: str, domain: str) -> Tuple[subprocess.Popen, int]:
+        self.slots.acquire()
+        port = None
         try:
-            if not proc.stdout:
-                return
-            for line in proc.stdout:
-                if "ready" in line.lower():
-                    ready.set()
-        except Exception:
-            pass
+            port = self._lease()
+            proc = _start_slipstream(exe, resolver_ip, domain, port)
+        except BaseException:
+            if port is not None:
+                self._release(port)
+            self.slots.release()
+            raise
+        with self.lock:
+            self.alive += 1
+            self.procs.add(proc)
+        return proc, port
+
+    def retire(self, proc: subprocess.Popen, port: int) -> None:
+        self.reap_q.put((proc, port))
+
+    def _reaper(self) -> None:
+        dying: List[Tuple[subprocess.Popen, int, float]] = []
+        while True:
+            try:
+                while True:
+                    proc, port = self.reap_q.get(timeout=(0.05 if dying else None))
+                    try:
+                        if proc.poll() is None:
+                            proc.terminate()
+                    except Exception:
+                        pass
+                    dying.append((proc, port, time.monotonic() + 2.0))
+                    if self.reap_q.empty():
+                        break
+            except Empty:
+                pass
+            now = time.monotonic()
+            still = []
+            for proc, port, kill_at in dying:
+                if proc.poll() is None:
+                    if now < kill_at:
+                        still.append((proc, port, kill_at))
+                        continue
+                    try:
+                        proc.kill()
+                        proc.wait(timeout=1)
+                    except Exception:
+                        pass
+                self._release(port)
+                with self.lock:
+                    self.alive -= 1
+                    self.procs.discard(proc)
+                self.slots.release()
+            dying = still
+
+    def kill_all(self) -> None:
+        # cancellation: children die now; tests blocked on them fail fast and retire them as usual
+        with self.lock:
+            procs = list(self.procs)
+        for proc in procs:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+    def close(self, timeout: float = 3.0) -> None:
+        # wait for outstanding teardowns so no child outlives the CLI
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with self.lock:
+                if self.alive <= 0:
+                    return
+            time.sleep(0.05)
+
+
+class _ConcurrencyRamp:
+    # --auto-ramp: one more worker per interval while CPU load and the failure ratio hold steady;
+    # on trouble step back once and keep that level
+    def __init__(self, start: int, max_n: int, interval_s: float = 3.0, max_load: float = 0.85, fail_margin: float = 0.15):
+        self.allowed = max(1, min(int(start), int(max_n)))
+        self.max_n = max(1, int(max_n))
+        self.interval = interval_s
+        self.max_load = max_load
+        self.fail_margin = fail_margin
+        self.held = False
+        self.mark = time.monotonic()
+        self.base: Optional[float] = None    # failure ratio before the last step up
+        self.seen = (0, 0)                   # (done, failed) at the last step
+
+    @staticmethod
+    def _load() -> float:
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            return 0.0     # no load average (Windows): ramp on failures only
+
+    def update(self, done: int, failed: int) -> int:
+        now = time.monotonic()
+        if self.held or now - self.mark < self.interval:
+            return self.allowed
+        d, f = done - self.seen[0], failed - self.seen[1]
+        if d < self.allowed:
+            return self.allowed     # not enough results at this level yet
+        ratio = f / d
+        self.mark, self.seen = now, (done, failed)
+        if self._load() > self.max_load or (self.base is not None and ratio > self.base + self.fail_margin):
+            self.allowed = max(1, self.allowed - 1)
+            self.held = True
+        elif self.allowed < self.max_n:
+            self.base = ratio if self.base is None else min(self.base, ratio)
+            self.allowed += 1
+        return self.allowed
+
+
+def _rt_score(ms: int, stats: Optional[tuple] = None) -> int:
+    # lower is better: scan RTT, plus jitter and loss penalties once --probes measured them
+    if ms < 0:
+        return 1 << 30
+    if not stats or not stats[0]:
+        return ms
+    sent, replies, _, jitter = stats
+    return ms + 2 * max(0, jitter) + (20 * 100 * (sent - replies)) // sent
+
+
+class _RealtestScheduler:
+    # - Bounded priority queue of RealPing candidates (ip ints), lowest score first
+    # - When full, "drop" discards the worst candidate (possibly the newcomer) for good,
+    #   "demote" parks it in an overflow that is only tested once the queue runs dry
+    # - The overflow holds at most as many as the queue; past that its worst candidate is dropped
+
+    def __init__(self, capacity: int, policy: str = "demote"):
+        self.cap = max(1, int(capacity))
+        self.policy = policy
+        self.items: List[Tuple[int, int, int]] = []   # sorted (score, seq, ip)
+        self.over: List[Tuple[int, int, int]] = []    # demoted, same order
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.closed = False
+        self.dropped = 0
+        self.demoted = 0
+
+    def __len__(self) -> int:
+        with self.cond:
+            return len(self.items) + len(self.over)
+
+    def put(self, ip: int, score: int) -> Optional[int]:
+        # returns the ip that left the queue for good (drop policy, or a full overflow), if any
+        with self.cond:
+            self.seq += 1
+            item = (score, self.seq, ip)
+            out = None
+            if len(self.items) < self.cap:
+                insort(self.items, item)
+            elif item >= self.items[-1]:
+                out = item
+            else:
+                out = self.items.pop()
+                insort(self.items, item)
+            if out is not None and self.policy == "demote":
+                self.demoted += 1
+                if len(self.over) < self.cap:
+                    insort(self.over, out)
+                    out = None
+                elif out < self.over[-1]:
+                    insort(self.over, out)
+                    out = self.over.pop()
+            if out is not None:
+                self.dropped += 1
+            self.cond.notify()
+            return out[2] if out is not None else None
+
+    def get(self, stop_evt: threading.Event) -> Optional[int]:
+        # blocks until a candidate is available; None once closed and empty (or stopped)
+        with self.cond:
+            while not stop_evt.is_set():
+                if not self.items and self.over:
+                    self.items, self.over = self.over, []
+                if self.items:
+                    return self.items.pop(0)[2]
+                if self.closed:
+                    return None
+                self.cond.wait(0.2)
+            return None
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
 
-    threading.Thread(target=_reader, daemon=True).start()
-    return proc, ready
 
 def _stop_proc(proc: Optional[subprocess.Popen]) -> None:
     if not proc:
@@ -289,125 +2439,798 @@ def _stop_proc(proc: Optional[subprocess.Popen]) -> None:
         except Exception:
             pass
 
-def _socks5_probe(proxy_port: int, timeout: float) -> bool:
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(timeout)
-    try:
-        s.connect(("127.0.0.1", int(proxy_port)))
-        s.sendall(b"\x05\x01\x00")
-        r = s.recv(2)
-        return len(r) == 2 and r[0] == 0x05 and r[1] == 0x00
-    finally:
-        try:
-            s.close()
-        except Exception:
-            pass
+class _PipeSink:
+    # one thread discards child output once readiness is known, so a chatty child never blocks on a full pipe
 
-def _wait_ready_or_socks(ev: threading.Event, port: int, timeout: float) -> bool:
-    end = time.monotonic() + timeout
-    while time.monotonic() < end:
-        if ev.is_set():
-            return True
-        try:
-            if _socks5_probe(port, 0.8):
-                return True
-        except Exception:
-            pass
-        time.sleep(0.2)
-    return False
+    def __init__(self):
+        self.add_q: "Queue" = Queue()
+        self.started = False
+        self.lock = threading.Lock()
 
-def _real_ping_via_socks(port: int, timeout: float, host: str, dst_port: int) -> Tuple[int, str]:
-    start = time.monotonic()
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def add(self, f) -> None:
+        self.add_q.put(f)
+        with self.lock:
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        sel = selectors.DefaultSelector()
+        while True:
+            while True:
+                try:
+                    sel.register(self.add_q.get_nowait(), selectors.EVENT_READ)
+                except Empty:
+                    break
+                except (ValueError, OSError):
+                    pass
+            if not sel.get_map():
+                try:
+                    sel.register(self.add_q.get(), selectors.EVENT_READ)
+                except (ValueError, OSError):
+                    pass
+                continue
+            for key, _ in sel.select(0.05):
+                try:
+                    chunk = os.read(key.fileobj.fileno(), 65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b""
+                if not chunk:
+                    sel.unregister(key.fileobj)
+                    try:
+                        key.fileobj.close()
+                    except Exception:
+                        pass
+
+_PIPE_SINK = _PipeSink()
+
+_CONNECT_PENDING = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)   # 10035: WSAEWOULDBLOCK
+_REALTEST_PHASES = ("spawn", "ready", "connect", "socks", "tls", "ttfb", "p50", "p95", "kBps", "cpu")
+
+def _wait_ready(proc: subprocess.Popen, port: int, timeout: float) -> Tuple[bool, Optional[socket.socket]]:
+    # Ready = "ready" on the child's stdout or the listener accepting a TCP connection, whichever comes first.
+    # Both are multiplexed on one selector; the accepted socket (if any) is handed back for the SOCKS session.
+    # Windows pipes aren't selectable, so there a reader thread feeds an Event and the loop polls it.
+    sel = selectors.DefaultSelector()
+    end = time.monotonic() + timeout
+    announced = threading.Event()
+    out = proc.stdout
+    if out is not None and os.name != "nt":
+        os.set_blocking(out.fileno(), False)
+        sel.register(out, selectors.EVENT_READ, "out")
+    elif out is not None:
+        def _reader():
+            try:
+                for line in out:
+                    if b"ready" in line.lower():
+                        announced.set()
+            except Exception:
+                pass
+        threading.Thread(target=_reader, daemon=True).start()
+    sock: Optional[socket.socket] = None
+    next_try = time.monotonic()
+    tail = b""
+    out_open = out is not None and os.name != "nt"
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= end or proc.poll() is not None:
+                return False, None
+            if sock is None and now >= next_try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex(("127.0.0.1", int(port)))
+                if err == 0:
+                    return True, sock
+                if err in _CONNECT_PENDING:
+                    sel.register(sock, selectors.EVENT_WRITE, "conn")
+                else:
+                    sock.close()
+                    sock = None
+                    next_try = now + 0.025
+            wait = end - now
+            if sock is None:
+                wait = min(wait, max(0.0, next_try - now))
+            if os.name == "nt":
+                wait = min(wait, 0.02)
+            if not sel.get_map():
+                # nothing to select on (refused connect, no selectable pipe): Windows' select() rejects an
+                # empty set with EINVAL, so sleep on the stdout event instead
+                announced.wait(wait)
+                events = []
+            else:
+                events = sel.select(wait)
+            for key, _ in events:
+                if key.data == "out":
+                    try:
+                        chunk = os.read(key.fileobj.fileno(), 4096)
+                    except BlockingIOError:
+                        continue
+                    if not chunk:
+                        sel.unregister(key.fileobj)
+                        out_open = False
+                        continue
+                    if b"ready" in (tail + chunk).lower():
+                        announced.set()
+                    tail = chunk[-5:]
+                elif sock is not None:
+                    sel.unregister(sock)
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        return True, sock
+                    sock.close()
+                    sock = None
+                    next_try = time.monotonic() + 0.025
+            if announced.is_set():
+                if sock is not None:
+                    sel.unregister(sock)
+                    sock.close()
+                return True, None
+    except BaseException:
+        if sock is not None:
+            sock.close()
+        raise
+    finally:
+        sel.close()
+        if out_open:
+            _PIPE_SINK.add(out)
+
+def _parse_url(v: str) -> Tuple[str, str, int, str]:
+    # -> (scheme, host, port, path); http or https only
+    u = urlsplit(v.strip())
+    if u.scheme not in ("http", "https") or not u.hostname:
+        raise argparse.ArgumentTypeError(f"invalid URL: {v!r} (use http://host[:port]/path or https://...)")
+    try:
+        port = u.port or (443 if u.scheme == "https" else 80)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid port in URL: {v!r}")
+    path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+    return u.scheme, u.hostname, port, path
+
+
+class _RealtestSpec:
+    # what a RealPing does once the tunnel is up; the defaults are the classic single generate_204 request
+    __slots__ = ("url", "samples", "download", "download_s", "insecure", "prefilter", "prefilter_ms")
+
+    def __init__(self, url: Optional[Tuple[str, str, int, str]] = None, samples: int = 1,
+                 download: Optional[Tuple[str, str, int, str]] = None, download_s: float = 5.0,
+                 insecure: bool = False, prefilter: Optional[_ProbeProfile] = None, prefilter_ms: int = 800):
+        self.url = url or ("https", "www.google.com", 443, "/generate_204")
+        self.samples = max(1, int(samples))
+        self.download = download
+        self.download_s = max(0.5, float(download_s))
+        self.insecure = bool(insecure)
+        self.prefilter = prefilter
+        self.prefilter_ms = int(prefilter_ms)
+
+
+_PREFILTER_PROBES = 2
+
+def _prefilter(ip: str, domain: str, profile: _ProbeProfile, timeout_ms: int) -> Optional[str]:
+    # a few tunnel-shaped queries before paying for slipstream-client; the rejection status, or None to go ahead
+    ok, detail, _, _ = multi_dns_tunnel_check(ip, domain, timeout_ms, _PREFILTER_PROBES, profile)
+    return None if ok else f"PREFILTER {detail}"
+
+
+# - One SSLContext per verification mode for the whole process (loading the CA bundle is the expensive part)
+# - The last TLS session per (host, port) is offered on the next handshake, so later RealPings resume
+#   instead of paying a full handshake; what's measured is then mostly the tunnel
+_TLS_LOCK = threading.Lock()
+_TLS_CTX = {}
+_TLS_SESSIONS = {}
+
+def _tls_context(insecure: bool = False) -> ssl.SSLContext:
+    with _TLS_LOCK:
+        ctx = _TLS_CTX.get(insecure)
+        if ctx is None:
+            ctx = ssl.create_default_context()
+            if insecure:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            _TLS_CTX[insecure] = ctx
+        return ctx
+
+def _keep_tls_session(conn, host: str, port: int, insecure: bool) -> None:
+    sess = getattr(conn, "session", None)
+    if sess is not None:
+        with _TLS_LOCK:
+            _TLS_SESSIONS[(host, port, insecure)] = sess
+
+
+def _socks_connect(port: int, timeout: float, host: str, dst_port: int, sock: Optional[socket.socket] = None,
+                   lap: Optional[Callable[[str], None]] = None) -> Optional[socket.socket]:
+    # SOCKS5 greeting + CONNECT through the local slipstream listener; None if the proxy refuses
+    s = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.settimeout(timeout)
     try:
-        s.connect(("127.0.0.1", int(port)))
+        if sock is None:
+            s.connect(("127.0.0.1", int(port)))
 
         s.sendall(b"\x05\x01\x00")
         r = s.recv(2)
         if len(r) != 2 or r[1] != 0x00:
-            return -1, "SOCKS FAIL"
+            s.close()
+            return None
+        if lap:
+            lap("connect")
 
         hb = host.encode("utf-8", "ignore")
         req = b"\x05\x01\x00\x03" + bytes([len(hb)]) + hb + int(dst_port).to_bytes(2, "big")
         s.sendall(req)
         rep = s.recv(10)
         if len(rep) < 2 or rep[1] != 0x00:
+            s.close()
+            return None
+        if lap:
+            lap("socks")
+        return s
+    except BaseException:
+        s.close()
+        raise
+
+def _open_url(port: int, timeout: float, url: Tuple[str, str, int, str], sock: Optional[socket.socket] = None,
+              lap: Optional[Callable[[str], None]] = None, insecure: bool = False):
+    scheme, host, dst_port, _ = url
+    s = _socks_connect(port, timeout, host, dst_port, sock, lap)
+    if s is None or scheme != "https":
+        return s
+    with _TLS_LOCK:
+        sess = _TLS_SESSIONS.get((host, dst_port, insecure))
+    try:
+        tls = _tls_context(insecure).wrap_socket(s, server_hostname=host, session=sess)
+    except BaseException:
+        s.close()
+        raise
+    if lap:
+        lap("tls")
+    return tls
+
+def _http_request(url: Tuple[str, str, int, str], keep_alive: bool) -> bytes:
+    _, host, port, path = url
+    host_h = host if port in (80, 443) else f"{host}:{port}"
+    conn_h = "keep-alive" if keep_alive else "close"
+    return f"GET {path} HTTP/1.1\r\nHost: {host_h}\r\nConnection: {conn_h}\r\n\r\n".encode("ascii", "ignore")
+
+def _read_http_response(conn, deadline: Optional[float] = None,
+                        on_first: Optional[Callable[[], None]] = None) -> Tuple[int, bool]:
+    # reads one response -> (body bytes, connection reusable); without Content-Length reads to close/deadline
+    buf = b""
+    while b"\r\n\r\n" not in buf:
+        d = conn.recv(4096)
+        if not d:
+            raise ConnectionError("connection closed before response headers")
+        if not buf and on_first:
+            on_first()
+        buf += d
+    head, _, body = buf.partition(b"\r\n\r\n")
+    lines = head.lower().split(b"\r\n")
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        raise ConnectionError("bad HTTP status line")
+    length: Optional[int] = None
+    reusable = True
+    for ln in lines[1:]:
+        k, _, v = ln.partition(b":")
+        k, v = k.strip(), v.strip()
+        if k == b"content-length" and v.isdigit():
+            length = int(v)
+        elif k == b"connection" and v == b"close":
+            reusable = False
+        elif k == b"transfer-encoding" and v != b"identity":
+            length = None
+            reusable = False
+    if status in (204, 304) or status < 200:
+        length = 0
+    if length is None:
+        reusable = False
+    got = len(body)
+    while (length is None or got < length) and (deadline is None or time.monotonic() < deadline):
+        d = conn.recv(65536)
+        if not d:
+            break
+        got += len(d)
+    if length is not None and got < length:
+        reusable = False
+    return got, reusable
+
+def _percentile(sorted_vals: List[int], q: float) -> int:
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+def _real_ping_via_socks(port: int, timeout: float, spec: Optional[_RealtestSpec] = None,
+                         sock: Optional[socket.socket] = None, phases: Optional[dict] = None) -> Tuple[int, str]:
+    # phases (ms): connect = TCP + SOCKS greeting, socks = CONNECT reply, tls = handshake, ttfb = first response byte;
+    # with spec.samples > 1 also p50/p95 over keep-alive requests (then the returned ms is p50), and kBps for a download
+    spec = spec or _RealtestSpec()
+    start = time.monotonic()
+    cpu0 = time.thread_time()
+    mark = start
+    ph = phases if phases is not None else {}
+
+    def lap(name: str) -> None:
+        nonlocal mark
+        now = time.monotonic()
+        ph[name] = int((now - mark) * 1000)
+        mark = now
+
+    conn = None
+    try:
+        conn = _open_url(port, timeout, spec.url, sock, lap, spec.insecure)
+        if conn is None:
             return -1, "SOCKS FAIL"
 
-        tls = ssl.create_default_context().wrap_socket(s, server_hostname=host)
-        tls.sendall(b"GET /generate_204 HTTP/1.1\r\nHost: www.google.com\r\nConnection: close\r\n\r\n")
-        tls.recv(64)
-        tls.close()
+        samples: List[int] = []
+        for n in range(spec.samples):
+            more = n + 1 < spec.samples
+            if conn is None:
+                # the server wouldn't keep the connection alive: same tunnel, new stream
+                conn = _open_url(port, timeout, spec.url, insecure=spec.insecure)
+                if conn is None:
+                    return -1, "SOCKS FAIL"
+            t = time.monotonic()
+            conn.sendall(_http_request(spec.url, more))
+            _, reusable = _read_http_response(conn, on_first=(lambda: lap("ttfb")) if n == 0 else None)
+            samples.append(int((time.monotonic() - t) * 1000))
+            _keep_tls_session(conn, spec.url[1], spec.url[2], spec.insecure)
+            if not (more and reusable):
+                conn.close()
+                conn = None
 
         ms = int((time.monotonic() - start) * 1000)
+        # our own CPU time inside the measured window (parsing, TLS crypto); near 0 means ms is all network
+        ph["cpu"] = int((time.thread_time() - cpu0) * 1000)
+        if spec.samples > 1:
+            srt = sorted(samples)
+            ph["p50"] = ms = _percentile(srt, 0.5)
+            ph["p95"] = _percentile(srt, 0.95)
+
+        if spec.download:
+            try:
+                dl = _open_url(port, timeout, spec.download, insecure=spec.insecure)
+                if dl is not None:
+                    try:
+                        t = time.monotonic()
+                        dl.sendall(_http_request(spec.download, False))
+                        got, _ = _read_http_response(dl, deadline=t + spec.download_s)
+                        _keep_tls_session(dl, spec.download[1], spec.download[2], spec.insecure)
+                        ph["kBps"] = int(got / 1024 / max(0.001, time.monotonic() - t))
+                    finally:
+                        dl.close()
+            except Exception:
+                pass    # a failed download doesn't fail the RealPing; there's just no kBps
+
         return ms, f"{ms} ms"
     except socket.timeout:
         return -1, "TIMEOUT"
     except Exception:
         return -1, "ERROR"
     finally:
-        try:
-            s.close()
-        except Exception:
-            pass
-
-def realtest_one(ip: str, domain: str, exe: str, ready_ms: int, timeout_s: float) -> Tuple[str, str]:
-    port = _free_port()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+def _fmt_phases(phases: dict) -> str:
+    return " ".join(f"{k}={phases[k]}" for k in _REALTEST_PHASES if k in phases)
+
+def realtest_one(ip: str, domain: str, exe: str, ready_ms: int, timeout_s: float,
+                 pool: Optional[_SlipstreamPool] = None, phases: Optional[dict] = None,
+                 spec: Optional[_RealtestSpec] = None) -> Tuple[str, str]:
+    # phases, if given, receives per-step ms: spawn, ready, connect, socks, tls, ttfb (+ p50/p95/kBps, see spec)
+    ph = phases if phases is not None else {}
+    if spec is not None and spec.prefilter is not None:
+        bad = _prefilter(ip, domain, spec.prefilter, spec.prefilter_ms)
+        if bad is not None:
+            return bad, "-"
     proc = None
+    port = 0
     try:
-        proc, ev = _start_slipstream(exe, ip, domain, port)
-        if not _wait_ready_or_socks(ev, port, max(0.2, ready_ms / 1000.0)):
+        t0 = time.monotonic()
+        if pool is not None:
+            proc, port = pool.spawn(exe, ip, domain)
+        else:
+            port = _free_port()
+            proc = _start_slipstream(exe, ip, domain, port)
+        t1 = time.monotonic()
+        ph["spawn"] = int((t1 - t0) * 1000)
+        ready, sock = _wait_ready(proc, port, max(0.2, ready_ms / 1000.0))
+        ph["ready"] = int((time.monotonic() - t1) * 1000)
+        if not ready:
             return "READY TIMEOUT", "-"
-        ms, st = _real_ping_via_socks(port, timeout_s, "www.google.com", 443)
+        ms, st = _real_ping_via_socks(port, timeout_s, spec, sock, ph)
         return st, ("-" if ms < 0 else str(ms))
     except FileNotFoundError:
         return "SLIPSTREAM NOT FOUND", "-"
+    except _NoFreePort:
+        return "NO PORT", "-"
+    except OSError as e:
+        # exec/permission trouble starting the client, or a socket error during the test
+        name = errno.errorcode.get(e.errno, type(e).__name__) if e.errno else type(e).__name__
+        return f"{'SPAWN' if proc is None else 'TEST'} ERROR {name}", "-"
     finally:
-        _stop_proc(proc)
+        if pool is not None and proc is not None:
+            pool.retire(proc, port)
+        else:
+            _stop_proc(proc)
 
 
 # ========================= Output Writers =========================
 
-def _open_text_out(path: str):
-    if not path:
-        return None
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    return open(path, "w", encoding="utf-8", newline="\n")
-
 def _fmt_ipms(ip: str, ms: str) -> str:
     # ms may be '-' or numeric string
     return f"{ip} {ms}".strip()
 
 
+# - --results-out keeps every scan/RealPing result, not just the OK list; repeat it for several formats
+# - Format comes from a 'ndjson:'/'csv:'/'bin:' prefix or the extension (.jsonl/.ndjson, .csv, .bin)
+# - bin: b"SLPRES1\n", then records; scan = _SINK_SCAN (kind 0, ip, unix ts, status code, ms,
+#   sent, replies (u16), min ms, jitter ms), realtest = _SINK_RT (kind 1, ip, ts, ms, one int per _REALTEST_PHASES,
+#   -1 = n/a) followed by a length byte and the status text; ints are big-endian, -1 = none
+# - All files (the OK lists too) are written by one background thread, flushed every --results-flush-s
+
+_SINK_FORMATS = {"ndjson": "ndjson", "jsonl": "ndjson", "json": "ndjson", "csv": "csv", "bin": "bin"}
+_SINK_MAGIC = b"SLPRES1\n"
+_SINK_SCAN = struct.Struct("!BIdBiHHii")
+_SINK_RT = struct.Struct("!BIdi" + "i" * len(_REALTEST_PHASES))
+_SINK_COLUMNS = ["type", "ts", "ip", "status", "rcode", "ms", "sent", "replies", "min_ms", "jitter_ms"] + list(_REALTEST_PHASES)
+
+def _parse_sink_spec(spec: str) -> Tuple[str, str]:
+    head, sep, rest = spec.partition(":")
+    if sep and head.lower() in _SINK_FORMATS and rest:
+        return _SINK_FORMATS[head.lower()], rest
+    ext = os.path.splitext(spec)[1].lstrip(".").lower()
+    if ext not in _SINK_FORMATS:
+        raise ValueError(f"can't tell the format of {spec!r}; use a .jsonl/.csv/.bin name or a ndjson:/csv:/bin: prefix")
+    return _SINK_FORMATS[ext], spec
+
+def _rt_ms_int(ms: str) -> int:
+    try:
+        return int(ms)
+    except (TypeError, ValueError):
+        return -1
+
+class _NdjsonSink:
+    def __init__(self, f):
+        self.f = f
+
+    def scan(self, ts: float, ip_n: int, code: int, ms: int, stats: Optional[tuple]) -> None:
+        rec = {"type": "scan", "ts": round(ts, 3), "ip": _int_to_ip(ip_n), "status": _STATUS_TEXT[code],
+               "rcode": _STATUS_RCODE.get(code), "ms": ms if ms >= 0 else None}
+        if stats:
+            rec["sent"], rec["replies"], rec["min_ms"], rec["jitter_ms"] = stats
+        self.f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+
+    def rt(self, ts: float, ip: str, status: str, ms: str, phases: dict) -> None:
+        ms_i = _rt_ms_int(ms)
+        rec = {"type": "realtest", "ts": round(ts, 3), "ip": ip, "status": status,
+               "ms": ms_i if ms_i >= 0 else None, "phases": phases}
+        self.f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+
+class _CsvSink:
+    def __init__(self, f):
+        self.f = f
+        self.w = csv.writer(f, lineterminator="\n")
+        if f.tell() == 0:
+            self.w.writerow(_SINK_COLUMNS)
+
+    def scan(self, ts: float, ip_n: int, code: int, ms: int, stats: Optional[tuple]) -> None:
+        sent, replies, mn, jitter = stats or ("", "", "", "")
+        self.w.writerow(["scan", f"{ts:.3f}", _int_to_ip(ip_n), _STATUS_TEXT[code], _STATUS_RCODE.get(code, ""),
+                         ms if ms >= 0 else "", sent, replies, mn, jitter] + [""] * len(_REALTEST_PHASES))
+
+    def rt(self, ts: float, ip: str, status: str, ms: str, phases: dict) -> None:
+        ms_i = _rt_ms_int(ms)
+        self.w.writerow(["realtest", f"{ts:.3f}", ip, status, "", ms_i if ms_i >= 0 else "", "", "", "", ""] +
+                        [phases.get(k, "") for k in _REALTEST_PHASES])
+
+class _BinSink:
+    def __init__(self, f):
+        self.f = f
+        if f.tell() == 0:
+            f.write(_SINK_MAGIC)
+
+    def scan(self, ts: float, ip_n: int, code: int, ms: int, stats: Optional[tuple]) -> None:
+        sent, replies, mn, jitter = stats or (0, 0, -1, -1)
+        self.f.write(_SINK_SCAN.pack(0, ip_n, ts, code, ms, sent, replies, mn, jitter))
+
+    def rt(self, ts: float, ip: str, status: str, ms: str, phases: dict) -> None:
+        st = status.encode("utf-8")[:255]
+        self.f.write(_SINK_RT.pack(1, _ip_to_int(ip), ts, _rt_ms_int(ms), *(int(phases.get(k, -1)) for k in _REALTEST_PHASES)))
+        self.f.write(bytes((len(st),)) + st)
+
+class _ResultWriter:
+    # one thread owns every output file; the result loop only queues small tuples
+    # ("scan", ts, ip_n, code, ms, stats), ("rt", ts, ip, status, ms, phases) or (list key, line)
+    def __init__(self, flush_s: float = 1.0, fsync: str = "never"):
+        self.flush_s = max(0.05, float(flush_s))
+        self.fsync = fsync
+        self.q: "Queue[Optional[tuple]]" = Queue(maxsize=65536)
+        self.sinks = []
+        self.lists = {}
+        self.files = []
+        self.error: Optional[Exception] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def _open(self, path: str, binary: bool, append: bool):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        mode = ("a" if append else "w") + ("b" if binary else "")
+        if binary:
+            f = open(path, mode, buffering=1 << 20)
+        else:
+            f = open(path, mode, buffering=1 << 20, encoding="utf-8", newline="\n")
+        self.files.append(f)
+        return f
+
+    def add_sink(self, spec: str, append: bool = False) -> None:
+        fmt, path = _parse_sink_spec(spec)
+        f = self._open(path, fmt == "bin", append)
+        self.sinks.append({"ndjson": _NdjsonSink, "csv": _CsvSink, "bin": _BinSink}[fmt](f))
+
+    def add_list(self, key: str, path: str, append: bool = False) -> None:
+        self.lists[key] = self._open(path, False, append)
+
+    def start(self) -> None:
+        if self.files and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def scan(self, ip_n: int, code: int, ms: int, stats: Optional[tuple]) -> None:
+        if self.sinks:
+            self.q.put(("scan", time.time(), ip_n, code, ms, stats))
+
+    def rt(self, ip: str, status: str, ms: str, phases: Optional[dict]) -> None:
+        if self.sinks:
+            self.q.put(("rt", time.time(), ip, status, ms, phases or {}))
+
+    def line(self, key: str, text: str) -> None:
+        if key in self.lists:
+            self.q.put((key, text))
+
+    def _write(self, item: tuple) -> None:
+        kind = item[0]
+        if kind == "scan":
+            for sink in self.sinks:
+                sink.scan(*item[1:])
+        elif kind == "rt":
+            for sink in self.sinks:
+                sink.rt(*item[1:])
+        else:
+            self.lists[kind].write(item[1] + "\n")
+
+    def _flush(self, sync: bool) -> None:
+        for f in self.files:
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_s
+        while True:
+            items = []
+            try:
+                items.append(self.q.get(timeout=max(0.01, next_flush - time.monotonic())))
+                while len(items) < 4096:
+                    items.append(self.q.get_nowait())
+            except Empty:
+                pass
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                elif self.error is None:
+                    try:
+                        self._write(item)
+                    except Exception as e:
+                        # keep draining so the result loop never blocks on a dead disk or a bad record
+                        self.error = e
+                        print(f"WARN: result output failed: {e}", file=sys.stderr)
+            if stop or time.monotonic() >= next_flush:
+                if self.error is None:
+                    try:
+                        self._flush(self.fsync == "interval")
+                    except Exception as e:
+                        self.error = e
+                        print(f"WARN: result output failed: {e}", file=sys.stderr)
+                next_flush = time.monotonic() + self.flush_s
+            if stop:
+                return
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.q.put(None)
+            self.thread.join()
+            self.thread = None
+        for f in self.files:
+            try:
+                f.flush()
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+                f.close()
+            except (OSError, ValueError):
+                pass
+        self.files = []
+
+
+
+# ========================= Metrics endpoint (--metrics-port) =========================
+# - OpenMetrics text on http://ADDR:PORT/metrics, served from a daemon thread; off unless asked for
+# - Counters and histograms are fed from the result loop (the one thread that sees every result);
+#   gauges are callables read at scrape time (queue depths, in-flight probes, pool occupancy)
+# - Times are in seconds, as OpenMetrics expects
+
+_RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)
+_SPAWN_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+def _om_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}       # name -> (type, help), exposition order
+        self.counters = {}   # name -> {labels: value}
+        self.gauges = {}     # name -> callable
+        self.hists = {}      # name -> [bounds, bucket counts, sum, count]
+
+    def counter(self, name: str, help_: str) -> None:
+        self.meta[name] = ("counter", help_)
+        self.counters.setdefault(name, {})
+
+    def gauge(self, name: str, help_: str, fn: Callable[[], float]) -> None:
+        self.meta[name] = ("gauge", help_)
+        self.gauges[name] = fn
+
+    def histogram(self, name: str, help_: str, bounds: Tuple[float, ...]) -> None:
+        self.meta[name] = ("histogram", help_)
+        self.hists[name] = [bounds, [0] * (len(bounds) + 1), 0.0, 0]
+
+    def inc(self, name: str, n: int = 1, labels: Tuple[Tuple[str, str], ...] = ()) -> None:
+        with self.lock:
+            c = self.counters[name]
+            c[labels] = c.get(labels, 0) + n
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            h = self.hists[name]
+            h[1][bisect_left(h[0], value)] += 1
+            h[2] += value
+            h[3] += 1
+
+    def render(self) -> str:
+        with self.lock:
+            counters = {k: dict(v) for k, v in self.counters.items()}
+            hists = {k: (h[0], list(h[1]), h[2], h[3]) for k, h in self.hists.items()}
+        out = []
+        for name, (kind, help_) in list(self.meta.items()):
+            if kind == "gauge":
+                try:
+                    val = self.gauges[name]()
+                except Exception:
+                    continue
+                out.append(f"# TYPE {name} gauge\n# HELP {name} {help_}\n{name} {val}")
+            elif kind == "counter":
+                out.append(f"# TYPE {name} counter\n# HELP {name} {help_}")
+                for labels, val in sorted(counters[name].items()):
+                    out.append(f"{name}_total{_om_labels(labels)} {val}")
+            else:
+                bounds, counts, total, n = hists[name]
+                out.append(f"# TYPE {name} histogram\n# HELP {name} {help_}")
+                acc = 0
+                for b, c in zip(bounds, counts):
+                    acc += c
+                    out.append(f'{name}_bucket{{le="{b}"}} {acc}')
+                out.append(f'{name}_bucket{{le="+Inf"}} {n}\n{name}_sum {round(total, 6)}\n{name}_count {n}')
+        out.append("# EOF\n")
+        return "\n".join(out)
+
+    def observe_realtest(self, status: str, ms: str, phases: dict) -> None:
+        result = "ok" if status.endswith(" ms") else ("prefiltered" if status.startswith("PREFILTER") else "fail")
+        self.inc("slipscan_realtests", labels=(("result", result),))
+        if status.endswith(" ms"):
+            self.observe("slipscan_realping_seconds", int(ms) / 1000.0)
+        if "spawn" in phases:
+            self.observe("slipscan_slipstream_spawn_seconds", phases["spawn"] / 1000.0)
+        if "ready" in phases:
+            self.observe("slipscan_slipstream_ready_seconds", phases["ready"] / 1000.0)
+
+    def add_realtest(self, pool: Optional["_SlipstreamPool"]) -> None:
+        self.counter("slipscan_realtests", "Finished RealPing tests by result")
+        self.histogram("slipscan_realping_seconds", "RealPing latency of successful tests", _RTT_BUCKETS)
+        self.histogram("slipscan_slipstream_spawn_seconds", "Time to start slipstream-client", _SPAWN_BUCKETS)
+        self.histogram("slipscan_slipstream_ready_seconds", "Time until slipstream-client reported ready", _SPAWN_BUCKETS)
+        if pool is not None:
+            self.gauge("slipscan_slipstream_procs", "slipstream-client children alive (incl. shutting down)",
+                       lambda: pool.alive)
+            self.gauge("slipscan_slipstream_pool_size", "Max slipstream-client children", lambda: pool.size)
+
+def _serve_metrics(metrics: _Metrics, addr: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer((addr, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
 
 # ========================= Rich Dashboard =========================
 # - Table shows ONLY Scan-OK IPs
 # - RealPing "Now" ticker line (moving)
 # - RealPing OK rows in GREEN
 
+_MANUAL_CODE = -2   # realtest command: rows come from a list, not a scan
+
+class _DashRow:
+    # one table row, kept as ints (-1 = not measured) and formatted only when rendered
+    __slots__ = ("scan_ms", "scan_code", "stats", "rt_ms", "rt_st")
+
+    def __init__(self):
+        self.scan_ms = -1
+        self.scan_code = -1
+        self.stats: Optional[tuple] = None
+        self.rt_ms = -1
+        self.rt_st = ""
+
+
 class RichDashboard:
-    def __init__(self, total_scan: int, table_keep: int = 1500):
+    # - Updates come from the result loop and only touch counters/rows under self.lock
+    # - render() copies a snapshot under the lock and builds the Rich tree outside it; Live calls it
+    #   on its own refresh thread, so drawing never sits on the result hot path
+    # - headless=True (no --ui): counters only, no table rows and no Progress
+    def __init__(self, total_scan: int, table_keep: int = 1500, headless: bool = False, label: str = "Scan"):
         self.console = Console(stderr=True)
         self.total_scan = max(1, int(total_scan))
+        self.label = label      # names the first counter line: "Scan", or "Realtest" for IPs read by realtest
+        self.lock = threading.Lock()
+        self.headless = bool(headless)
 
         self.scan_done = 0
         self.scan_ok = 0
         self.scan_fail = 0
+        self.scan_skip = 0
 
         self.rt_done = 0
         self.rt_ok = 0
         self.rt_fail = 0
 
         self.rt_enqueued = 0  # for live mode display
+        self.rt_queued = 0    # waiting in the RealPing scheduler
+        self.rt_dropped = 0
+        self.rt_phase_sum = {}   # phase -> total ms over finished RealPings
+        self.rt_phase_n = {}
 
-        self.rows_ok = {}      # ip -> dict(scan_ms, scan_st, rt_ms, rt_st)
+        self.rows_ok = {}      # ip int -> _DashRow, only the last table_keep OK IPs
+        self.show_probes = False  # --probes N: loss/jitter columns
         self.order_ok = deque()
-        self.table_keep = int(table_keep)
+        self.table_keep = 0 if self.headless else int(table_keep)
 
         self.current_rt_ip: str = ""
         self._marquee_tick = 0
 
+        self.rate_cap = 0        # pps, 0 = unlimited
+        self.rate_now = 0
+        self.rate_backoffs = 0
+        self.rate_event = ""
+
+        self.progress = None
+        if self.headless:
+            return
         self.progress = Progress(
             SpinnerColumn(),
             TextColumn("[bold cyan]Slipstreamplus-CLI[/bold cyan]"),
@@ -420,25 +3243,50 @@ class RichDashboard:
         )
         self.task = self.progress.add_task("scan", total=self.total_scan)
 
-    def _touch_ok(self, ip: str):
-        if ip in self.rows_ok:
-            return
-        self.rows_ok[ip] = {"scan_ms": "-", "scan_st": "-", "rt_ms": "-", "rt_st": "-"}
+    def set_total(self, total: int):
+        self.total_scan = max(1, int(total))
+
+    def _touch_ok(self, ip: int) -> Optional[_DashRow]:
+        row = self.rows_ok.get(ip)
+        if row is not None or not self.table_keep:
+            return row
+        row = self.rows_ok[ip] = _DashRow()
         self.order_ok.append(ip)
         while len(self.order_ok) > self.table_keep:
             old = self.order_ok.popleft()
             self.rows_ok.pop(old, None)
+        return row
+
+    def update_scan(self, ip: int, scan_ms: int, code: int, ok: bool, stats: Optional[tuple] = None):
+        with self.lock:
+            self.scan_done += 1
+            if ok:
+                self.scan_ok += 1
+                row = self._touch_ok(ip)
+                if row is not None:
+                    row.scan_ms = scan_ms
+                    row.scan_code = code
+                    row.stats = stats
+            elif code == _STATUS_CODE["SKIP"]:
+                self.scan_skip += 1
+            else:
+                self.scan_fail += 1
 
-    def update_scan(self, ip: str, scan_ms: str, scan_status: str, ok: bool):
-        self.scan_done += 1
-        if ok:
-            self.scan_ok += 1
-            self._touch_ok(ip)
-            self.rows_ok[ip]["scan_ms"] = scan_ms
-            self.rows_ok[ip]["scan_st"] = scan_status
-        else:
-            self.scan_fail += 1
-        self.progress.update(self.task, completed=self.scan_done)
+    def add_manual(self, ip: int):
+        self.update_scan(ip, -1, _MANUAL_CODE, True)
+
+    def restore_scan(self, done: int, ok: int, fail: int, skip: int):
+        with self.lock:
+            self.scan_done = int(done)
+            self.scan_ok = int(ok)
+            self.scan_fail = int(fail)
+            self.scan_skip = int(skip)
+
+    def restore_realtest(self, ok: int, fail: int):
+        with self.lock:
+            self.rt_ok = int(ok)
+            self.rt_fail = int(fail)
+            self.rt_done = self.rt_ok + self.rt_fail
 
     def set_current_realtest(self, ip: str):
         self.current_rt_ip = ip or ""
@@ -446,16 +3294,38 @@ class RichDashboard:
     def inc_rt_enq(self):
         self.rt_enqueued += 1
 
-    def update_realtest(self, ip: str, rt_ms: str, rt_status: str, ok: bool):
-        self._touch_ok(ip)
-        self.rows_ok[ip]["rt_ms"] = rt_ms
-        self.rows_ok[ip]["rt_st"] = rt_status
-
-        self.rt_done += 1
-        if ok:
-            self.rt_ok += 1
-        else:
-            self.rt_fail += 1
+    def update_rate(self, rate_now: float, rate_cap: float, backoffs: int = 0, event: str = ""):
+        self.rate_now = int(rate_now)
+        self.rate_cap = int(rate_cap)
+        self.rate_backoffs = int(backoffs)
+        self.rate_event = event or ""
+
+    def update_realtest(self, ip: str, rt_ms: str, rt_status: str, ok: bool, phases: Optional[dict] = None):
+        with self.lock:
+            for k, v in (phases or {}).items():
+                self.rt_phase_sum[k] = self.rt_phase_sum.get(k, 0) + v
+                self.rt_phase_n[k] = self.rt_phase_n.get(k, 0) + 1
+            row = self._touch_ok(_ip_to_int(ip))
+            if row is not None:
+                row.rt_ms = _rt_ms_int(rt_ms)
+                row.rt_st = rt_status
+
+            self.rt_done += 1
+            if ok:
+                self.rt_ok += 1
+            else:
+                self.rt_fail += 1
+
+    def summary(self) -> str:
+        # one plain line for headless runs, in place of the final panel
+        line = f"{self.label}: {self.scan_done}/{self.total_scan} OK={self.scan_ok} FAIL={self.scan_fail}"
+        if self.scan_skip:
+            line += f" SKIP={self.scan_skip}"
+        if self.rt_done or self.rt_enqueued:
+            line += f" | RealPing: DONE={self.rt_done} OK={self.rt_ok} FAIL={self.rt_fail}"
+            if self.rt_dropped:
+                line += f" dropped={self.rt_dropped}"
+        return line
 
     def _marquee_line(self, width: int = 78) -> Text:
         base = "RealPing Now: "
@@ -471,6 +3341,14 @@ class RichDashboard:
         return Text(view, style="bold yellow")
 
     def render(self, subtitle: str = "") -> Panel:
+        with self.lock:
+            scan_done, scan_ok, scan_fail, scan_skip = self.scan_done, self.scan_ok, self.scan_fail, self.scan_skip
+            rt_done, rt_ok, rt_fail = self.rt_done, self.rt_ok, self.rt_fail
+            avg = {k: self.rt_phase_sum[k] // self.rt_phase_n[k] for k in self.rt_phase_n}
+            rows = [(ip, r.scan_ms, r.scan_code, r.stats, r.rt_ms, r.rt_st)
+                    for ip in list(self.order_ok)[-70:] for r in (self.rows_ok[ip],)]
+        self.progress.update(self.task, total=self.total_scan, completed=scan_done)
+
         header = Text()
         header.append("Slipstreamplus-CLI\n", style="bold cyan")
         header.append("Coded By : Farhad-UK", style="bold green")
@@ -478,40 +3356,62 @@ class RichDashboard:
             header.append(f"\n{subtitle}", style="dim")
 
         stats = Text()
-        stats.append("Scan: ", style="bold")
-        stats.append(f"{self.scan_done}/{self.total_scan}  ", style="bold")
-        stats.append(f"OK={self.scan_ok} ", style="green")
-        stats.append(f"FAIL={self.scan_fail}\n", style="red")
+        stats.append(f"{self.label}: ", style="bold")
+        stats.append(f"{scan_done}/{self.total_scan}  ", style="bold")
+        stats.append(f"OK={scan_ok} ", style="green")
+        stats.append(f"FAIL={scan_fail}", style="red")
+        if scan_skip:
+            stats.append(f" SKIP={scan_skip}", style="dim")
+        stats.append("\n")
 
         stats.append("RealPing: ", style="bold")
         if self.rt_enqueued > 0:
-            stats.append(f"DONE={self.rt_done}/{self.rt_enqueued}  ", style="bold")
+            stats.append(f"DONE={rt_done}/{self.rt_enqueued}  ", style="bold")
         else:
-            stats.append(f"DONE={self.rt_done}  ", style="bold")
-        stats.append(f"OK={self.rt_ok} ", style="green")
-        stats.append(f"FAIL={self.rt_fail}", style="red")
+            stats.append(f"DONE={rt_done}  ", style="bold")
+        stats.append(f"OK={rt_ok} ", style="green")
+        stats.append(f"FAIL={rt_fail}", style="red")
+        if self.rt_queued or self.rt_dropped:
+            stats.append(f"  queued={self.rt_queued}", style="dim")
+            if self.rt_dropped:
+                stats.append(f" dropped={self.rt_dropped}", style="yellow")
+        if avg:
+            stats.append(f"\nRealPing avg ms: {_fmt_phases(avg)}", style="dim")
+
+        if self.rate_cap > 0:
+            stats.append("\nRate: ", style="bold")
+            stats.append(f"{self.rate_now}/{self.rate_cap} pps  ", style="bold")
+            stats.append(f"backoffs={self.rate_backoffs}", style=("yellow" if self.rate_backoffs else "dim"))
+            if self.rate_event:
+                stats.append(f"  last: {self.rate_event}", style="dim")
 
         table = Table(show_header=True, header_style="bold magenta", expand=True)
         table.add_column("IP", style="bold", no_wrap=True)
         table.add_column("Scan ms", justify="right")
         table.add_column("Scan Status")
+        if self.show_probes:
+            table.add_column("Loss", justify="right")
+            table.add_column("Jitter", justify="right")
         table.add_column("RealPing ms", justify="right")
         table.add_column("RealPing Status")
 
-        ips = list(self.order_ok)[-70:]
-        for ip in ips:
-            d = self.rows_ok.get(ip, {})
-            scan_ms = str(d.get("scan_ms", "-"))
-            scan_st = str(d.get("scan_st", "-"))
-            rt_ms = str(d.get("rt_ms", "-"))
-            rt_st = str(d.get("rt_st", "-"))
+        for ip_n, scan_ms_i, code, pstats, rt_ms_i, rt_st in rows:
+            scan_ms = "-" if scan_ms_i < 0 else str(scan_ms_i)
+            scan_st = _STATUS_TEXT[code] if code >= 0 else ("(manual list)" if code == _MANUAL_CODE else "-")
+            rt_ms = "-" if rt_ms_i < 0 else str(rt_ms_i)
+            rt_st = rt_st or "-"
 
             is_rt_ok = (" ms" in rt_st)
-            ip_cell = Text(ip, style=("bold green" if is_rt_ok else "bold"))
+            ip_cell = Text(_int_to_ip(ip_n), style=("bold green" if is_rt_ok else "bold"))
             rt_ms_cell = Text(rt_ms, style=("green" if is_rt_ok else ""))
             rt_st_cell = Text(rt_st, style=("green" if is_rt_ok else ("red" if rt_st not in ("-", "") else "")))
 
-            table.add_row(ip_cell, scan_ms, scan_st, rt_ms_cell, rt_st_cell)
+            if self.show_probes:
+                loss, jitter = _fmt_probe_stats(pstats)
+                loss_cell = Text(loss, style=("yellow" if loss not in ("-", "0%") else ""))
+                table.add_row(ip_cell, scan_ms, scan_st, loss_cell, jitter, rt_ms_cell, rt_st_cell)
+            else:
+                table.add_row(ip_cell, scan_ms, scan_st, rt_ms_cell, rt_st_cell)
 
         grid = Table.grid(expand=True)
         grid.add_row(header)
@@ -523,9 +3423,43 @@ class RichDashboard:
         return Panel(grid, border_style="cyan", padding=(1, 2))
 
 
+def _live_view(dash: RichDashboard, subtitle: Callable[[], str], fps: float, prof: Optional[_Profiler] = None):
+    # Rich pulls a fresh render on its own thread at a fixed rate; headless runs never touch Live
+    if dash.headless:
+        return contextlib.nullcontext()
+
+    def renderable():
+        if prof is None:
+            return dash.render(subtitle())
+        mark = prof.begin()
+        panel = dash.render(subtitle())
+        prof.end("render", mark)
+        return panel
+
+    return Live(get_renderable=renderable, refresh_per_second=max(0.5, float(fps)),
+                console=dash.console, screen=False, transient=False)
+
+def _final_view(dash: RichDashboard, subtitle: str) -> None:
+    if dash.headless:
+        print(dash.summary(), file=sys.stderr)
+    else:
+        dash.console.print(dash.render(subtitle))
+
+
 # ========================= Commands =========================
 
 def cmd_scan(args: argparse.Namespace) -> int:
+    if not getattr(args, "profile", ""):
+        return _scan(args, None)
+    prof = _Profiler(args.profile, args.profile_hz, args.profile_cprofile, args.profile_mem)
+    prof.start()
+    try:
+        return _scan(args, prof)
+    finally:
+        # every exit path, early errors included, stops cProfile/tracemalloc and writes the report
+        prof.finish()
+
+def _scan(args: argparse.Namespace, prof: Optional[_Profiler]) -> int:
     domain = args.domain.strip()
     if not domain:
         print("ERROR: --domain is required", file=sys.stderr)
@@ -536,29 +3470,166 @@ def cmd_scan(args: argparse.Namespace) -> int:
     if not use_file and not tokens:
         print("ERROR: provide --file or --targets", file=sys.stderr)
         return 2
+    index_path = (getattr(args, "index", "") or "").strip()
+    if index_path and (not use_file or getattr(args, "no_index_cache", False)):
+        print("ERROR: --index needs --file and can't be combined with --no-index-cache", file=sys.stderr)
+        return 2
 
     timeout_ms = int(args.timeout_ms)
     threads = max(1, int(args.threads))
+    if int(getattr(args, "probes", 1) or 1) > _PROBES_MAX:
+        print(f"ERROR: --probes can be at most {_PROBES_MAX}", file=sys.stderr)
+        return 2
+    engine = (getattr(args, "engine", "threads") or "threads").lower()
+    udp_io = getattr(args, "udp_io", "plain") or "plain"
+    if udp_io == "mmsg" and _mmsg_libc() is None:
+        print("WARN: sendmmsg/recvmmsg not available here; using plain sendto/recvfrom", file=sys.stderr)
+        udp_io = "plain"
     random_k = int(args.random_per_cidr)
     use_random = random_k > 0
+    budget = max(0, int(getattr(args, "probe_budget", 0) or 0))
 
-    if use_file and use_random and _file_has_plain_ip(args.file):
-        use_random = False
-        random_k = 0
+    order = (getattr(args, "order", "permuted") or "permuted").lower()
+    seed = getattr(args, "seed", None)
+
+    state_path = (getattr(args, "state_file", "") or "").strip()
+    if budget and state_path:
+        print("ERROR: --probe-budget can't be checkpointed (its picks depend on replies); drop --state-file", file=sys.stderr)
+        return 2
+    state: Optional[_ScanState] = None
+    if getattr(args, "resume", False):
+        if not state_path:
+            print("ERROR: --resume requires --state-file", file=sys.stderr)
+            return 2
+        try:
+            state = _ScanState.load(state_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ERROR: cannot resume from {state_path}: {e}", file=sys.stderr)
+            return 2
+        # positions only mean something under the original seed/order/sampling/sharding
+        seed = state.params.get("seed")
+        order = state.params.get("order", order)
+        random_k = int(state.params.get("random_k", 0))
+        use_random = random_k > 0
+
+    if prof is not None:
+        mark = prof.begin()
 
     if use_file:
-        total = _count_targets_file(args.file, use_random, random_k)
+        try:
+            plan = _load_plan(args.file, seed, use_cache=not getattr(args, "no_index_cache", False), idx=index_path)
+        except OSError:
+            plan = _TargetPlan(seed)
     else:
-        total = _count_targets_in_lines(tokens, use_random, random_k)
+        plan = _TargetPlan.from_tokens(tokens, seed)
+    if prof is not None:
+        prof.end("load_targets", mark)
+
+    db_path = (getattr(args, "db", "") or "").strip()
+    only_stale = getattr(args, "only_stale", None)
+    skip_dead = getattr(args, "skip_dead_within", None)
+    recheck_good = bool(getattr(args, "recheck_known_good", False))
+    if not db_path and (only_stale is not None or skip_dead is not None or recheck_good):
+        print("ERROR: --only-stale/--skip-dead-within/--recheck-known-good need --db", file=sys.stderr)
+        return 2
+    store: Optional[_ResultStore] = None
+    target_filter: Optional[_TargetFilter] = None
+    if db_path:
+        try:
+            store = _ResultStore(db_path, domain)
+            now = time.time()
+            skip_ips = _IpSet()
+            if only_stale is not None:
+                store.scanned_since(now - only_stale, skip_ips)
+            if skip_dead is not None:
+                store.dead_since(now - skip_dead, skip_ips)
+            if recheck_good:
+                # walk only the known-good IPs inside the targets, not the whole plan
+                plan = plan.subset(store.known_good())
+            if len(skip_ips):
+                target_filter = _TargetFilter(skip_ips)
+            store.begin_run(args.file if use_file else " ".join(tokens)[:1000])
+        except sqlite3.Error as e:
+            print(f"ERROR: result store {db_path}: {e}", file=sys.stderr)
+            return 2
+
+    sampler: Optional[_AdaptiveSampler] = None
+    if budget:
+        # --random-per-cidr only sizes the seed round here; the sampler picks the rest
+        sampler = _AdaptiveSampler(plan, budget, random_k or _ADAPT_SEED,
+                                   target_filter.skip if target_filter is not None else None)
+        use_random = False
+        random_k = 0
+
+    if use_file and use_random and plan.has_single:
+        use_random = False
+        random_k = 0
+
+    plan.set_sampling(random_k)
+    total = plan.total if sampler is None else min(budget, plan.total)
 
     if total <= 0:
         print("WARN: No targets found.", file=sys.stderr)
+        if store is not None:
+            store.close({})
         return 1
 
     worker_count = min(threads, max(1, total))
+    procs = int(getattr(args, "procs", 1) or 0)
+    if procs <= 0:
+        procs = os.cpu_count() or 1
+    procs = max(1, min(procs, total))
+    if sampler is not None and procs > 1:
+        print("ERROR: --probe-budget runs in one process; drop --procs", file=sys.stderr)
+        return 2
+
+    if state_path:
+        try:
+            source = _source_digest(args.file if use_file else "", tokens)
+        except OSError as e:
+            print(f"ERROR: cannot read {args.file}: {e}", file=sys.stderr)
+            return 2
+        if state is not None:
+            prm = state.params
+            if prm.get("source") != source or prm.get("domain") != domain or int(prm.get("total", -1)) != total:
+                print("ERROR: state file was written for different targets or domain", file=sys.stderr)
+                return 2
+            procs = len(state.cursors)
+            if state.finished:
+                print(f"Scan in {state_path} already finished ({state.done}/{total}).", file=sys.stderr)
+                return 0
+        else:
+            state = _ScanState(state_path, {
+                "source": source, "domain": domain, "seed": plan.seed, "order": order,
+                "random_k": random_k, "total": total,
+            }, procs)
+    resuming = state is not None and bool(getattr(args, "resume", False))
+
+    metrics: Optional[_Metrics] = None
+    metrics_srv = None
+    if getattr(args, "metrics_port", None):
+        metrics = _Metrics()
+        try:
+            metrics_srv = _serve_metrics(metrics, args.metrics_addr, args.metrics_port)
+        except OSError as e:
+            print(f"ERROR: metrics endpoint {args.metrics_addr}:{args.metrics_port}: {e}", file=sys.stderr)
+            return 2
+
+    state_every = max(1.0, float(getattr(args, "state_interval_s", 10.0)))
+    skip = [c.low for c in state.cursors] if state is not None else [0] * procs
 
-    target_q: "Queue[str]" = Queue(maxsize=10000)
-    out_q: "Queue[Tuple[str,bool,str,int]]" = Queue()
+    probes = max(1, int(getattr(args, "probes", 1) or 1))
+
+    goal_k = max(0, int(getattr(args, "stop_after_ok", 0) or 0))
+    goal_ms = getattr(args, "target_latency_ms", None)
+    if goal_ms is not None and not goal_k:
+        print("ERROR: --target-latency-ms needs --stop-after-ok", file=sys.stderr)
+        return 2
+    loss_max = getattr(args, "realtest_loss_max", None)
+    jitter_max = getattr(args, "realtest_jitter_max", None)
+
+    # bounded: if the result loop falls behind, probing slows down instead of results piling up in RAM
+    out_q: "Queue[Tuple[int,bool,str,int,Optional[tuple]]]" = Queue(maxsize=65536)
 
     stop_evt = threading.Event()
     producer_done = threading.Event()
@@ -573,34 +3644,78 @@ def cmd_scan(args: argparse.Namespace) -> int:
     rt_ready = int(args.realtest_ready_ms)
     rt_timeout = float(args.realtest_timeout_s)
     rt_parallel = max(1, int(args.realtest_parallel))
-
-    found_end: List[str] = []
-    found_seen = set()
-
-    rt_in: "Queue[str]" = Queue()
-    rt_out: "Queue[Tuple[str,str,str]]" = Queue()
+    rt_spec = _RealtestSpec(args.realtest_url, args.realtest_samples, args.realtest_download_url, args.realtest_download_s,
+                            args.realtest_insecure, _PROBE_PROFILES.get(args.realtest_prefilter), timeout_ms)
+    rt_pool = None
+    if auto_mode in ("end", "live"):
+        # twice the workers: one child starting while the previous one is still shutting down
+        rt_pool = _SlipstreamPool(2 * rt_parallel, getattr(args, "realtest_port_range", None))
+
+    rate_cap = max(0, int(getattr(args, "rate", 0) or 0))
+    bucket = _TokenBucket(rate_cap) if rate_cap > 0 else None
+    aimd = None
+    if bucket is not None and getattr(args, "rate_adaptive", False):
+        aimd = _AimdController(bucket, rate_cap, args.rate_min, timeout_ms / 1000.0, margin=args.rate_loss_margin)
+
+    found_seen = state.scan_ok if state is not None else _IpSet()
+
+    # one scheduler for both modes: live workers start right away, end workers once the scan is over
+    rt_sched = _RealtestScheduler(getattr(args, "realtest_queue", 1000), getattr(args, "realtest_queue_policy", "demote"))
+    rt_out: "Queue[Tuple[str,str,str,dict]]" = Queue()
     rt_stop = threading.Event()
 
-    dash = RichDashboard(total_scan=total, table_keep=1500)
-
-    # Output files (optional)
-    scan_ok_f = _open_text_out(args.scan_ok_out) if getattr(args, "scan_ok_out", None) else None
-    rt_ok_f = _open_text_out(args.realtest_ok_out) if getattr(args, "realtest_ok_out", None) else None
+    probe_gauges = {} if metrics is not None and procs == 1 else None
+    if metrics is not None:
+        metrics.counter("slipscan_probes_sent", "DNS queries sent")
+        metrics.counter("slipscan_probes_received", "DNS replies received")
+        metrics.counter("slipscan_scan_results", "Scan results by status")
+        metrics.histogram("slipscan_scan_rtt_seconds", "Scan reply time (median with --probes)", _RTT_BUCKETS)
+        if probe_gauges is not None:
+            metrics.gauge("slipscan_inflight", "Probes waiting for a reply", lambda: probe_gauges.get("inflight", int)())
+            if engine != "event":
+                metrics.gauge("slipscan_target_queue", "Targets queued for probe workers",
+                              lambda: probe_gauges.get("target_q", int)())
+        metrics.gauge("slipscan_result_queue", "Results waiting for the result loop", out_q.qsize)
+        metrics.gauge("slipscan_realtest_queue", "Candidates waiting for RealPing", lambda: len(rt_sched))
+        if bucket is not None:
+            metrics.gauge("slipscan_rate_pps", "Current send-rate cap", lambda: int(bucket.rate))
+        metrics.add_realtest(rt_pool)
+
+    dash = RichDashboard(total_scan=total, table_keep=1500, headless=not args.ui)
+    dash.show_probes = probes > 1
+    if bucket is not None:
+        dash.update_rate(bucket.rate, rate_cap)
+
+    # Output files (optional); a resumed scan keeps what the earlier run already wrote
+    writer = _ResultWriter(args.results_flush_s, args.results_fsync)
+    try:
+        if getattr(args, "scan_ok_out", None):
+            writer.add_list("scan_ok", args.scan_ok_out, resuming)
+        if getattr(args, "realtest_ok_out", None):
+            writer.add_list("rt_ok", args.realtest_ok_out, resuming)
+        for spec in args.results_out or []:
+            writer.add_sink(spec, resuming)
+    except (OSError, ValueError) as e:
+        writer.close()
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    writer.start()
     rt_ok_fmt = (getattr(args, "realtest_ok_format", "ip") or "ip").lower()
+    scan_ok_fmt = (getattr(args, "scan_ok_format", "ip") or "ip").lower()
 
-    def _write_scan_ok(ip_: str):
-        if scan_ok_f:
-            scan_ok_f.write(ip_.strip() + "\n")
-            scan_ok_f.flush()
+    def _write_scan_ok(ip_: str, ms_: str = "-", loss_: str = "-", jitter_: str = "-"):
+        if scan_ok_fmt == "ipms":
+            writer.line("scan_ok", _fmt_ipms(ip_.strip(), ms_))
+        elif scan_ok_fmt == "stats":
+            writer.line("scan_ok", f"{ip_.strip()} {ms_} {loss_} {jitter_}")
+        else:
+            writer.line("scan_ok", ip_.strip())
 
     def _write_rt_ok(ip_: str, ms_: str):
-        if not rt_ok_f:
-            return
         if rt_ok_fmt == "ipms":
-            rt_ok_f.write(_fmt_ipms(ip_.strip(), str(ms_).strip()) + "\n")
+            writer.line("rt_ok", _fmt_ipms(ip_.strip(), str(ms_).strip()))
         else:
-            rt_ok_f.write(ip_.strip() + "\n")
-        rt_ok_f.flush()
+            writer.line("rt_ok", ip_.strip())
 
     # Fix #1: When UI is ON, don't print lines to stdout unless --stdout is set
     ui_stdout_off = args.ui and (not args.stdout)
@@ -609,87 +3724,213 @@ def cmd_scan(args: argparse.Namespace) -> int:
     rt_enq_lock = threading.Lock()
     rt_enqueued = 0
 
+    if resuming:
+        dash.restore_scan(state.done, state.counts["ok"], state.counts["fail"], state.counts["skip"])
+        for ip_, st_, ms_ in state.rt_done:
+            dash.update_realtest(ip_, ms_, st_, st_.endswith(" ms"))
+        dash.restore_realtest(state.rt_counts["ok"], state.rt_counts["fail"])
+        rt_enqueued = dash.rt_enqueued = dash.rt_done
+        # realtests that were queued but never finished go back in, ahead of new finds
+        for ip_n in sorted(state.rt_pending):
+            if auto_mode in ("end", "live"):
+                dropped = rt_sched.put(ip_n, 0)
+                if dropped is not None:
+                    state.rt_pending.discard(dropped)
+                rt_enqueued += 1
+                dash.rt_enqueued = rt_enqueued
+            else:
+                state.rt_pending.discard(ip_n)
+
+    def _rt_record(ip_: str, st_: str, ms_: str, ph_: Optional[dict] = None):
+        writer.rt(ip_, st_, ms_, ph_)
+        if metrics is not None:
+            metrics.observe_realtest(st_, ms_, ph_ or {})
+        if state is not None:
+            state.rt_pending.discard(_ip_to_int(ip_))
+            state.rt_done.append([ip_, st_, ms_])
+            state.rt_counts["ok" if st_.endswith(" ms") else "fail"] += 1
+        if store is not None:
+            store.record_rt(_ip_to_int(ip_), st_, ms_)
+
     def subtitle():
-        return f"domain={domain} | workers={worker_count}/{threads} | timeout={timeout_ms}ms | random={random_k} | auto={auto_mode}"
+        procs_s = f"procs={procs} | " if procs > 1 else ""
+        probes_s = f" probes={probes}" if probes > 1 else ""
+        if args.probe_profile != "a":
+            probes_s += f" profile={args.probe_profile}"
+        sample_s = f"budget={budget}" if sampler is not None else f"random={random_k}"
+        if engine == "event":
+            return f"domain={domain} | {procs_s}engine=event sockets={args.sockets} io={udp_io} inflight<={args.max_inflight}{probes_s} | timeout={timeout_ms}ms | {sample_s} order={order} seed={plan.seed} | auto={auto_mode}"
+        return f"domain={domain} | {procs_s}workers={worker_count}/{threads}{probes_s} | timeout={timeout_ms}ms | {sample_s} order={order} seed={plan.seed} | auto={auto_mode}"
+
+    def emit(ip_: int, ok_: bool, detail_: str, ms_: int, stats_: Optional[tuple] = None):
+        # observed where results enter out_q, so consumer/render lag can't skew send-time bins
+        if aimd is not None and detail_ != "SKIP":
+            aimd.observe(detail_, ms_)
+        if sampler is not None and detail_ != "SKIP":
+            sampler.observe(ip_ & 0xFFFFFFFF, ok_)
+        item = (ip_, ok_, detail_, ms_, stats_)
+        while not stop_evt.is_set():
+            try:
+                out_q.put(item, timeout=0.2)
+                return
+            except Full:
+                continue
 
-    def producer():
+    def scanner():
         try:
-            it = _iter_targets_file(args.file, stop_evt, use_random, random_k) if use_file else _iter_targets_tokens(tokens, stop_evt, use_random, random_k)
-            for ip in it:
-                if stop_evt.is_set():
-                    break
-                target_q.put(ip)
+            if procs > 1:
+                spec = {
+                    "plan": plan, "order": order, "skip": skip, "filter": target_filter,
+                    "domain": domain, "timeout_ms": timeout_ms, "engine": engine,
+                    "threads": max(1, worker_count // procs), "sockets": args.sockets,
+                    "max_inflight": max(1, int(args.max_inflight) // procs), "probes": probes, "udp_io": udp_io,
+                    "profile": args.probe_profile,
+                }
+                _probe_sharded(spec, procs, emit, stop_evt, bucket)
+            else:
+                if sampler is not None:
+                    targets = sampler.iter_addrs(stop_evt)
+                else:
+                    targets = plan.iter_addrs(stop_evt, order, skip=skip[0])
+                if target_filter is not None and sampler is None:
+                    targets = _iter_filtered(targets, target_filter, lambda ip_: emit(ip_, False, "SKIP", -1))
+                if prof is not None:
+                    targets = prof.timed_iter("targets", targets)
+                _probe_targets(targets, domain, timeout_ms, emit, stop_evt, engine,
+                               worker_count, args.sockets, args.max_inflight, bucket, probes, probe_gauges, prof, udp_io,
+                               args.probe_profile)
         finally:
             producer_done.set()
 
-    def worker():
-        while True:
-            if producer_done.is_set() and target_q.empty():
-                return
-            try:
-                ip = target_q.get(timeout=0.2)
-            except Empty:
-                continue
-            ok1, detail, ms = fast_dns_tunnel_check(ip, domain, timeout_ms)
-            out_q.put((ip, ok1, detail, ms))
-
     def rt_worker():
         while not rt_stop.is_set():
-            try:
-                ip = rt_in.get(timeout=0.2)
-            except Empty:
-                # do not exit too early; only exit when stop is set OR nothing more expected later
-                if producer_done.is_set() and rt_in.empty():
-                    time.sleep(0.05)
-                continue
+            t = time.perf_counter()
+            ip_n = rt_sched.get(rt_stop)
+            if prof is not None:
+                prof.wait("realtest_queue.get", time.perf_counter() - t)
+            if ip_n is None:
+                return
+            ip = _int_to_ip(ip_n)
             dash.set_current_realtest(ip)
-            st, ms = realtest_one(ip, domain, rt_exe, rt_ready, rt_timeout)
-            rt_out.put((ip, st, ms))
+            ph = {}
+            if prof is not None:
+                mark = prof.begin()
+            st, ms = realtest_one(ip, domain, rt_exe, rt_ready, rt_timeout, rt_pool, ph, rt_spec)
+            if prof is not None:
+                prof.end("realtest", mark)
+            rt_out.put((ip, st, ms, ph))
             dash.set_current_realtest("")
 
-    threading.Thread(target=producer, daemon=True).start()
-    for _ in range(worker_count):
-        threading.Thread(target=worker, daemon=True).start()
+    threading.Thread(target=scanner, daemon=True).start()
 
-    if auto_mode == "live":
+    # goal mode: RealPing OKs count when auto-realtest is on, scan OKs otherwise
+    goal_rt = auto_mode in ("end", "live")
+    top: List[Tuple[int, str]] = []     # max-heap of (-ms, ip): the best goal_k so far
+    goal_hits = 0
+    goal_met = False
+
+    def _goal_hit(ip_: str, ms_: str) -> None:
+        nonlocal goal_hits, goal_met
+        try:
+            ms_i = int(ms_)
+        except ValueError:
+            return
+        if not goal_k or ms_i < 0 or (goal_ms is not None and ms_i > goal_ms):
+            return
+        goal_hits += 1
+        if len(top) < goal_k:
+            heapq.heappush(top, (-ms_i, ip_))
+        else:
+            heapq.heappushpop(top, (-ms_i, ip_))
+        if goal_hits >= goal_k and not goal_met:
+            goal_met = True
+            # cancel everything still running: producer and in-flight probes, queued and running realtests
+            stop_evt.set()
+            rt_stop.set()
+            rt_sched.close()
+            if rt_pool is not None:
+                rt_pool.kill_all()
+
+    def start_rt_workers():
         for _ in range(rt_parallel):
             threading.Thread(target=rt_worker, daemon=True).start()
 
-    done = 0
+    if auto_mode == "live":
+        start_rt_workers()
+
+    done = state.done if resuming else 0
 
     try:
         # Fix #2: keep final screen (screen=False, transient=False)
-        with Live(dash.render(subtitle()), refresh_per_second=12, console=dash.console, screen=False, transient=False) as live:
-            while done < total:
+        with _live_view(dash, subtitle, args.ui_fps, prof):
+            while done < total and not goal_met:
                 # drain rt outputs (live)
                 if auto_mode == "live":
                     for _ in range(600):
                         try:
-                            ip_rt, st_rt, ms_rt = rt_out.get_nowait()
+                            ip_rt, st_rt, ms_rt, ph_rt = rt_out.get_nowait()
                         except Empty:
                             break
                         ok_rt = st_rt.endswith(" ms")
-                        dash.update_realtest(ip_rt, ms_rt, st_rt, ok_rt)
+                        dash.update_realtest(ip_rt, ms_rt, st_rt, ok_rt, ph_rt)
+                        _rt_record(ip_rt, st_rt, ms_rt, ph_rt)
                         if ok_rt:
                             _write_rt_ok(ip_rt, ms_rt)
+                            _goal_hit(ip_rt, ms_rt)
+                        if goal_met:
+                            # results still queued are from cancelled realtests
+                            break
+                    if goal_met:
+                        break
 
+                # take whatever has piled up in one go; bookkeeping runs once per batch
+                t = time.perf_counter()
                 try:
-                    ip, ok1, detail, ms = out_q.get(timeout=0.2)
+                    batch = [out_q.get(timeout=0.2)]
                 except Empty:
-                    live.update(dash.render(subtitle()))
+                    if prof is not None:
+                        prof.wait("out_q.get", time.perf_counter() - t)
+                    if state is not None:
+                        state.maybe_save(state_every)
+                    if store is not None:
+                        store.maybe_flush()
+                    # all runners returned without reaching total (e.g. a shard process died)
+                    if producer_done.is_set() and out_q.empty():
+                        break
                     continue
 
-                done += 1
-                scan_ms_str = "-" if ms < 0 else str(ms)
-                dash.update_scan(ip, scan_ms_str, detail, ok1)
-
-                if ok1:
-                    _write_scan_ok(ip)
-                    if not ui_stdout_off:
-                        print(f"{ip}\t{scan_ms_str}\t{detail}")
+                if prof is not None:
+                    prof.wait("out_q.get", time.perf_counter() - t)
+                    mark = prof.begin()
+                for _ in range(4095):
+                    try:
+                        batch.append(out_q.get_nowait())
+                    except Empty:
+                        break
 
-                    if ip not in found_seen:
-                        found_seen.add(ip)
+                for ip, ok1, detail, ms, pstats in batch:
+                    done += 1
+                    tag = ip
+                    ip_n = tag & 0xFFFFFFFF
+                    code = _STATUS_CODE.get(detail, _STATUS_CODE["ERROR"])
+                    dash.update_scan(ip_n, ms, code, ok1, pstats)
+                    if aimd is not None:
+                        dash.update_rate(aimd.rate, rate_cap, aimd.backoffs, aimd.last_event)
+
+                    # an OK above the watermark gets re-probed after a resume; found_seen keeps it single
+                    # (strings are only built for these; a FAIL stays ints end to end)
+                    if ok1 and found_seen.add(ip_n):
+                        ip = _int_to_ip(ip_n)
+                        scan_ms_str = "-" if ms < 0 else str(ms)
+                        loss_str, jitter_str = _fmt_probe_stats(pstats)
+                        _write_scan_ok(ip, scan_ms_str, loss_str, jitter_str)
+                        if not goal_rt:
+                            _goal_hit(ip, scan_ms_str)
+                        if not ui_stdout_off:
+                            if pstats:
+                                print(f"{ip}\t{scan_ms_str}\t{detail}\tloss={loss_str}\tjitter={jitter_str}")
+                            else:
+                                print(f"{ip}\t{scan_ms_str}\t{detail}")
 
                         passes = True
                         if ms_max is not None:
@@ -697,49 +3938,93 @@ def cmd_scan(args: argparse.Namespace) -> int:
                                 passes = False
                             else:
                                 passes = ms < int(ms_max)
+                        if pstats and loss_max is not None:
+                            passes = passes and 100.0 * (pstats[0] - pstats[1]) / pstats[0] <= loss_max
+                        if pstats and jitter_max is not None:
+                            passes = passes and 0 <= pstats[3] <= jitter_max
+
+                        if passes and auto_mode in ("end", "live"):
+                            if state is not None:
+                                state.rt_pending.add(ip_n)
+                            dropped = rt_sched.put(ip_n, _rt_score(ms, pstats))
+                            if dropped is not None and state is not None:
+                                state.rt_pending.discard(dropped)
+                            with rt_enq_lock:
+                                rt_enqueued += 1
+                                dash.rt_enqueued = rt_enqueued
+                            dash.rt_queued = len(rt_sched)
+                            dash.rt_dropped = rt_sched.dropped
+
+                    if state is not None:
+                        state.complete(tag, code)
+                    if detail != "SKIP":
+                        writer.scan(ip_n, code, ms, pstats)
+                        if metrics is not None:
+                            # without --probes a reply is anything but TIMEOUT/ERROR
+                            sent_, got_ = pstats[:2] if pstats else (1, int(code not in _NO_REPLY_CODES))
+                            metrics.inc("slipscan_probes_sent", sent_)
+                            metrics.inc("slipscan_probes_received", got_)
+                            metrics.inc("slipscan_scan_results", labels=(("status", detail),))
+                            if ms >= 0:
+                                metrics.observe("slipscan_scan_rtt_seconds", ms / 1000.0)
+                        if store is not None:
+                            store.record_scan(ip_n, code, ms)
+
+                    if goal_met:
+                        break
 
-                        if passes:
-                            if auto_mode == "end":
-                                found_end.append(ip)
-                            elif auto_mode == "live":
-                                rt_in.put(ip)
-                                with rt_enq_lock:
-                                    rt_enqueued += 1
-                                    dash.rt_enqueued = rt_enqueued
-                                    dash.inc_rt_enq()  # keep in sync, harmless
-
-                live.update(dash.render(subtitle()))
+                if state is not None:
+                    state.maybe_save(state_every)
+                if store is not None:
+                    store.maybe_flush()
+                if prof is not None:
+                    prof.end("consume", mark, len(batch))
 
             # ---- scan finished ----
 
-            if auto_mode == "live":
+            if auto_mode in ("live", "end") and not goal_met:
                 # IMPORTANT: do NOT stop workers immediately.
-                # Wait until all enqueued realtests are DONE or deadline hits.
+                # Wait until every queued realtest is DONE (live: or the drain deadline hits).
+                rt_sched.close()
+                if auto_mode == "end":
+                    start_rt_workers()
                 with rt_enq_lock:
                     enq = rt_enqueued
                     dash.rt_enqueued = enq
 
-                deadline = time.monotonic() + max(5.0, float(args.live_drain_timeout_s))
+                deadline = None
+                if auto_mode == "live":
+                    deadline = time.monotonic() + max(5.0, float(args.live_drain_timeout_s))
                 while True:
                     drained = False
                     for _ in range(1200):
                         try:
-                            ip_rt, st_rt, ms_rt = rt_out.get_nowait()
+                            ip_rt, st_rt, ms_rt, ph_rt = rt_out.get_nowait()
                         except Empty:
                             break
                         drained = True
                         ok_rt = st_rt.endswith(" ms")
-                        dash.update_realtest(ip_rt, ms_rt, st_rt, ok_rt)
+                        dash.update_realtest(ip_rt, ms_rt, st_rt, ok_rt, ph_rt)
+                        _rt_record(ip_rt, st_rt, ms_rt, ph_rt)
                         if ok_rt:
                             _write_rt_ok(ip_rt, ms_rt)
+                            _goal_hit(ip_rt, ms_rt)
+                        if auto_mode == "end" and not ui_stdout_off:
+                            print(f"RT\t{ip_rt}\t{st_rt}\t{ms_rt}\t{_fmt_phases(ph_rt)}")
+                        if goal_met:
+                            break
 
-                    live.update(dash.render(subtitle()))
+                    dash.rt_queued = len(rt_sched)
+                    if state is not None:
+                        state.maybe_save(state_every)
+                    if store is not None:
+                        store.maybe_flush()
 
-                    # finish condition: all enqueued results arrived and queue empty
-                    if dash.rt_done >= enq and rt_in.empty():
+                    # finish condition: every candidate that wasn't dropped has a result
+                    if goal_met or (dash.rt_done >= enq - rt_sched.dropped and len(rt_sched) == 0):
                         break
 
-                    if time.monotonic() > deadline:
+                    if deadline is not None and time.monotonic() > deadline:
                         break
 
                     if not drained:
@@ -747,118 +4032,263 @@ def cmd_scan(args: argparse.Namespace) -> int:
 
                 rt_stop.set()
 
-            if auto_mode == "end" and found_end:
-                for ip in found_end:
-                    dash.set_current_realtest(ip)
-                    live.update(dash.render(subtitle()))
-
-                    st, ms_rt = realtest_one(ip, domain, rt_exe, rt_ready, rt_timeout)
-                    ok_rt = st.endswith(" ms")
-                    dash.update_realtest(ip, ms_rt, st, ok_rt)
-                    if ok_rt:
-                        _write_rt_ok(ip, ms_rt)
-
-                    dash.set_current_realtest("")
-                    live.update(dash.render(subtitle()))
-
-                    if not ui_stdout_off:
-                        print(f"RT\t{ip}\t{st}\t{ms_rt}")
-
         # After Live ends, print final panel so it stays
-        dash.console.print(dash.render(subtitle()))
+        dash.rt_dropped = rt_sched.dropped
+        _final_view(dash, subtitle())
+        if rt_sched.dropped:
+            hint = "" if rt_sched.policy == "demote" else " or use --realtest-queue-policy demote"
+            print(f"WARN: RealPing queue was full: {rt_sched.dropped} candidate(s) dropped untested "
+                  f"(raise --realtest-queue{hint})", file=sys.stderr)
+
+        if goal_k:
+            best = sorted((-m, ip_) for m, ip_ in top)
+            kind = "RealPing" if goal_rt else "Scan"
+            title = f"Top {len(best)} by {kind} ms" + (" (goal met)" if goal_met else f" (goal {goal_hits}/{goal_k})")
+            tt = Table(title=title, header_style="bold magenta")
+            tt.add_column("#", justify="right")
+            tt.add_column("IP", style="bold green")
+            tt.add_column(f"{kind} ms", justify="right")
+            for n, (m, ip_) in enumerate(best, 1):
+                tt.add_row(str(n), ip_, str(m))
+                if not ui_stdout_off:
+                    print(f"TOP\t{n}\t{ip_}\t{m}")
+            if not dash.headless:
+                dash.console.print(tt)
+        if goal_met:
+            producer_done.wait(5.0)
 
     except KeyboardInterrupt:
         stop_evt.set()
         rt_stop.set()
+        if rt_pool is not None:
+            rt_pool.kill_all()
         print("\nInterrupted.", file=sys.stderr)
 
-    # close output files
-    try:
-        if scan_ok_f:
-            scan_ok_f.close()
-        if rt_ok_f:
-            rt_ok_f.close()
-    except Exception:
-        pass
+    if state is not None:
+        state.finished = state.done >= total and not state.rt_pending
+        try:
+            state.save()
+            if not state.finished:
+                print(f"State saved to {state_path} ({state.done}/{total}); continue with --resume.", file=sys.stderr)
+        except OSError as e:
+            print(f"WARN: could not write {state_path}: {e}", file=sys.stderr)
+    if sampler is not None:
+        print(sampler.summary(), file=sys.stderr)
+
+    if rt_pool is not None:
+        rt_pool.close()
+
+    if store is not None:
+        try:
+            store.close({"ok": dash.scan_ok, "fail": dash.scan_fail, "skip": dash.scan_skip})
+        except sqlite3.Error as e:
+            print(f"WARN: result store {db_path}: {e}", file=sys.stderr)
+
+    writer.close()
+    if metrics_srv is not None:
+        metrics_srv.shutdown()
+        metrics_srv.server_close()
 
     return 0
 
 
+def _iter_ip_lines(f) -> Iterable[str]:
+    # first field of each line, so plain lists, 'ip ms' files and scan stdout all work; IPv4 only
+    for line in f:
+        parts = line.split()
+        if not parts:
+            continue
+        ip = _strip_port(parts[0])
+        try:
+            if ipaddress.ip_address(ip).version == 4:
+                yield ip
+        except ValueError:
+            continue
+
+
 def cmd_realtest(args: argparse.Namespace) -> int:
     domain = args.domain.strip()
     exe = args.slipstream_path.strip() if args.slipstream_path else ""
     if not exe:
         exe = "slipstream-client-windows-amd64.exe" if os.name == "nt" else "slipstream-client"
 
-    ips: List[str] = []
     if args.file:
-        with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                ip = _strip_port(line.strip())
-                if _is_ip(ip):
-                    ips.append(ip)
+        try:
+            src = open(args.file, "r", encoding="utf-8", errors="ignore")
+        except OSError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 2
+    elif not sys.stdin.isatty():
+        src = sys.stdin
     else:
-        if not sys.stdin.isatty():
-            for line in sys.stdin.read().splitlines():
-                ip = _strip_port(line.strip())
-                if _is_ip(ip):
-                    ips.append(ip)
-
-    seen = set()
-    uniq = []
-    for ip in ips:
-        if ip not in seen:
-            seen.add(ip)
-            uniq.append(ip)
-    ips = uniq
-
-    if not ips:
         print("ERROR: no IPs provided for realtest", file=sys.stderr)
         return 2
 
-    dash = RichDashboard(total_scan=len(ips), table_keep=500)
+    parallel = max(1, int(getattr(args, "parallel", 1) or 1))
+    spec = _RealtestSpec(args.url, args.samples, args.download_url, args.download_s, args.insecure,
+                         _PROBE_PROFILES.get(args.prefilter), args.prefilter_timeout_ms)
+    ramp = _ConcurrencyRamp(1, parallel) if getattr(args, "auto_ramp", False) and parallel > 1 else None
+
+    metrics: Optional[_Metrics] = None
+    metrics_srv = None
+    if getattr(args, "metrics_port", None):
+        metrics = _Metrics()
+        try:
+            metrics_srv = _serve_metrics(metrics, args.metrics_addr, args.metrics_port)
+        except OSError as e:
+            if src is not sys.stdin:
+                src.close()
+            print(f"ERROR: metrics endpoint {args.metrics_addr}:{args.metrics_port}: {e}", file=sys.stderr)
+            return 2
+
+    writer = _ResultWriter(args.results_flush_s, args.results_fsync)
+    try:
+        if getattr(args, "realtest_ok_out", None):
+            writer.add_list("rt_ok", args.realtest_ok_out)
+        for out_spec in args.results_out or []:
+            writer.add_sink(out_spec)
+    except (OSError, ValueError) as e:
+        writer.close()
+        if src is not sys.stdin:
+            src.close()
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    writer.start()
+
+    # reader -> bounded ip_q -> N workers -> res_q -> this thread (the only one touching dash and outputs)
+    ip_q: "Queue[str]" = Queue(maxsize=parallel * 4)
+    res_q: "Queue[tuple]" = Queue()
+    stop_evt = threading.Event()
+    input_done = threading.Event()
+    read_count = [0]
+
+    def reader():
+        seen = _IpSet()
+        try:
+            for ip in _iter_ip_lines(src):
+                if stop_evt.is_set():
+                    return
+                if not seen.add(_ip_to_int(ip)):
+                    continue
+                read_count[0] += 1
+                while not stop_evt.is_set():
+                    try:
+                        ip_q.put(ip, timeout=0.2)
+                        break
+                    except Full:
+                        continue
+        except OSError as e:
+            print(f"WARN: reading input stopped: {e}", file=sys.stderr)
+        finally:
+            input_done.set()
+
+    pool = _SlipstreamPool(2 * parallel, getattr(args, "port_range", None))
+    allowed = [ramp.allowed if ramp is not None else parallel]
+    if metrics is not None:
+        metrics.add_realtest(pool)
+        metrics.gauge("slipscan_realtest_queue", "IPs read but not yet picked up by a worker", ip_q.qsize)
+        metrics.gauge("slipscan_realtest_parallel", "Workers currently allowed to run", lambda: allowed[0])
+
+    def worker(n: int):
+        while not stop_evt.is_set():
+            if input_done.is_set() and ip_q.empty():
+                return
+            if n >= allowed[0]:
+                time.sleep(0.1)
+                continue
+            try:
+                ip = ip_q.get(timeout=0.2)
+            except Empty:
+                continue
+            res_q.put(("start", ip))
+            ph = {}
+            st, ms = realtest_one(ip, domain, exe, args.ready_timeout_ms, args.timeout_s, pool, ph, spec)
+            res_q.put(("done", ip, st, ms, ph))
+
+    dash = RichDashboard(total_scan=1, table_keep=500, headless=not args.ui, label="Realtest")
 
-    rt_ok_f = _open_text_out(args.realtest_ok_out) if getattr(args, "realtest_ok_out", None) else None
     rt_ok_fmt = (getattr(args, "realtest_ok_format", "ip") or "ip").lower()
 
     def _write_rt_ok(ip_: str, ms_: str):
-        if not rt_ok_f:
-            return
         if rt_ok_fmt == "ipms":
-            rt_ok_f.write(_fmt_ipms(ip_.strip(), str(ms_).strip()) + "\n")
+            writer.line("rt_ok", _fmt_ipms(ip_.strip(), str(ms_).strip()))
         else:
-            rt_ok_f.write(ip_.strip() + "\n")
-        rt_ok_f.flush()
+            writer.line("rt_ok", ip_.strip())
 
     def subtitle():
-        return f"RealTest only | domain={domain} | timeout={args.timeout_s}s | ready={args.ready_timeout_ms}ms"
+        par = f"parallel={allowed[0]}/{parallel}" + (" (ramp)" if ramp is not None else "")
+        return f"RealTest only | domain={domain} | {par} | timeout={args.timeout_s}s | ready={args.ready_timeout_ms}ms"
 
     ui_stdout_off = args.ui and (not args.stdout)
 
-    with Live(dash.render(subtitle()), refresh_per_second=12, console=dash.console, screen=False, transient=False) as live:
-        for ip in ips:
-            dash.update_scan(ip, "-", "(manual list)", True)
-            dash.set_current_realtest(ip)
-            live.update(dash.render(subtitle()))
+    threading.Thread(target=reader, daemon=True).start()
+    workers = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(parallel)]
+    for t in workers:
+        t.start()
 
-            st, ms = realtest_one(ip, domain, exe, args.ready_timeout_ms, args.timeout_s)
-            ok_rt = st.endswith(" ms")
-            dash.update_realtest(ip, ms, st, ok_rt)
-            if ok_rt:
-                _write_rt_ok(ip, ms)
-
-            dash.set_current_realtest("")
-            live.update(dash.render(subtitle()))
-
-            if not ui_stdout_off:
-                print(f"{ip}\t{st}\t{ms}")
+    started = 0
+    try:
+        with _live_view(dash, subtitle, args.ui_fps):
+            while True:
+                try:
+                    ev = res_q.get(timeout=0.2)
+                except Empty:
+                    if input_done.is_set() and dash.rt_done >= started and ip_q.empty() and \
+                            not any(t.is_alive() for t in workers):
+                        break
+                    ev = None
+                if ev is not None and ev[0] == "start":
+                    started += 1
+                    dash.add_manual(_ip_to_int(ev[1]))
+                    dash.set_current_realtest(ev[1])
+                elif ev is not None:
+                    _, ip, st, ms, ph = ev
+                    ok_rt = st.endswith(" ms")
+                    dash.update_realtest(ip, ms, st, ok_rt, ph)
+                    writer.rt(ip, st, ms, ph)
+                    if metrics is not None:
+                        metrics.observe_realtest(st, ms, ph)
+                    if ok_rt:
+                        _write_rt_ok(ip, ms)
+                    if not ui_stdout_off:
+                        print(f"{ip}\t{st}\t{ms}\t{_fmt_phases(ph)}")
+                    if dash.rt_done >= started:
+                        dash.set_current_realtest("")
+                if ramp is not None:
+                    allowed[0] = ramp.update(dash.rt_done, dash.rt_fail)
+                dash.set_total(read_count[0])
+
+        _final_view(dash, subtitle())
+    except KeyboardInterrupt:
+        stop_evt.set()
+        print("\nInterrupted.", file=sys.stderr)
 
-    dash.console.print(dash.render(subtitle()))
+    pool.close()
+    writer.close()
+    if metrics_srv is not None:
+        metrics_srv.shutdown()
+        metrics_srv.server_close()
     try:
-        if rt_ok_f:
-            rt_ok_f.close()
+        if src is not sys.stdin:
+            src.close()
     except Exception:
         pass
+    if read_count[0] == 0:
+        print("ERROR: no IPs provided for realtest", file=sys.stderr)
+        return 2
+    return 0
+
+
+def cmd_compile(args: argparse.Namespace) -> int:
+    dst = args.out or _index_path(args.file)
+    start = time.monotonic()
+    try:
+        plan = _compile_index(args.file, dst)
+    except OSError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    ms = int((time.monotonic() - start) * 1000)
+    print(f"{dst}: ranges={len(plan.base)} singles={plan.singles} total={plan.total} ({ms} ms)")
     return 0
 
 
@@ -874,20 +4304,108 @@ def build_parser() -> argparse.ArgumentParser:
     s.add_argument("--targets", nargs="*")
     s.add_argument("--timeout-ms", type=int, default=800)
     s.add_argument("--threads", type=int, default=200)
+    s.add_argument("--engine", choices=["threads", "event"], default="threads",
+                   help="threads: one blocking probe per worker thread; event: single-thread selector engine on a few shared sockets")
+    s.add_argument("--sockets", type=int, default=4, help="Event engine: number of shared UDP sockets (default 4)")
+    s.add_argument("--max-inflight", type=int, default=10000, help="Event engine: max probes in flight at once (default 10000)")
+    s.add_argument("--udp-io", choices=["plain", "mmsg"], default="plain",
+                   help="Event engine socket calls: plain sendto/recvfrom, or mmsg to batch them with "
+                        "sendmmsg/recvmmsg (Linux; falls back to plain elsewhere) (default plain)")
+    s.add_argument("--probes", type=int, default=1,
+                   help="Queries per IP, pipelined on one socket; reports reply loss, median RTT and jitter (default 1)")
+    s.add_argument("--probe-profile", choices=sorted(_PROBE_PROFILES), default="a",
+                   help="Query shape: a = short A lookup; txt/null = tunnel-like (that qtype, names near 253 chars, "
+                        "EDNS0 1232), and truncated or EDNS-stripped replies count as FAIL (default a)")
+    s.add_argument("--procs", type=int, default=1,
+                   help="Split targets into N shards scanned by N worker processes (0 = all CPU cores). "
+                        "--threads, --max-inflight and --rate are divided between them")
     s.add_argument("--random-per-cidr", type=int, default=0)
+    s.add_argument("--probe-budget", type=int, default=0, metavar="N",
+                   help="Adaptive sampling: send at most N probes, steering them toward prefixes with more hits and "
+                        "dropping prefixes without any (seed round: --random-per-cidr per prefix, default 4)")
+    s.add_argument("--order", choices=["permuted", "sequential"], default="permuted",
+                   help="permuted: pseudo-random order across the whole input (default); sequential: ascending address order")
+    s.add_argument("--seed", type=int, default=None, help="Seed for --order permuted, --random-per-cidr and --probe-budget sampling (default: random)")
+    s.add_argument("--rate", type=int, default=0, help="Cap probe send rate in packets/sec (token bucket, default 0 = unlimited)")
+    s.add_argument("--rate-adaptive", action="store_true",
+                   help="With --rate: AIMD backoff/ramp-up of the send rate from the rolling TIMEOUT/ERROR ratio (--rate is the ceiling)")
+    s.add_argument("--rate-min", type=int, default=50, help="Adaptive rate floor in pps (default 50)")
+    s.add_argument("--rate-loss-margin", type=float, default=0.15,
+                   help="Adaptive: back off when the TIMEOUT/ERROR ratio exceeds its baseline by this much (default 0.15)")
+
+    s.add_argument("--no-index-cache", action="store_true",
+                   help="Don't read/write the compiled <file>.slipidx index next to --file")
+    s.add_argument("--index", default="", metavar="PATH",
+                   help="Compiled index to use for --file instead of <file>.slipidx (e.g. from compile --out); rebuilt there if stale")
+    s.add_argument("--state-file", default="",
+                   help="Checkpoint scan progress to this JSON file (written atomically)")
+    s.add_argument("--resume", action="store_true",
+                   help="Continue the scan recorded in --state-file (same targets and domain)")
+    s.add_argument("--state-interval-s", type=float, default=10.0,
+                   help="Seconds between checkpoint writes")
+    s.add_argument("--db", default="",
+                   help="SQLite result store: records per-IP scan status/RTT/RealPing with timestamps across runs")
+    s.add_argument("--only-stale", type=_parse_duration, metavar="AGE",
+                   help="With --db: skip IPs scanned more recently than AGE (e.g. 6h, 30m, 2d)")
+    s.add_argument("--skip-dead-within", type=_parse_duration, metavar="AGE",
+                   help="With --db: skip IPs that failed a scan within AGE")
+    s.add_argument("--recheck-known-good", action="store_true",
+                   help="With --db: only probe IPs whose last recorded scan was OK")
 
     s.add_argument("--ui", action="store_true", help="Enable Rich UI dashboard")
     s.add_argument("--stdout", action="store_true", help="When --ui is on, also print results to stdout (default: off)")
+    s.add_argument("--ui-fps", type=float, default=8.0, help="Dashboard redraws per second with --ui (default 8)")
+    s.add_argument("--profile", default="", metavar="PATH",
+                   help="Record stage times, queue waits and stack samples; write a JSON report to PATH at exit")
+    s.add_argument("--profile-hz", type=float, default=20.0, help="Stack samples per second for --profile (0 = off, default 20)")
+    s.add_argument("--profile-cprofile", action="store_true", help="Also run cProfile (slow); stats go next to the report as .pstats")
+    s.add_argument("--profile-mem", action="store_true", help="Also run tracemalloc (slow) and report the top allocation sites")
+    s.add_argument("--metrics-port", type=int, default=0, help="Serve OpenMetrics on this port at /metrics (default off)")
+    s.add_argument("--metrics-addr", default="127.0.0.1", help="Bind address for --metrics-port (default 127.0.0.1)")
     s.add_argument("--scan-ok-out", default="", help="Write Scan-OK IPs to file (ip per line)")
+    s.add_argument("--scan-ok-format", choices=["ip", "ipms", "stats"], default="ip",
+                   help="Format for --scan-ok-out: ip, 'ip ms', or 'ip median_ms loss%% jitter_ms' (with --probes)")
     s.add_argument("--realtest-ok-out", default="", help="Write RealTest OK results to file")
     s.add_argument("--realtest-ok-format", choices=["ip", "ipms"], default="ip", help="Format for --realtest-ok-out: ip or 'ip ms'")
+    s.add_argument("--results-out", action="append", default=[], metavar="PATH",
+                   help="Write every result record; format from the extension (.jsonl/.csv/.bin) or a ndjson:/csv:/bin: prefix. Repeatable")
+    s.add_argument("--results-flush-s", type=float, default=1.0, help="Flush interval for output files (default 1)")
+    s.add_argument("--results-fsync", choices=["never", "interval", "close"], default="never",
+                   help="fsync output files: never, on every flush, or once at exit (default never)")
 
     s.add_argument("--auto-realtest", choices=["off", "end", "live"], default="off")
     s.add_argument("--realtest-ms-max", type=int, default=None)
+    s.add_argument("--realtest-loss-max", type=float, default=None, metavar="PCT",
+                   help="With --probes: only RealPing IPs that lost at most PCT%% of the probes")
+    s.add_argument("--realtest-jitter-max", type=int, default=None, metavar="MS",
+                   help="With --probes: only RealPing IPs whose jitter is at most MS")
     s.add_argument("--realtest-timeout-s", type=float, default=5.0)
     s.add_argument("--realtest-ready-ms", type=int, default=2000)
     s.add_argument("--realtest-slipstream-path", default="")
-    s.add_argument("--realtest-parallel", type=int, default=1, help="Only for live mode (default 1)")
+    s.add_argument("--realtest-parallel", type=int, default=1, help="RealPing workers, live and end mode (default 1)")
+    s.add_argument("--stop-after-ok", type=int, default=0, metavar="K",
+                   help="Stop everything once K good resolvers are found (RealPing OKs with --auto-realtest, else scan OKs) and print the top K")
+    s.add_argument("--target-latency-ms", type=int, default=None, metavar="MS",
+                   help="With --stop-after-ok: only results at or under MS count toward the goal")
+    s.add_argument("--realtest-url", type=_parse_url, default=None, metavar="URL",
+                   help="URL fetched through the tunnel (default https://www.google.com/generate_204; http:// works for local servers)")
+    s.add_argument("--realtest-samples", type=int, default=1,
+                   help="Requests per RealPing over one tunnel (keep-alive); >1 reports p50/p95 and uses p50 as the ms")
+    s.add_argument("--realtest-download-url", type=_parse_url, default=None, metavar="URL",
+                   help="Also download this URL through the tunnel and report KB/s")
+    s.add_argument("--realtest-download-s", type=float, default=5.0, help="Time cap for --realtest-download-url (default 5)")
+    s.add_argument("--realtest-insecure", action="store_true",
+                   help="Don't verify the RealPing server's TLS certificate (self-signed test servers)")
+    s.add_argument("--realtest-prefilter", choices=["off", "txt", "null"], default="off",
+                   help="Before each RealPing, send a few queries with this --probe-profile (within --timeout-ms) "
+                        "and skip slipstream-client when they fail (default off)")
+    s.add_argument("--realtest-queue", type=int, default=1000,
+                   help="Max RealPing candidates waiting; best scan RTT/loss/jitter are tested first (default 1000)")
+    s.add_argument("--realtest-queue-policy", choices=["drop", "demote"], default="demote",
+                   help="When the queue is full: demote the worst candidate to be tested only after the queue drains "
+                        "(default; the overflow holds as many again, then the worst is dropped), or drop it untested")
+    s.add_argument("--realtest-port-range", type=_parse_port_range, default=None, metavar="LO-HI",
+                   help="Reserve these local ports for slipstream-client listeners (default: OS-assigned, still leased)")
 
     s.add_argument("--live-drain-timeout-s", type=float, default=30.0,
                    help="After scan finishes in live mode, wait up to this many seconds for remaining RealPing results.")
@@ -900,12 +4418,41 @@ def build_parser() -> argparse.ArgumentParser:
     r.add_argument("--slipstream-path", default="")
     r.add_argument("--ready-timeout-ms", type=int, default=2000)
     r.add_argument("--timeout-s", type=float, default=5.0)
+    r.add_argument("--parallel", type=int, default=1, help="RealPing this many IPs at once (default 1)")
+    r.add_argument("--url", type=_parse_url, default=None,
+                   help="URL fetched through the tunnel (default https://www.google.com/generate_204; http:// works for local servers)")
+    r.add_argument("--samples", type=int, default=1,
+                   help="Requests per RealPing over one tunnel (keep-alive); >1 reports p50/p95 and uses p50 as the ms")
+    r.add_argument("--download-url", type=_parse_url, default=None, help="Also download this URL through the tunnel and report KB/s")
+    r.add_argument("--download-s", type=float, default=5.0, help="Time cap for --download-url (default 5)")
+    r.add_argument("--insecure", action="store_true", help="Don't verify the server's TLS certificate (self-signed test servers)")
+    r.add_argument("--prefilter", choices=["off", "txt", "null"], default="off",
+                   help="Send a few queries with this scan --probe-profile first and skip slipstream-client when "
+                        "they fail (default off)")
+    r.add_argument("--prefilter-timeout-ms", type=int, default=800, help="Reply timeout for --prefilter (default 800)")
+    r.add_argument("--auto-ramp", action="store_true",
+                   help="Start at 1 and add workers up to --parallel while CPU load and the failure ratio stay steady")
+    r.add_argument("--port-range", type=_parse_port_range, default=None, metavar="LO-HI",
+                   help="Reserve these local ports for slipstream-client listeners (default: OS-assigned, still leased)")
     r.add_argument("--ui", action="store_true", help="Enable Rich UI dashboard")
     r.add_argument("--stdout", action="store_true", help="When --ui is on, also print results to stdout (default: off)")
+    r.add_argument("--ui-fps", type=float, default=8.0, help="Dashboard redraws per second with --ui (default 8)")
+    r.add_argument("--metrics-port", type=int, default=0, help="Serve OpenMetrics on this port at /metrics (default off)")
+    r.add_argument("--metrics-addr", default="127.0.0.1", help="Bind address for --metrics-port (default 127.0.0.1)")
     r.add_argument("--realtest-ok-out", default="", help="Write RealTest OK results to file")
     r.add_argument("--realtest-ok-format", choices=["ip", "ipms"], default="ip", help="Format for --realtest-ok-out: ip or 'ip ms'")
+    r.add_argument("--results-out", action="append", default=[], metavar="PATH",
+                   help="Write every result record; format from the extension (.jsonl/.csv/.bin) or a ndjson:/csv:/bin: prefix. Repeatable")
+    r.add_argument("--results-flush-s", type=float, default=1.0, help="Flush interval for output files (default 1)")
+    r.add_argument("--results-fsync", choices=["never", "interval", "close"], default="never",
+                   help="fsync output files: never, on every flush, or once at exit (default never)")
     r.set_defaults(func=cmd_realtest)
 
+    c = sub.add_parser("compile", help="Parse a target file once into a binary index (<file>.slipidx) for instant scan startup")
+    c.add_argument("--file", required=True)
+    c.add_argument("--out", default="", help="Index path (default: <file>.slipidx, which scan picks up automatically; pass any other path to scan --index)")
+    c.set_defaults(func=cmd_compile)
+
     return p
 
 def main(argv: Optional[List[str]] = None) -> int:
@@ -913,4 +4460,5 @@ def main(argv: Optional[List[str]] = None) -> int:
     return int(args.func(args))
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     raise SystemExit(main())
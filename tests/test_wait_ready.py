@@ -0,0 +1,69 @@
+import errno
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import slipscan_cli
+
+
+class _StrictSelector(selectors.SelectSelector):
+    # Windows' select() fails with WinError 10022 (EINVAL) when no descriptors are registered
+    def select(self, timeout=None):
+        if not self.get_map():
+            raise OSError(errno.EINVAL, "select() on an empty descriptor set")
+        return super().select(timeout)
+
+
+def _unused_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn(code: str, port: int) -> subprocess.Popen:
+    # stdout isn't piped, so only the connect probe is ever registered with the selector
+    return subprocess.Popen([sys.executable, "-c", code, str(port)], stdout=subprocess.DEVNULL)
+
+
+_LISTEN_LATE = """
+import socket, sys, time
+time.sleep(0.3)
+s = socket.socket()
+s.bind(("127.0.0.1", int(sys.argv[1])))
+s.listen(1)
+time.sleep(5)
+"""
+
+
+@pytest.fixture(autouse=True)
+def _strict_selector(monkeypatch):
+    monkeypatch.setattr(slipscan_cli.selectors, "DefaultSelector", _StrictSelector)
+
+
+def test_refused_connects_wait_without_selecting():
+    port = _unused_port()
+    proc = _spawn(_LISTEN_LATE, port)
+    try:
+        ok, sock = slipscan_cli._wait_ready(proc, port, 5.0)
+        assert ok
+        if sock is not None:
+            sock.close()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_timeout_with_nothing_registered():
+    port = _unused_port()
+    proc = _spawn("import time; time.sleep(5)", port)
+    try:
+        t0 = time.monotonic()
+        assert slipscan_cli._wait_ready(proc, port, 0.3) == (False, None)
+        assert time.monotonic() - t0 < 2.0
+    finally:
+        proc.kill()
+        proc.wait()